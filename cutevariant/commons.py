@@ -9,6 +9,55 @@
 MAX_RECENT_PROJECTS = 5
 MIN_COMPLETION_LETTERS = 1
 DEFAULT_SELECTION_NAME = "variants"
+# Number of variants inserted at once during an import
+DEFAULT_BATCH_SIZE = 10000
+# Metadatas keys used to resume an interrupted import:
+# Number of variants of the file already processed; settings of the import
+# (json object with the samples whose genotypes are imported, the mode and the
+# id of the first variant inserted by the import)
+IMPORT_CHECKPOINT_KEY = "import_checkpoint"
+IMPORT_SETTINGS_KEY = "import_settings"
+# Metadatas key of the position of the checkpoint in the file (json object with
+# the offset of the record of the last processed variant, the number of
+# variants of this record already processed and the key of the last variant)
+IMPORT_OFFSET_KEY = "import_offset"
+# Key of the variants with the offset of their record in the uncompressed file
+# (set by readers that can seek to a record; see AbstractReader.set_start_offset)
+RECORD_OFFSET_KEY = "record_offset"
+# Metadatas key of the settings of the dictionary encoding of annotations
+# (json object with the encoded fields and the threshold)
+ANNOTATION_DICTIONARY_KEY = "annotation_dictionary"
+# Reasons of the rejection of variants during imports (rejected_variants table)
+REJECTED_DUPLICATE = "duplicate"
+REJECTED_MISSING_KEY = "missing key"
+# Metadatas key of the number of writes in the project (variants, selections,
+# wordsets); results of queries cached with another number are obsolete
+WRITE_COUNTER_KEY = "write_counter"
+# Maximum size of the results cached in query_cache table (bytes)
+QUERY_CACHE_SIZE = 32 * 1024 * 1024
+# Suffix of the sidecar database of a project with its cached data
+CACHE_STORE_SUFFIX = ".cache"
+# Index advisor: maximum size of the indexes it creates (bytes), minimum number
+# of queries on the same fields and minimum duration of recorded queries (s)
+INDEX_ADVISOR_BUDGET = 256 * 1024 * 1024
+INDEX_ADVISOR_MIN_COUNT = 3
+INDEX_ADVISOR_MIN_DURATION = 0.05
+# Text fields indexed by FTS5 trigram tables at import (by table); metadatas key
+# of the indexed fields (json object)
+FTS_FIELDS = {
+    "variants": ("comment",),
+    "annotations": ("gene", "transcript", "hgvs_c", "hgvs_p"),
+}
+FTS_KEY = "fts_fields"
+# SQLite settings used during bulk loads of variants
+# (cache_size in KiB when negative: 512 MiB)
+BULK_LOAD_PRAGMAS = {
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+    "cache_size": -524288,
+    "temp_store": "MEMORY",
+    "foreign_keys": "OFF",
+}
 # version from which database files are supported (included)
 MIN_AUTHORIZED_DB_VERSION = "0.2.0"
 
@@ -139,10 +188,31 @@ def is_gz_file(filepath):
         return test_f.read(3) == b"\x1f\x8b\x08"
 
 
-def get_uncompressed_size(filepath):
-    """Get the size of the given compressed file
-    This size is stored in the last 4 bytes of the file.
+def get_bgzf_block_size(file_obj):
+    """Return the size of the BGZF block at the current position of the file
+
+    A BGZF file (written by bgzip) is a series of gzip members of at most
+    64 KiB of uncompressed data; the total size of each member is stored
+    in the "BC" subfield of its header.
+
+    :param file_obj: File opened in binary mode; the position is not restored.
+    :return: Compressed size of the block in bytes, or None if the block is
+        not a BGZF block (or if the end of the file is reached).
     """
-    with open(filepath, "rb") as file_obj:
-        file_obj.seek(-4, 2)
-        return int.from_bytes(file_obj.read(4), byteorder="little")
+    header = file_obj.read(12)
+    if len(header) < 12 or header[:4] != b"\x1f\x8b\x08\x04":
+        # No gzip magic or no FEXTRA flag
+        return None
+
+    extra_length = int.from_bytes(header[10:12], byteorder="little")
+    extra = file_obj.read(extra_length)
+    # Browse subfields: SI1, SI2, SLEN (2 bytes), data
+    offset = 0
+    while offset + 4 <= len(extra):
+        subfield_length = int.from_bytes(extra[offset + 2 : offset + 4], "little")
+        if extra[offset : offset + 2] == b"BC" and subfield_length == 2:
+            return int.from_bytes(extra[offset + 4 : offset + 6], "little") + 1
+        offset += 4 + subfield_length
+    return None
+
+
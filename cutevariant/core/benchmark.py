@@ -0,0 +1,370 @@
+"""Benchmark of the import of synthetic VCF files
+
+Deterministic VCF files are generated with a given number of variants,
+samples, snpEff annotations per variant and rate of multi-allelic records,
+then imported like with :meth:`cutevariant.core.importer.async_import_file`.
+
+The throughput (variants/s), the time of each stage of the import and the
+peak memory usage of the import are reported; results can be saved as JSON
+to compare the performances of successive versions.
+
+Each import runs in a new process: its peak memory usage doesn't include
+the memory used by the previous runs, the generation of the file or the
+caller.
+
+Stages of an import:
+
+    - setup: project creation, tables, fields and samples
+    - parse: parsing of the file (including annotations)
+    - extra_fields: computation of extra fields (genotype counters, etc.)
+    - insert: insertion of variants in the database
+    - index: creation of indexes
+
+Example::
+
+    >>> results = benchmark_import(variants=10000, samples=10, repeat=3)
+    >>> save_results(results, "import_benchmark.json")
+
+.. note:: With more than 1 process, variants are parsed and extra fields are
+    computed in worker processes: their time is reported in the `parse`
+    stage; `extra_fields` is None.
+"""
+# Standard imports
+import os
+import sys
+import json
+import time
+import random
+import platform
+import tempfile
+import functools
+import multiprocessing
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+
+# Custom imports
+from cutevariant import __version__
+from cutevariant.core import sql
+from cutevariant.core.importer import async_import_reader
+from cutevariant.core.readerfactory import create_reader
+import cutevariant.commons as cm
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # Not available on Windows
+    resource = None
+
+LOGGER = cm.logger()
+
+# Parameters of generated files
+DEFAULT_VARIANT_COUNT = 10000
+DEFAULT_SAMPLE_COUNT = 2
+DEFAULT_ANNOTATION_COUNT = 2
+DEFAULT_MULTIALLELIC_RATE = 0.1
+
+# First progress messages of each stage (see async_import_reader)
+STAGE_MESSAGES = {
+    "Insertings variants...": "insert",
+    "Restoring settings and checking foreign keys...": "bulk",
+    "Creating indexes...": "index",
+}
+
+VCF_HEADER = """##fileformat=VCFv4.2
+##source=cutevariant-benchmark
+##SnpEffVersion="4.3t (synthetic)"
+##INFO=<ID=DP,Number=1,Type=Integer,Description="Total read depth">
+##INFO=<ID=ANN,Number=.,Type=String,Description="Functional annotations: 'Allele | Annotation | Annotation_Impact | Gene_Name | Gene_ID | Feature_Type | Feature_ID | Transcript_BioType | Rank | HGVS.c | HGVS.p | cDNA.pos / cDNA.length | CDS.pos / CDS.length | AA.pos / AA.length | Distance | ERRORS / WARNINGS / INFO' ">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">
+##FORMAT=<ID=GQ,Number=1,Type=Integer,Description="Genotype quality">
+"""
+
+CONSEQUENCES = (
+    ("missense_variant", "MODERATE"),
+    ("synonymous_variant", "LOW"),
+    ("stop_gained", "HIGH"),
+    ("intron_variant", "MODIFIER"),
+    ("upstream_gene_variant", "MODIFIER"),
+    ("downstream_gene_variant", "MODIFIER"),
+)
+
+
+def generate_vcf(
+    filepath,
+    variants=DEFAULT_VARIANT_COUNT,
+    samples=DEFAULT_SAMPLE_COUNT,
+    annotations=DEFAULT_ANNOTATION_COUNT,
+    multiallelic_rate=DEFAULT_MULTIALLELIC_RATE,
+    seed=0,
+):
+    """Write a synthetic VCF file annotated by snpEff
+
+    The same parameters always produce the same file.
+
+    :param filepath: Path of the VCF file.
+    :key variants: Number of records.
+    :key samples: Number of samples.
+    :key annotations: Number of annotations (transcripts) per record.
+    :key multiallelic_rate: Fraction of records with 2 alternative alleles.
+    :key seed: Seed of the random generator.
+    :return: Number of variants (1 per alternative allele).
+    :rtype: <int>
+    """
+    rng = random.Random(seed)
+    variant_count = 0
+    pos = 0
+    with open(filepath, "w") as file:
+        file.write(VCF_HEADER)
+        file.write(
+            "\t".join(
+                ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO"]
+                + ["FORMAT"]
+                + [f"SAMPLE{index}" for index in range(1, samples + 1)]
+            )
+            + "\n"
+        )
+
+        for _ in range(variants):
+            pos += rng.randint(1, 200)
+            ref = rng.choice("ACGT")
+            alts = rng.sample([base for base in "ACGT" if base != ref], 2)
+            if rng.random() >= multiallelic_rate:
+                alts = alts[:1]
+            variant_count += len(alts)
+
+            ann = ",".join(
+                "|".join(
+                    [alt, *rng.choice(CONSEQUENCES)]
+                    + [f"GENE{pos % 97}", f"ENSG{pos % 97:011}", "transcript"]
+                    + [f"ENST{pos:08}.{index}", "protein_coding", f"{index + 1}/10"]
+                    + [f"c.{pos}{ref}>{alt}", "", "", "", "", "", ""]
+                )
+                for alt in alts
+                for index in range(annotations)
+            )
+
+            genotypes = []
+            for _ in range(samples):
+                alleles = sorted(rng.choice(range(len(alts) + 1)) for _ in range(2))
+                genotypes.append(
+                    f"{alleles[0]}/{alleles[1]}:{rng.randint(5, 100)}:{rng.randint(1, 99)}"
+                )
+
+            file.write(
+                "\t".join(
+                    ["chr1", str(pos), ".", ref, ",".join(alts), "50", "PASS"]
+                    + [f"DP={rng.randint(10, 1000)};ANN={ann}", "GT:DP:GQ"]
+                    + genotypes
+                )
+                + "\n"
+            )
+
+    return variant_count
+
+
+def get_peak_rss():
+    """Return the peak resident set size of the current process in bytes
+
+    On Linux, the peak of the address space of the process (VmHWM) is used:
+    unlike `ru_maxrss`, it is not inherited from the parent process when a
+    new program is executed. The peak is never reset: see
+    :meth:`run_isolated_import_benchmark` to measure an import alone.
+
+    :return: Size in bytes; None if the platform doesn't support it.
+    :rtype: <int>
+    """
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    # Kilobytes
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageTimer:
+    """Accumulate the time spent in the generators of a reader
+
+    Nested generators are timed separately: the time of a generator includes
+    the time of the generators it consumes.
+    """
+
+    def __init__(self):
+        self.timings = {}
+
+    def wrap(self, name, func):
+        """Return a function that times the generator returned by func"""
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            iterator = iter(func(*args, **kwargs))
+            self.timings.setdefault(name, 0.0)
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    self.timings[name] += time.perf_counter() - start
+                    return
+                self.timings[name] += time.perf_counter() - start
+                yield item
+
+        return wrapper
+
+
+def run_import_benchmark(filepath, db_path, **kwargs):
+    """Import the given file and measure the import
+
+    The import is the same as :meth:`cutevariant.core.importer.async_import_file`;
+    the generators of variants of the reader are timed.
+
+    :param filepath: Path of the file to import.
+    :param db_path: Path of the database; an existing file is replaced.
+    :key kwargs: Options of :meth:`cutevariant.core.importer.async_import_file`
+        (batch_size, processes, fast_parser, bulk, etc.).
+    :return: Number of variants, elapsed time, throughput, time of each stage
+        and peak memory usage of the process (worker processes excluded).
+    :rtype: <dict>
+    """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    processes = kwargs.pop("processes", 1)
+    fast_parser = kwargs.pop("fast_parser", False)
+    timer = StageTimer()
+    conn = sql.get_sql_connection(db_path)
+
+    stage_starts = [("setup", time.perf_counter())]
+    try:
+        with create_reader(
+            filepath, processes=processes, fast_parser=fast_parser
+        ) as reader:
+            if processes == 1:
+                reader.get_variants = timer.wrap("parse", reader.get_variants)
+            reader.get_extra_variants = timer.wrap(
+                "extra_variants", reader.get_extra_variants
+            )
+
+            for _, message in async_import_reader(conn, reader, **kwargs):
+                if message in STAGE_MESSAGES:
+                    stage_starts.append((STAGE_MESSAGES[message], time.perf_counter()))
+
+        end = time.perf_counter()
+        variant_count = sql.get_variants_count(conn)
+    finally:
+        conn.close()
+
+    # Wall clock time of each stage
+    stages = {"setup": 0.0, "insert": 0.0, "bulk": 0.0, "index": 0.0}
+    for (stage, start), (_, stop) in zip(
+        stage_starts, stage_starts[1:] + [(None, end)]
+    ):
+        stages[stage] += stop - start
+
+    # Generators of variants are consumed during the insertion
+    extra_variants = timer.timings.get("extra_variants", 0.0)
+    parse = timer.timings.get("parse")
+    stages["insert"] -= extra_variants
+    if parse is None:
+        # Parsed in worker processes
+        stages["parse"], stages["extra_fields"] = extra_variants, None
+    else:
+        stages["parse"], stages["extra_fields"] = parse, extra_variants - parse
+
+    elapsed = end - stage_starts[0][1]
+    return {
+        "variants": variant_count,
+        "elapsed": elapsed,
+        "variants_per_second": variant_count / elapsed if elapsed else None,
+        "stages": stages,
+        "peak_rss": get_peak_rss(),
+    }
+
+
+def run_isolated_import_benchmark(filepath, db_path, **kwargs):
+    """Run :meth:`run_import_benchmark` in a new process
+
+    The process is spawned (not forked) so that its peak memory usage is the
+    one of the import only.
+
+    :return: Results of :meth:`run_import_benchmark`.
+    :rtype: <dict>
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        future = executor.submit(run_import_benchmark, filepath, db_path, **kwargs)
+        return future.result()
+
+
+def benchmark_import(
+    variants=DEFAULT_VARIANT_COUNT,
+    samples=DEFAULT_SAMPLE_COUNT,
+    annotations=DEFAULT_ANNOTATION_COUNT,
+    multiallelic_rate=DEFAULT_MULTIALLELIC_RATE,
+    seed=0,
+    repeat=1,
+    directory=None,
+    **kwargs,
+):
+    """Generate a synthetic VCF file and import it `repeat` times
+
+    Each import runs in a new process (see :meth:`run_isolated_import_benchmark`).
+
+    :key variants: Number of records of the file.
+    :key samples: Number of samples.
+    :key annotations: Number of annotations per record.
+    :key multiallelic_rate: Fraction of records with 2 alternative alleles.
+    :key seed: Seed of the random generator.
+    :key repeat: Number of imports.
+    :key directory: Directory of the VCF file and of the database
+        (default: temporary directory removed afterwards).
+    :key kwargs: Options of :meth:`cutevariant.core.importer.async_import_file`.
+    :return: Parameters, environment, results of each run and the fastest run.
+    :rtype: <dict>
+    """
+    parameters = {
+        "variants": variants,
+        "samples": samples,
+        "annotations": annotations,
+        "multiallelic_rate": multiallelic_rate,
+        "seed": seed,
+        "repeat": repeat,
+        "import_options": kwargs,
+    }
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        directory = directory or temp_directory
+        filepath = os.path.join(directory, "benchmark.vcf")
+        db_path = os.path.join(directory, "benchmark.db")
+
+        LOGGER.info("benchmark_import: generating %s", filepath)
+        generate_vcf(filepath, variants, samples, annotations, multiallelic_rate, seed)
+        runs = [
+            run_isolated_import_benchmark(filepath, db_path, **kwargs)
+            for _ in range(repeat)
+        ]
+
+    return {
+        "date": dt.datetime.now().isoformat(timespec="seconds"),
+        "cutevariant_version": __version__,
+        "python_version": platform.python_version(),
+        "sqlite_version": sql.sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "parameters": parameters,
+        "runs": runs,
+        "best": min(runs, key=lambda run: run["elapsed"]),
+    }
+
+
+def save_results(results, filepath):
+    """Write the results of :meth:`benchmark_import` in a JSON file"""
+    with open(filepath, "w") as file:
+        json.dump(results, file, indent=2)
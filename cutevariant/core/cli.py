@@ -8,9 +8,14 @@
 import progressbar
 from columnar import columnar
 from cutevariant.core.importer import async_import_file
-from cutevariant.core import sql, vql, command
+from cutevariant.core import sql, vql, command, benchmark, indexadvisor
 from cutevariant.core.querybuilder import *
-from cutevariant.commons import log_level
+from cutevariant.commons import (
+    log_level,
+    DEFAULT_BATCH_SIZE,
+    INDEX_ADVISOR_BUDGET,
+    FTS_FIELDS,
+)
 
 
 def display_sql_results(data, headers, *args, **kwargs):
@@ -42,6 +47,11 @@ def display_query_status(query_result):
     exit(1)
 
 
+def comma_separated_list(value: str) -> list:
+    """Split the given argument on commas (argparse type)"""
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
 def main():
     # noinspection PyTypeChecker
     parser = argparse.ArgumentParser(
@@ -82,9 +92,106 @@ def main():
         epilog="""Examples:
 
         $ cutevariant-cli createdb -i "examples/test.snpeff.vcf"
+        or
+        $ cutevariant-cli createdb -i "examples/test.vcf" --db project.db --append
+        or
+        $ cutevariant-cli createdb -i "examples/test.vcf" --db project.db --resume
         """
     )
     createdb_parser.add_argument("-i", "--input", help="VCF file path", required=True)
+    createdb_parser.add_argument(
+        "-b",
+        "--batch-size",
+        help="Number of variants inserted at once in the database.",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+    )
+    createdb_parser.add_argument(
+        "-p",
+        "--processes",
+        help="Number of processes used to parse the VCF file "
+        "(0: use all available cores).",
+        type=int,
+        default=1,
+    )
+    createdb_parser.add_argument(
+        "--fast-parser",
+        help="Parse the VCF file with the lightweight tokenizer instead of PyVCF.",
+        action="store_true",
+    )
+    createdb_parser.add_argument(
+        "--presorted",
+        help="The transcripts of each variant are on consecutive lines "
+        "of the CSV file; skip the sort.",
+        action="store_true",
+    )
+    createdb_parser.add_argument(
+        "--bulk",
+        help="Speed up insertions with unsafe SQLite settings "
+        "(the database may be corrupted if the import is interrupted).",
+        action="store_true",
+    )
+    createdb_parser.add_argument(
+        "-a",
+        "--append",
+        help="Append the file to an existing database instead of creating it.",
+        action="store_true",
+    )
+    createdb_parser.add_argument(
+        "--packed-genotypes",
+        help="Pack the genotypes of all the samples of each variant in blobs "
+        "(compact storage for large cohorts; only numeric sample fields are kept).",
+        action="store_true",
+    )
+    createdb_parser.add_argument(
+        "--dictionary-threshold",
+        help="Store annotation strings as integer codes for fields with at most "
+        "this number of distinct values (e.g. impact, consequence).",
+        type=int,
+    )
+    createdb_parser.add_argument(
+        "--no-fts",
+        help="Don't create the full-text indexes used to search substrings in "
+        "text fields (gene, transcript, hgvs_c, hgvs_p, comment).",
+        action="store_true",
+    )
+    createdb_parser.add_argument(
+        "--fields",
+        help="Comma separated list of the fields of the file to import; "
+        "a field can be prefixed by its category (e.g. dp,af,samples.gq). "
+        "chr, pos, ref, alt and gt are always imported.",
+        type=comma_separated_list,
+    )
+    createdb_parser.add_argument(
+        "--exclude-fields",
+        help="Comma separated list of the fields of the file not to import.",
+        type=comma_separated_list,
+    )
+    createdb_parser.add_argument(
+        "--samples",
+        help="Comma separated list of the samples to import.",
+        type=comma_separated_list,
+    )
+    createdb_parser.add_argument(
+        "--exclude-samples",
+        help="Comma separated list of the samples not to import.",
+        type=comma_separated_list,
+    )
+    createdb_parser.add_argument(
+        "--where",
+        help="Import only the variants that meet these conditions, written "
+        "like the WHERE clause of a VQL query "
+        "(ex: \"qual > 30 AND impact = 'HIGH'\").",
+    )
+    createdb_parser.add_argument(
+        "--bed", help="Import only the variants in the intervals of this BED file."
+    )
+    createdb_parser.add_argument(
+        "--resume",
+        help="Resume an interrupted import of the file into the database "
+        "from its last checkpoint.",
+        action="store_true",
+    )
 
     # Show parser ##############################################################
     show_parser = sub_parser.add_parser(
@@ -92,7 +199,7 @@ def main():
     )
     show_parser.add_argument(
         "table",
-        choices=["fields", "selections", "samples", "wordsets"],
+        choices=["fields", "selections", "samples", "wordsets", "indexes"],
         help="Possible names of tables.",
     )
 
@@ -102,6 +209,31 @@ def main():
     )
     remove_parser.add_argument("names", nargs="+", help="Name(s) of selection(s).")
 
+    # Index parser #############################################################
+    index_parser = sub_parser.add_parser(
+        "index",
+        help="List, create or drop the indexes suggested by the index advisor.",
+        parents=[parent_parser],
+        epilog="""Examples:
+
+    $ cutevariant-cli index list
+    or
+    $ cutevariant-cli index apply --budget 100
+    or
+    $ cutevariant-cli index drop idx_advisor_annotations_gene
+    """,
+    )
+    index_parser.add_argument("action", choices=["list", "apply", "drop"])
+    index_parser.add_argument(
+        "names", nargs="*", help="Name(s) of index(es) to drop (default: all)."
+    )
+    index_parser.add_argument(
+        "--budget",
+        help="Maximum size of the indexes created by the advisor (MiB).",
+        type=float,
+        default=INDEX_ADVISOR_BUDGET / 2 ** 20,
+    )
+
     # VQL parser ###############################################################
     select_parser = sub_parser.add_parser(
         "exec",
@@ -123,6 +255,8 @@ def main():
     $ cutevariant-cli exec "CREATE myselection3 = myselection2 | myselection2"
     or
     $ cutevariant-cli exec "CREATE boby FROM variants INTERSECT 'examples/test.bed'"
+    or
+    $ cutevariant-cli exec "PROFILE SELECT chr,pos FROM variants WHERE gene = 'CHID1'"
     """,
     )
     select_parser.add_argument("vql", help="A VQL statement.")
@@ -143,6 +277,75 @@ def main():
         "-s", "--to-selection", help="Save SELECT query into a selection name."
     )
 
+    # Benchmark parser #########################################################
+    bench_parser = sub_parser.add_parser(
+        "bench",
+        help="Measure performances on synthetic data.",
+        epilog="""Examples:
+
+    $ cutevariant-cli bench import --variants 100000 --samples 10 -o results.json
+    """,
+    )
+    bench_sub_parser = bench_parser.add_subparsers(dest="benchmark")
+    bench_import_parser = bench_sub_parser.add_parser(
+        "import", help="Import a synthetic VCF file."
+    )
+    bench_import_parser.add_argument(
+        "--variants",
+        help="Number of records of the file.",
+        type=int,
+        default=benchmark.DEFAULT_VARIANT_COUNT,
+    )
+    bench_import_parser.add_argument(
+        "--samples",
+        help="Number of samples.",
+        type=int,
+        default=benchmark.DEFAULT_SAMPLE_COUNT,
+    )
+    bench_import_parser.add_argument(
+        "--annotations",
+        help="Number of annotations per record.",
+        type=int,
+        default=benchmark.DEFAULT_ANNOTATION_COUNT,
+    )
+    bench_import_parser.add_argument(
+        "--multiallelic-rate",
+        help="Fraction of records with 2 alternative alleles.",
+        type=float,
+        default=benchmark.DEFAULT_MULTIALLELIC_RATE,
+    )
+    bench_import_parser.add_argument(
+        "--seed", help="Seed of the random generator.", type=int, default=0
+    )
+    bench_import_parser.add_argument(
+        "--repeat", help="Number of imports.", type=int, default=1
+    )
+    bench_import_parser.add_argument(
+        "-o", "--output", help="JSON file of the results."
+    )
+    bench_import_parser.add_argument(
+        "--batch-size",
+        help="Number of variants inserted at once in the database.",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+    )
+    bench_import_parser.add_argument(
+        "-p",
+        "--processes",
+        help="Number of processes used to parse the VCF file.",
+        type=int,
+        default=1,
+    )
+    bench_import_parser.add_argument(
+        "--fast-parser", help="Use the lightweight tokenizer.", action="store_true"
+    )
+    bench_import_parser.add_argument(
+        "--bulk", help="Use the bulk load mode.", action="store_true"
+    )
+    bench_import_parser.add_argument(
+        "--packed-genotypes", help="Pack the genotypes.", action="store_true"
+    )
+
     # Set parser ###############################################################
     # set_parser = sub_parser.add_parser("set", help="Set variable", parents=[parent_parser])
 
@@ -168,7 +371,11 @@ def main():
             # The output file will be based on the name of the VCF one
             args.db = args.input + ".db"
 
-        if os.path.exists(args.db):
+        if args.append or args.resume:
+            if not os.path.exists(args.db):
+                print("The database must exist to append or resume data:", args.db)
+                exit(1)
+        elif os.path.exists(args.db):
             # Remove existing file
             os.remove(args.db)
 
@@ -176,11 +383,71 @@ def main():
         if conn:
             # TODO: bug ... max is not 100...
             for i, message in progressbar.progressbar(
-                async_import_file(conn, args.input), redirect_stdout=True
+                async_import_file(
+                    conn,
+                    args.input,
+                    batch_size=args.batch_size,
+                    processes=args.processes or os.cpu_count(),
+                    fast_parser=args.fast_parser,
+                    presorted=args.presorted,
+                    bulk=args.bulk,
+                    append=args.append,
+                    resume=args.resume,
+                    packed_genotypes=args.packed_genotypes,
+                    dictionary_threshold=args.dictionary_threshold,
+                    include_fields=args.fields,
+                    exclude_fields=args.exclude_fields,
+                    include_samples=args.samples,
+                    exclude_samples=args.exclude_samples,
+                    filters=args.where,
+                    bed=args.bed,
+                    fts_fields=None if args.no_fts else FTS_FIELDS,
+                ),
+                redirect_stdout=True,
             ):
                 print(message)
 
-        print("The database is successfully created!")
+        if args.append or args.resume:
+            print("The database is successfully updated!")
+        else:
+            print("The database is successfully created!")
+        exit()
+
+    # Benchmark parser #########################################################
+    if args.subparser == "bench":
+        if args.benchmark != "import":
+            bench_parser.print_help(sys.stderr)
+            exit(1)
+
+        results = benchmark.benchmark_import(
+            variants=args.variants,
+            samples=args.samples,
+            annotations=args.annotations,
+            multiallelic_rate=args.multiallelic_rate,
+            seed=args.seed,
+            repeat=args.repeat,
+            batch_size=args.batch_size,
+            processes=args.processes,
+            fast_parser=args.fast_parser,
+            bulk=args.bulk,
+            packed_genotypes=args.packed_genotypes,
+        )
+        for run in results["runs"]:
+            stages = ", ".join(
+                f"{stage}: {elapsed:.2f}s"
+                for stage, elapsed in run["stages"].items()
+                if elapsed is not None
+            )
+            print(
+                f"{run['variants']} variants in {run['elapsed']:.2f}s "
+                f"({run['variants_per_second']:.0f} variants/s; {stages})"
+            )
+        if results["best"]["peak_rss"]:
+            print(f"Peak RSS: {results['best']['peak_rss'] / 2 ** 20:.1f} MiB")
+
+        if args.output:
+            benchmark.save_results(results, args.output)
+            print("Results saved in", args.output)
         exit()
 
     # Prepare SQL connection on DB file
@@ -219,11 +486,39 @@ def main():
                 ["id", "word_count"]
             )
 
+        if args.table == "indexes":
+            display_sql_results(
+                (i.values() for i in indexadvisor.get_indexes(conn)),
+                ["name", "table", "columns", "size", "status"],
+            )
+
     # Remove parser ############################################################
     if args.subparser == "remove":
         for name in args.names:
             sql.delete_selection_by_name(conn, name)
 
+    # Index parser #############################################################
+    if args.subparser == "index":
+        budget = int(args.budget * 2 ** 20)
+        if args.action == "list":
+            display_sql_results(
+                (i.values() for i in indexadvisor.get_indexes(conn)),
+                ["name", "table", "columns", "size", "status"],
+            )
+
+        if args.action == "apply":
+            suggestions = indexadvisor.get_index_suggestions(conn, budget=budget)
+            for name in indexadvisor.apply_index_suggestions(conn, suggestions):
+                print(name, "created")
+
+        if args.action == "drop":
+            names = args.names or [
+                index["name"] for index in indexadvisor.get_advisor_indexes(conn)
+            ]
+            for name in names:
+                if not indexadvisor.drop_advisor_index(conn, name):
+                    print(name, "is not an index of the advisor")
+
     # VQL parser ###############################################################
     if args.subparser == "exec":
         query = "".join(args.vql)
@@ -266,6 +561,11 @@ def main():
         LOGGER.debug("VQL command: %s", cmd["cmd"])
         # Note: show_cmd is supported in a separated command option
 
+        # Explain command: SQL query, query plan and timings
+        if cmd["cmd"] == "explain_cmd":
+            print(command.explain_to_text(ret))
+            exit(1)
+
         # Select command
         if cmd["cmd"] in ("select_cmd",) and not args.to_selection:
             display_sql_results((i.values() for i in ret), ["id"] + cmd["fields"])
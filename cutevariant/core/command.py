@@ -21,18 +21,21 @@
 import sqlite3
 import os
 import functools
-
-# Pip install ( because functools doesnt work with unhachable)
-from memoization import cached
+import time
+import json
 
 # Custom imports
 from cutevariant.core.querybuilder import build_sql_query, build_full_sql_query
-from cutevariant.core import sql, vql
+from cutevariant.core import sql, vql, indexadvisor
 from cutevariant.commons import logger
 from cutevariant.core.reader import BedReader
 
 LOGGER = logger()
 
+# Approximate counts: number of variants sampled and number of id ranges
+COUNT_SAMPLE_SIZE = 10000
+COUNT_SAMPLE_RANGES = 10
+
 
 def select_cmd(
     conn: sqlite3.Connection,
@@ -45,6 +48,9 @@ def select_cmd(
     having={},  # {"op":">", "value": 3  }
     limit=50,
     offset=0,
+    keyset=False,
+    cursor=None,
+    backward=False,
     **kwargs,
 ):
     """Select query Command
@@ -63,10 +69,26 @@ def select_cmd(
         order_desc (bool, optional): Descending or Ascending Order
         limit (int, optional): record count
         offset (int, optional): record count per page
+        keyset (bool, optional): Sort variants in a unique order to page them
+            with cursors instead of OFFSET
+        cursor (tuple, optional): Position of the last variant of the
+            previous page (keyset pagination); variants after it are returned.
+            See :meth:`cutevariant.core.querybuilder.get_keyset_cursor`.
+        backward (bool, optional): Return the variants before the cursor
+            (previous page)
 
     Yields:
         variants (dict)
+
+    Examples:
+        Read the next page after the last variant of the current one::
+
+            keyset_fields = get_keyset_fields(fields, order_by, default_tables)
+            cursor = get_keyset_cursor(variants[-1], keyset_fields)
+            select_cmd(conn, fields, order_by=order_by, cursor=cursor)
     """
+    # Values of the cursor are bound to the query
+    params = {}
     query = build_full_sql_query(
         conn,
         fields=fields,
@@ -78,19 +100,48 @@ def select_cmd(
         offset=offset,
         group_by=group_by,
         having=having,
+        keyset=keyset,
+        cursor=cursor,
+        backward=backward,
+        params=params,
         **kwargs,
     )
-    LOGGER.debug("command:select_cmd:: %s", query)
-    for i in conn.execute(query):
-        # THIS IS INSANE... SQLITE DOESNT RETURN ALIAS NAME WITH SQUARE BRACKET....
-        # I HAVE TO replace [] by () and go back after...
-        # TODO : Change VQL Syntax from [] to () would be a good alternative
-        # @See QUERYBUILDER
-        # See : https://stackoverflow.com/questions/41538952/issue-cursor-description-never-returns-square-bracket-in-column-name-python-2-7-sqlite3-alias
-        yield {k.replace("(", "[").replace(")", "]"): v for k, v in dict(i).items()}
+    LOGGER.debug("command:select_cmd:: %s %s", query, params)
+    # Pages of variants are cached in the store of the project
+    cache_key = f"{query} -- {json.dumps(params, sort_keys=True)}" if params else query
+    if limit:
+        variants = sql.get_cached_result(conn, cache_key)
+        if variants is not None:
+            LOGGER.debug("command:select_cmd:: cached in query_cache table")
+            yield from variants
+            return
+
+    start = time.perf_counter()
+    rows = conn.execute(query, params)
+    if backward:
+        # Rows before the cursor are read in reverse order
+        rows = reversed(rows.fetchall())
+    # THIS IS INSANE... SQLITE DOESNT RETURN ALIAS NAME WITH SQUARE BRACKET....
+    # I HAVE TO replace [] by () and go back after...
+    # TODO : Change VQL Syntax from [] to () would be a good alternative
+    # @See QUERYBUILDER
+    # See : https://stackoverflow.com/questions/41538952/issue-cursor-description-never-returns-square-bracket-in-column-name-python-2-7-sqlite3-alias
+    variants = (
+        {k.replace("(", "[").replace(")", "]"): v for k, v in dict(i).items()}
+        for i in rows
+    )
+    if not limit:
+        yield from variants
+        return
+
+    variants = list(variants)
+    indexadvisor.record_query(
+        conn, filters, time.perf_counter() - start, order_by=order_by
+    )
+    sql.cache_result(conn, cache_key, variants)
+    yield from variants
 
 
-@cached(max_size=128)
 def count_cmd(
     conn: sqlite3.Connection,
     fields=["chr", "pos", "ref", "alt"],
@@ -98,6 +149,7 @@ def count_cmd(
     filters={},
     group_by=[],
     having={},
+    approximate=False,
     **kwargs,
 ):
     """Count command
@@ -111,9 +163,19 @@ def count_cmd(
         conn (sqlite3.Connection): sqlite3 connection
         source (str, optional): virtual source table
         filters (dict, optional): nested tree of condition
+        approximate (bool, optional): Return an estimate of the count if the
+            exact count is expensive (annotations, filters on large
+            sources); the estimate is refined by a call without this flag.
+            See :meth:`estimate_count`.
 
     Returns:
-        dict: Count of variants wgstith "count" as a key
+        dict: Count of variants wgstith "count" as a key; "approximate" key
+            is True if the count is an estimate.
+
+    Note:
+        Exact counts are cached in the store of the project until the next
+        modification of the data.
+        See :meth:`cutevariant.core.sql.cache_result`.
     """
     # See #177: Check if fields has annotations
     # If an annotation field is selected, the variant count stored in the selection
@@ -151,7 +213,92 @@ def count_cmd(
     # @See QUERYBUILDER
     # See : https://stackoverflow.com/questions/41538952/issue-cursor-description-never-returns-square-bracket-in-column-name-python-2-7-sqlite3-alias
     LOGGER.debug("command:count_cmd:: %s", query)
-    return {"count": sql.count_query(conn, query)}
+    cache_key = f"SELECT COUNT(*) FROM ({query})"
+    result = sql.get_cached_result(conn, cache_key)
+    if result is not None:
+        LOGGER.debug("command:count_cmd:: cached in query_cache table")
+        return result
+
+    if approximate and not group_by:
+        # Groups can't be estimated from samples of variants
+        count = estimate_count(conn, fields, source, filters, **kwargs)
+        if count is not None:
+            return {"count": count, "approximate": True}
+
+    start = time.perf_counter()
+    result = {"count": sql.count_query(conn, query)}
+    indexadvisor.record_query(conn, filters, time.perf_counter() - start)
+    sql.cache_result(conn, cache_key, result)
+    return result
+
+
+def estimate_count(
+    conn: sqlite3.Connection,
+    fields=["chr", "pos", "ref", "alt"],
+    source="variants",
+    filters={},
+    sample_size=COUNT_SAMPLE_SIZE,
+    ranges=COUNT_SAMPLE_RANGES,
+    **kwargs,
+):
+    """Estimate the number of rows of a query from samples of variants
+
+    The query is counted on ranges of variants ids spread over the whole
+    table (SQLite reads only these ranges of rowids); the proportion of
+    matching rows in the sampled variants of the source is extrapolated to
+    the variant count of the source (stored in selections table).
+
+    Args:
+        conn (sqlite3.Connection): sqlite3 connection
+        fields (list, optional): list of fields
+        source (str, optional): virtual source table
+        filters (dict, optional): nested tree of condition
+        sample_size (int, optional): Number of variants ids sampled
+        ranges (int, optional): Number of ranges of ids
+
+    Returns:
+        int: Estimated count; None if the source is small enough to be counted
+        exactly.
+    """
+    total = conn.execute(
+        "SELECT count FROM selections WHERE name = ?", (source,)
+    ).fetchone()[0]
+    if total <= sample_size:
+        return None
+
+    min_id, max_id = conn.execute("SELECT MIN(id), MAX(id) FROM variants").fetchone()
+    width = max(sample_size // ranges, 1)
+    step = (max_id - min_id + 1) / ranges
+
+    sampled_count = matching_count = 0
+    for index in range(ranges):
+        start = min_id + int(index * step)
+        id_filters = [
+            {"field": "variants.id", "operator": ">=", "value": start},
+            {"field": "variants.id", "operator": "<", "value": start + width},
+        ]
+        query_kwargs = {"limit": None, "offset": None, "order_by": None, **kwargs}
+        query = build_full_sql_query(
+            conn,
+            fields=fields,
+            source=source,
+            filters={"AND": id_filters + ([filters] if filters else [])},
+            **query_kwargs,
+        )
+        matching_count += sql.count_query(conn, query)
+        query = build_full_sql_query(
+            conn, fields=[], source=source, filters={"AND": id_filters}, **query_kwargs
+        )
+        sampled_count += sql.count_query(conn, query)
+
+    if not sampled_count:
+        return None
+    LOGGER.debug(
+        "command:estimate_count:: %s rows in %s sampled variants",
+        matching_count,
+        sampled_count,
+    )
+    return round(matching_count * total / sampled_count)
 
 
 def drop_cmd(conn: sqlite3.Connection, feature: str, name: str, **kwargs):
@@ -161,17 +308,20 @@ def drop_cmd(conn: sqlite3.Connection, feature: str, name: str, **kwargs):
 
         DROP selections boby
         DROP wordsets mygene
+        DROP indexes idx_advisor_annotations_gene
 
     will execute::
 
         drop_cmd(conn, "selections", "boby")
         drop_cmd(conn, "wordsets", "boby")
+        drop_cmd(conn, "indexes", "idx_advisor_annotations_gene")
 
     Args:
         conn (sqlite3.Connection): sqlite connection
-        feature (str): selections or wordsets (Names of the SQL tables).
+        feature (str): selections, wordsets (Names of the SQL tables) or
+            indexes (only indexes created by the index advisor).
             Lower case features are also accepted.
-        name (str): name of the selection or name of the wordset
+        name (str): name of the selection, of the wordset or of the index
 
     Returns:
         dict: {"success": <boolean>}; True if deletion is ok, False otherwise.
@@ -179,7 +329,7 @@ def drop_cmd(conn: sqlite3.Connection, feature: str, name: str, **kwargs):
     Raises:
         vql.VQLSyntaxError
     """
-    accept_features = ("selections", "wordsets")
+    accept_features = ("selections", "wordsets", "indexes")
 
     # Cast to lower case
     feature = feature.lower()
@@ -187,6 +337,9 @@ def drop_cmd(conn: sqlite3.Connection, feature: str, name: str, **kwargs):
     if feature not in accept_features:
         raise vql.VQLSyntaxError(f"{feature} doesn't exists")
 
+    if feature == "indexes":
+        return {"success": indexadvisor.drop_advisor_index(conn, name)}
+
     affected_lines = sql.delete_by_name(conn, name, table_name=feature)
     return {"success": (affected_lines > 0)}
 
@@ -307,7 +460,10 @@ def bed_cmd(conn: sqlite3.Connection, path: str, target: str, source: str, **kwa
 
     # bed_intervals: chrom, start, end, name, etc. keys in each interval
     # see also cutevariant/core/reader/bedreader.py
-    selection_id = sql.create_selection_from_bed(conn, source, target, BedReader(path))
+    # Sort-merge sweep: linear time, memory independent of the BED size
+    selection_id = sql.create_selection_from_sorted_bed(
+        conn, source, target, BedReader(path)
+    )
     return dict() if selection_id is None else {"id": selection_id}
 
 
@@ -323,7 +479,8 @@ def show_cmd(conn: sqlite3.Connection, feature: str, **kwargs):
         conn (sqlite3.Connection): sqlite3 connection
         feature (str): Requested feature type of items (Name of the SQL table);
             Lower case features are also accepted.
-        can be: `"selections", "fields", "samples", "wordsets"`
+        can be: `"selections", "fields", "samples", "wordsets", "indexes"`
+            (indexes created and suggested by the index advisor)
 
     Yields:
         (generator[dict]): Items according to requested feature.
@@ -336,6 +493,7 @@ def show_cmd(conn: sqlite3.Connection, feature: str, **kwargs):
         "fields": sql.get_fields,
         "samples": sql.get_samples,
         "wordsets": sql.get_wordsets,
+        "indexes": indexadvisor.get_indexes,
     }
 
     # Cast in lower case
@@ -380,6 +538,103 @@ def import_cmd(conn: sqlite3.Connection, feature=str, name=str, path=str, **kwar
     return {"success": (affected_rows is not None)}
 
 
+def explain_cmd(conn: sqlite3.Connection, statement: str, profile=False, **kwargs):
+    """Explain command: SQL query and query plan of a SELECT or COUNT statement
+
+    This following VQL command:
+        `PROFILE SELECT chr,pos FROM variants WHERE pos > 3`
+    will execute :
+        `explain_cmd(conn, "SELECT chr,pos FROM variants WHERE pos > 3", True)`
+
+    The statement is parsed and its SQL query is built as by :meth:`select_cmd`
+    and :meth:`count_cmd`. With `profile`, the query is also executed;
+    results cached in the store of the project are not used.
+
+    Args:
+        conn (sqlite3.Connection): sqlite3 connection
+        statement (str): VQL statement (SELECT or COUNT)
+        profile (bool, optional): Execute the query and time its execution
+
+    Returns:
+        dict: `statement`; `sql`: executed SQL query; `plan`: steps of the
+            query plan (see :meth:`cutevariant.core.sql.get_query_plan`);
+            `timings`: durations in seconds of `parse`, `build` and with
+            `profile`, `execute` (until the first row) and `fetch` (other
+            rows); `count`: number of rows returned (with `profile`).
+
+    Raises:
+        vql.VQLSyntaxError
+    """
+    timings = dict()
+    start = time.perf_counter()
+    vql_obj = vql.parse_one_vql(statement)
+    timings["parse"] = time.perf_counter() - start
+
+    cmd = vql_obj.pop("cmd")
+    if cmd not in ("select_cmd", "count_cmd"):
+        raise vql.VQLSyntaxError(f"{cmd} can't be explained")
+
+    start = time.perf_counter()
+    if cmd == "select_cmd":
+        query = build_full_sql_query(conn, **vql_obj)
+    else:
+        query = build_full_sql_query(
+            conn, limit=None, offset=None, order_by=None, **vql_obj
+        )
+        query = f"SELECT COUNT(*) as count FROM ({query})"
+    timings["build"] = time.perf_counter() - start
+
+    result = {
+        "statement": statement,
+        "sql": query,
+        "plan": sql.get_query_plan(conn, query),
+        "timings": timings,
+    }
+    if not profile:
+        return result
+
+    start = time.perf_counter()
+    # The first row is computed by execute()
+    rows = conn.execute(query)
+    timings["execute"] = time.perf_counter() - start
+    start = time.perf_counter()
+    rows = rows.fetchall()
+    timings["fetch"] = time.perf_counter() - start
+    result["count"] = rows[0][0] if cmd == "count_cmd" else len(rows)
+    return result
+
+
+def explain_to_text(result: dict):
+    """Return the result of :meth:`explain_cmd` as text
+
+    The plan is drawn as a tree (as by the sqlite3 shell); durations are in
+    milliseconds.
+
+    Args:
+        result (dict): Result of explain_cmd
+
+    Returns:
+        str: Lines of the SQL query, the query plan and the timings
+    """
+    lines = [result["sql"], "", "QUERY PLAN"]
+    # Last child of each step, and prefix of the children of each step
+    last_children = {step["parent"]: step["id"] for step in result["plan"]}
+    prefixes = dict()
+    for step in result["plan"]:
+        prefix = prefixes.get(step["parent"], "")
+        is_last = last_children[step["parent"]] == step["id"]
+        lines.append(prefix + ("`--" if is_last else "|--") + step["detail"])
+        prefixes[step["id"]] = prefix + ("   " if is_last else "|  ")
+    lines.append("")
+    lines.extend(
+        "%-8s %10.3f ms" % (stage + ":", duration * 1000)
+        for stage, duration in result["timings"].items()
+    )
+    if "count" in result:
+        lines.append("%-8s %10d" % ("count:", result["count"]))
+    return "\n".join(lines)
+
+
 def create_command_from_obj(conn, vql_obj: dict):
     """Create command function from vql object according to its "cmd" key
 
@@ -393,6 +648,7 @@ def create_command_from_obj(conn, vql_obj: dict):
         - bed_cmd
         - show_cmd
         - import_cmd
+        - explain_cmd
 
     Warning:
         Use :meth:`execute` instead, that is a wrapper to this function.
@@ -413,7 +669,7 @@ def create_command_from_obj(conn, vql_obj: dict):
         conn (sqlite3.Connection): sqlite3.connection
         vql_obj (dict): A VQL object with requested commands at "cmd" key:
             `select_cmd, create_cmd, set_cmd, bed_cmd, show_cmd, import_cmd,
-            drop_cmd, count_cmd`.
+            drop_cmd, count_cmd, explain_cmd`.
             A VQL object is dictionary returned by vql.parse.
 
     Returns:
@@ -468,11 +724,13 @@ def execute_all(conn: sqlite3.Connection, vql_source: str):
 
 
 def clear_cache_cmd():
-    """Clear function cache by memoization module.
+    """Clear the caches of the process
 
-    This method must be called when new project is open
+    This method must be called when new project is open.
+    Results cached in the store of the project are kept; they are checked
+    against the write counter of the project.
     """
-    count_cmd.cache_clear()
+    sql.read_write_counter.cache_clear()
 
 
 # class CommandGraph(object):
@@ -0,0 +1,150 @@
+"""Compact storage of genotypes in blobs
+
+In "packed" projects, the genotypes of all the samples of a variant are
+stored in one row of the "genotypes" table instead of one row per sample in
+the "sample_has_variant" table:
+
+- `gt` codes are packed on 2 bits per sample (4 samples per byte):
+  0 = not called (-1), 1 = homozygous_ref (0), 2 = heterozygous (1),
+  3 = homozygous_alt (2).
+- Numeric sample fields (DP, GQ, etc.) are packed as arrays of little endian
+  32 bits integers or floats; missing values are stored as
+  :data:`INT_MISSING` or NaN.
+
+Values of a sample are at the index `samples.id - 1` of the arrays;
+samples beyond the end of an array (i.e. samples added to the project after
+the variant) have missing values.
+
+Blobs are decoded in SQL queries by functions registered on the connection
+(see :meth:`register_functions`)::
+
+    SELECT genotype_gt(genotypes.gt, 0), genotype_int(genotypes.dp, 0)
+    FROM variants LEFT JOIN genotypes ON genotypes.variant_id = variants.id
+"""
+# Standard imports
+import math
+import struct
+from array import array
+import sys
+
+# Missing value of packed integers
+INT_MISSING = -(2 ** 31)
+
+# Sample fields types that can be packed and their array typecodes
+PACKED_TYPES = {"int": "i", "float": "f"}
+
+# SQL functions used to decode each type of packed field
+SQL_DECODERS = {"gt": "genotype_gt", "int": "genotype_int", "float": "genotype_float"}
+
+
+def sample_index(sample_id: int) -> int:
+    """Return the index of the values of the given sample in the blobs"""
+    return sample_id - 1
+
+
+def is_packable(field: dict) -> bool:
+    """Return True if the given sample field can be stored in the genotypes table
+
+    Fields with multiple values (the "number" of values given by the reader is
+    not 1; e.g. AD: "64,0") can't be packed.
+    """
+    if field.get("number", 1) != 1:
+        return False
+    return field["name"] == "gt" or field["type"] in PACKED_TYPES
+
+
+def pack_gt(genotypes: dict, blob: bytes = None) -> bytes:
+    """Pack gt codes
+
+    :param genotypes: Sample indexes as keys, gt codes (-1, 0, 1, 2) as values.
+    :key blob: Packed gt codes updated with the given ones.
+    :return: 2 bits per sample.
+    """
+    data = bytearray(blob or b"")
+    size = (max(genotypes, default=-1) + 4) // 4
+    if size > len(data):
+        data.extend(bytes(size - len(data)))
+
+    for index, gt in genotypes.items():
+        code = gt + 1 if gt in (0, 1, 2) else 0
+        shift = (index & 3) * 2
+        data[index >> 2] = (data[index >> 2] & ~(3 << shift)) | (code << shift)
+    return bytes(data)
+
+
+def pack_values(values: dict, field_type: str, blob: bytes = None) -> bytes:
+    """Pack numeric values
+
+    :param values: Sample indexes as keys, values of a field as values.
+    :param field_type: "int" or "float"
+    :key blob: Packed values updated with the given ones.
+    :return: Array of 4 bytes numbers.
+    """
+    typecode = PACKED_TYPES[field_type]
+    missing = INT_MISSING if field_type == "int" else math.nan
+
+    data = array(typecode)
+    if blob:
+        data.frombytes(blob)
+        if sys.byteorder == "big":
+            data.byteswap()
+
+    size = max(values, default=-1) + 1
+    if size > len(data):
+        data.extend([missing] * (size - len(data)))
+
+    for index, value in values.items():
+        if value is None or value == "":
+            data[index] = missing
+        elif field_type == "int":
+            data[index] = int(value)
+        else:
+            data[index] = float(value)
+
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tobytes()
+
+
+def unpack_gt(blob: bytes, index: int):
+    """Get the gt code of the sample at the given index (SQL function)"""
+    if blob is None or index >> 2 >= len(blob):
+        return -1
+    return ((blob[index >> 2] >> ((index & 3) * 2)) & 3) - 1
+
+
+def unpack_int(blob: bytes, index: int):
+    """Get the integer of the sample at the given index (SQL function)"""
+    if blob is None or (index + 1) * 4 > len(blob):
+        return None
+    value = struct.unpack_from("<i", blob, index * 4)[0]
+    return None if value == INT_MISSING else value
+
+
+def unpack_float(blob: bytes, index: int):
+    """Get the float of the sample at the given index (SQL function)"""
+    if blob is None or (index + 1) * 4 > len(blob):
+        return None
+    value = struct.unpack_from("<f", blob, index * 4)[0]
+    return None if math.isnan(value) else value
+
+
+def register_functions(conn):
+    """Register the SQL functions used to decode blobs on the given connection"""
+    conn.create_function(SQL_DECODERS["gt"], 2, unpack_gt, deterministic=True)
+    conn.create_function(SQL_DECODERS["int"], 2, unpack_int, deterministic=True)
+    conn.create_function(SQL_DECODERS["float"], 2, unpack_float, deterministic=True)
+
+
+def get_sql_expression(field: dict, index, table="genotypes") -> str:
+    """Return the SQL expression that decodes the value of a sample field
+
+    :param field: Sample field with "name" and "type" keys.
+    :param index: Index of the sample (see :meth:`sample_index`),
+        or SQL expression of the index.
+    :key table: Name or alias of the genotypes table.
+    """
+    field_type = "gt" if field["name"] == "gt" else field["type"]
+    return "{}(`{}`.`{}`, {})".format(
+        SQL_DECODERS[field_type], table, field["name"], index
+    )
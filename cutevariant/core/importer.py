@@ -1,8 +1,12 @@
 """File importer and project creation"""
+# Standard imports
+import json
+
 # Custom imports
 from cutevariant import __version__
-from .reader.abstractreader import AbstractReader
+from .reader.abstractreader import AbstractReader, compute_extra_fields
 from .readerfactory import create_reader
+from .prefilter import VariantFilter, serialize_filters, deserialize_filters
 from cutevariant.core.reader.pedreader import PedReader
 from .sql import (
     create_project,
@@ -12,21 +16,62 @@
     create_table_annotations,
     create_table_variants,
     create_table_samples,
+    create_table_genotypes,
+    create_table_annotation_dictionary,
     create_table_selections,
     create_table_wordsets,
     insert_many_samples,
     get_samples,
     insert_many_fields,
+    insert_new_fields,
     async_insert_many_variants,
     create_indexes,
+    create_fts_indexes,
     update_sample,
+    get_metadatas,
+    update_metadatas,
+    delete_metadatas,
+    begin_bulk_load,
+    end_bulk_load,
+)
+from .querybuilder import (
+    get_default_tables_and_sample_ids,
+    get_packed_genotypes,
+    get_dictionary_fields,
+    get_fts_fields,
+)
+from .genotypes import is_packable
+from cutevariant.commons import (
+    logger,
+    DEFAULT_BATCH_SIZE,
+    IMPORT_CHECKPOINT_KEY,
+    IMPORT_SETTINGS_KEY,
+    IMPORT_OFFSET_KEY,
+    FTS_FIELDS,
 )
-from cutevariant.commons import logger
 
 LOGGER = logger()
 
 
-def async_import_reader(conn, reader: AbstractReader, pedfile=None, project={}):
+def async_import_reader(
+    conn,
+    reader: AbstractReader,
+    pedfile=None,
+    project={},
+    batch_size=DEFAULT_BATCH_SIZE,
+    bulk=False,
+    append=False,
+    resume=False,
+    packed_genotypes=False,
+    dictionary_threshold=None,
+    include_fields=None,
+    exclude_fields=None,
+    include_samples=None,
+    exclude_samples=None,
+    filters=None,
+    bed=None,
+    fts_fields=FTS_FIELDS,
+):
     """Import data via the given reader into a SQLite database via the given connection
 
     :param conn: sqlite connection
@@ -34,53 +79,191 @@ def async_import_reader(conn, reader: AbstractReader, pedfile=None, project={}):
     :param pedfile: PED file path
     :param project: The reference genome and the name of the project.
         Keys have to be at least "reference" and "project_name".
+    :key batch_size: Number of variants inserted at once in the database.
+    :key bulk: Tune the connection for massive insertions until the end of
+        the insertion of variants; foreign keys are checked afterwards.
+        See :meth:`cutevariant.core.sql.begin_bulk_load`.
+    :key append: Append data to an existing project instead of creating it.
+        New fields and samples are added, variants already in the project
+        are updated. Existing indexes are kept up to date by SQLite.
+        Genotypes of samples already in the project are ignored.
+    :key resume: Resume an interrupted import of the same file into the same
+        database. Variants are committed by batches with the number of
+        variants already processed (checkpoint) in the metadatas table;
+        the import restarts after the last checkpoint, with the settings
+        of the interrupted import (append mode, imported samples).
+        Readers that support it seek to the record of the checkpoint
+        (see :meth:`AbstractReader.set_start_offset`); the others read
+        the file again from the beginning.
+        Project creation, fields, samples and PED file are not imported again.
+    :key packed_genotypes: Store the genotypes of all the samples of each
+        variant in blobs of "genotypes" table instead of one row per sample in
+        "sample_has_variant" table. Only gt and numeric sample fields with a
+        single value are kept. See :mod:`cutevariant.core.genotypes`.
+        Ignored with `append` and `resume`: the storage of the existing
+        project is used.
+        Queries on the samples of a packed project also return the variants
+        without data for these samples (see
+        :meth:`cutevariant.core.querybuilder.build_sql_query`).
+    :key dictionary_threshold: Store the values of the annotation fields of
+        type str as integer codes, as long as they have at most this number
+        of distinct values (fields with more values are stored as is).
+        See :meth:`cutevariant.core.sql.create_table_annotation_dictionary`.
+        Ignored with `append` and `resume`: the storage of the existing
+        project is used.
+    :key include_fields: Allow list of the fields of the file to import;
+        names of fields ("dp") or names prefixed by their categories
+        ("samples.dp"). Default: None, all the fields.
+    :key exclude_fields: Deny list of the fields of the file.
+        Mandatory fields (chr, pos, ref, alt, gt) are always imported.
+        See :meth:`cutevariant.core.reader.abstractreader.AbstractReader.select_fields`.
+    :key include_samples: Allow list of the samples to import.
+        Default: None, all the samples.
+    :key exclude_samples: Deny list of the samples.
+        Ignored with `resume`: the selection of the interrupted import is used.
+    :key filters: Conditions that variants must meet to be imported;
+        WHERE clause of a VQL query (``qual > 30 AND impact = 'HIGH'``) or
+        nested tree of conditions. Variants are tested as they would be stored.
+        See :class:`cutevariant.core.prefilter.VariantFilter`.
+    :key bed: Path of a BED file; only variants in its intervals are imported.
+    :key fts_fields: Text fields indexed for substring searches, by table
+        (see :meth:`cutevariant.core.sql.create_fts_indexes`); None to skip
+        full-text indexes. Ignored with `append`: the indexes of the
+        existing project are kept up to date.
     :type project: <dict>
     :return: yield progression and message
     :rtype: <generator <int>, <str>>
+    :raises ValueError: If resume is set but there is no interrupted import
+        in the database, or if filters use unknown fields.
+    :raises VQLSyntaxError: If filters can't be parsed.
     """
     # Create project
     yield 0, f"Importing data with {reader}"
-    create_project(
-        conn,
-        name=project.get("project_name", "UKN"),
-        reference=project.get("reference", "UKN"),
-    )
+    start = 0
+    skip = None
+    checkpoint_variant = None
+    if resume:
+        metadatas = get_metadatas(conn)
+        if IMPORT_CHECKPOINT_KEY not in metadatas:
+            raise ValueError("There is no interrupted import to resume.")
+        start = int(metadatas[IMPORT_CHECKPOINT_KEY])
+        if IMPORT_OFFSET_KEY in metadatas:
+            position = json.loads(metadatas[IMPORT_OFFSET_KEY])
+            checkpoint_variant = position["variant"]
+            if reader.set_start_offset(position["offset"]):
+                # Only the variants of the record of the checkpoint are read again
+                skip = position["count"]
+        settings = json.loads(metadatas[IMPORT_SETTINGS_KEY])
+        append = settings["append"]
+        new_samples = settings["samples"]
+        include_fields, exclude_fields = settings["fields"]
+        filters, bed = settings["prefilters"]
+        filters = deserialize_filters(filters)
+        first_import_id = settings.get("first_id")
+        # Samples already in the project are not parsed again
+        include_samples, exclude_samples = new_samples, None
+        yield 0, f"Resuming the import after {start} variants..."
+
+    # Unwanted fields and samples are not parsed
+    reader.select_fields(include_fields, exclude_fields)
+    reader.select_samples(include_samples, exclude_samples)
+
+    if filters or bed:
+        # Fail before the creation of the project
+        prefilter = VariantFilter(filters, bed, fields=reader.get_extra_fields())
+        yield 0, "Variants will be filtered before their insertion"
+    else:
+        prefilter = None
+
+    if bulk:
+        yield 0, "Bulk load mode enabled"
+        previous_settings = begin_bulk_load(conn)
+
+    if resume:
+        # Everything is already there except variants
+        pass
+    elif append:
+        yield 0, "Appending data to the existing project..."
+        yield 0, "Inserting new fields..."
+        new_fields = insert_new_fields(conn, reader.get_extra_fields())
+        for field in new_fields:
+            yield 0, f"- New field: {field['name']} ({field['category']})"
+
+        # Insert only new samples
+        known_samples = {sample["name"] for sample in get_samples(conn)}
+        new_samples = [
+            name for name in reader.get_samples() if name not in known_samples
+        ]
+        yield 0, "Inserting samples..."
+        insert_many_samples(conn, new_samples)
+        if len(new_samples) != len(reader.get_samples()):
+            LOGGER.warning(
+                "async_import_reader:: Genotypes of samples already in the "
+                "project will be ignored: %s",
+                known_samples & set(reader.get_samples()),
+            )
+        # Samples and fields are cached for the queries
+        get_default_tables_and_sample_ids.cache_clear()
+        get_packed_genotypes.cache_clear()
+    else:
+        create_project(
+            conn,
+            name=project.get("project_name", "UKN"),
+            reference=project.get("reference", "UKN"),
+        )
 
-    # Create metadatas
-    create_table_metadatas(conn)
-    metadatas = reader.get_metadatas()
-    # Database versioning
-    metadatas["cutevariant_version"] = __version__
-    insert_many_metadatas(conn, metadatas)
+        # Create metadatas
+        create_table_metadatas(conn)
+        metadatas = reader.get_metadatas()
+        # Database versioning
+        metadatas["cutevariant_version"] = __version__
+        insert_many_metadatas(conn, metadatas)
 
-    yield 0, "Creating table shema..."
-    # Create table fields
-    create_table_fields(conn)
+        yield 0, "Creating table shema..."
+        # Create table fields
+        create_table_fields(conn)
 
-    # Create annotations tables
-    create_table_annotations(conn, reader.get_extra_fields_by_category("annotations"))
+        # Create annotations tables
+        create_table_annotations(
+            conn, reader.get_extra_fields_by_category("annotations")
+        )
+        if dictionary_threshold is not None:
+            yield 0, "Annotations will be encoded"
+            create_table_annotation_dictionary(
+                conn,
+                reader.get_extra_fields_by_category("annotations"),
+                dictionary_threshold,
+            )
 
-    # Create variants tables
-    create_table_variants(conn, reader.get_extra_fields_by_category("variants"))
+        # Create variants tables
+        create_table_variants(conn, reader.get_extra_fields_by_category("variants"))
 
-    # Create table samples
-    create_table_samples(conn, reader.get_extra_fields_by_category("samples"))
+        # Create table samples
+        create_table_samples(conn, reader.get_extra_fields_by_category("samples"))
+        if packed_genotypes:
+            yield 0, "Genotypes will be packed"
+            create_table_genotypes(
+                conn, reader.get_extra_fields_by_category("samples")
+            )
 
-    # Create selection
-    create_table_selections(conn)
+        # Create selection
+        create_table_selections(conn)
 
-    # Create table sets
-    create_table_wordsets(conn)
+        # Create table sets
+        create_table_wordsets(conn)
 
-    # Insert samples
-    yield 0, "Inserting samples..."
-    insert_many_samples(conn, reader.get_samples())
+        # Insert samples
+        yield 0, "Inserting samples..."
+        insert_many_samples(conn, reader.get_samples())
+        new_samples = reader.get_samples()
 
     # Import PED file
-    if pedfile:
+    if pedfile and not resume:
         yield 0, f"Import pedfile {pedfile}"
         import_pedfile(conn, pedfile)
 
+    if pedfile or resume:
+
         # Compute control and cases samples
         samples = tuple(get_samples(conn))
         LOGGER.debug("Check found samples in DB after PED import: %s", samples)
@@ -97,26 +280,144 @@ def async_import_reader(conn, reader: AbstractReader, pedfile=None, project={}):
         control_samples = list()
         case_samples = list()
 
-    # Insert fields
-    yield 0, "Inserting fields..."
-    insert_many_fields(conn, reader.get_extra_fields())
+    if not append and not resume:
+        # Insert fields
+        yield 0, "Inserting fields..."
+        fields = reader.get_extra_fields()
+        if packed_genotypes:
+            # Sample fields that can't be packed are not imported
+            fields = [
+                field
+                for field in fields
+                if field["category"] != "samples" or is_packable(field)
+            ]
+        insert_many_fields(conn, fields)
 
     # Insert variants, link them to annotations and samples
     yield 0, "Insertings variants..."
     variants = reader.get_extra_variants(control=control_samples, case=case_samples)
+    if len(new_samples) != len(reader.get_samples()):
+        variants = filter_samples(variants, new_samples, case_samples, control_samples)
+    if prefilter:
+        variants = prefilter.filter(variants)
+
+    if not resume:
+        # Save what is needed to resume the import if it is interrupted
+        # Variants with ids from first_import_id are inserted by this import
+        first_import_id = conn.execute(
+            "SELECT IFNULL(MAX(id), 0) + 1 FROM variants"
+        ).fetchone()[0]
+        delete_metadatas(conn, [IMPORT_OFFSET_KEY])
+        update_metadatas(
+            conn,
+            {
+                IMPORT_CHECKPOINT_KEY: 0,
+                IMPORT_SETTINGS_KEY: json.dumps(
+                    {
+                        "append": append,
+                        "first_id": first_import_id,
+                        "samples": list(new_samples),
+                        "fields": [
+                            None if include_fields is None else list(include_fields),
+                            list(exclude_fields or ()),
+                        ],
+                        "prefilters": [
+                            prefilter and serialize_filters(prefilter.filters),
+                            bed,
+                        ],
+                    }
+                ),
+            },
+        )
+
     yield from async_insert_many_variants(
-        conn, variants, total_variant_count=reader.number_lines
+        conn,
+        variants,
+        progress_callback=reader.get_progress,
+        batch_size=batch_size,
+        append=append,
+        checkpoint=True,
+        start=start,
+        skip=skip,
+        checkpoint_variant=checkpoint_variant,
+        first_import_id=first_import_id,
+    )
+    if prefilter:
+        yield 97, f"{prefilter.rejected_count} variant(s) filtered out."
+
+    if bulk:
+        yield 98, "Restoring settings and checking foreign keys..."
+        end_bulk_load(conn, previous_settings)
+
+    if not append:
+        # Create indexes
+        yield 99, "Creating indexes..."
+        create_indexes(conn)
+        if fts_fields:
+            yield 99, "Creating full-text indexes..."
+            create_fts_indexes(conn, fts_fields)
+
+    # The import is complete: nothing to resume
+    delete_metadatas(
+        conn, [IMPORT_CHECKPOINT_KEY, IMPORT_SETTINGS_KEY, IMPORT_OFFSET_KEY]
     )
+    # Fields with too many values may have been decoded
+    get_dictionary_fields.cache_clear()
+    get_fts_fields.cache_clear()
 
-    # Create indexes
-    yield 99, "Creating indexes..."
-    create_indexes(conn)
-    yield 100, "Indexes created."
+    if append:
+        # Indexes are already there
+        yield 100, "Data appended."
+    else:
+        yield 100, "Indexes created."
 
     # session.add(Selection(name="favoris", description="favoris", count = 0))
 
 
-def async_import_file(conn, filename, pedfile=None, project={}):
+def filter_samples(variants, samples, case_samples, control_samples):
+    """Keep only the data of the given samples in the variants
+
+    Genotypes counters are computed again on the remaining samples.
+
+    :param variants: Generator of variants with extra fields.
+    :param samples: Names of the samples to keep.
+    :param case_samples: Names of case samples
+    :param control_samples: Names of control samples
+    :return: Generator of variants.
+    :rtype: <generator <dict>>
+    """
+    samples = set(samples)
+    for variant in variants:
+        if "samples" in variant:
+            variant["samples"] = [
+                sample for sample in variant["samples"] if sample["name"] in samples
+            ]
+            compute_extra_fields(variant, case_samples, control_samples)
+        yield variant
+
+
+def async_import_file(
+    conn,
+    filename,
+    pedfile=None,
+    project={},
+    batch_size=DEFAULT_BATCH_SIZE,
+    processes=1,
+    fast_parser=False,
+    presorted=False,
+    bulk=False,
+    append=False,
+    resume=False,
+    packed_genotypes=False,
+    dictionary_threshold=None,
+    include_fields=None,
+    exclude_fields=None,
+    include_samples=None,
+    exclude_samples=None,
+    filters=None,
+    bed=None,
+    fts_fields=FTS_FIELDS,
+):
     """Import filename into SQLite database
 
     :param conn: sqlite connection
@@ -124,12 +425,52 @@ def async_import_file(conn, filename, pedfile=None, project={}):
     :param pedfile: PED file path
     :param project: The reference genome and the name of the project.
         Keys have to be at least "reference" and "project_name".
+    :key batch_size: Number of variants inserted at once in the database.
+    :key processes: Number of processes used to parse the file.
+    :key fast_parser: Parse VCF files with the lightweight tokenizer
+        instead of PyVCF.
+    :key presorted: The transcripts of each variant are on consecutive lines
+        of CSV files; they are not sorted.
+    :key bulk: Tune the connection for massive insertions.
+    :key append: Append data to an existing project.
+    :key resume: Resume an interrupted import of the same file.
+    :key packed_genotypes: Pack the genotypes of each variant in blobs.
+    :key dictionary_threshold: Encode annotation fields with at most this
+        number of distinct values.
+    :key include_fields: Allow list of the fields to import.
+    :key exclude_fields: Deny list of the fields.
+    :key include_samples: Allow list of the samples to import.
+    :key exclude_samples: Deny list of the samples.
+    :key filters: Conditions that variants must meet to be imported.
+    :key bed: Path of a BED file; only variants in its intervals are imported.
+    :key fts_fields: Text fields indexed for substring searches, by table;
+        None to skip full-text indexes.
     :type project: <dict>
     :return: yield progression and message
     """
     # Context manager that wraps the given file and creates an apropriate reader
-    with create_reader(filename) as reader:
-        yield from async_import_reader(conn, reader, pedfile, project)
+    with create_reader(
+        filename, processes=processes, fast_parser=fast_parser, presorted=presorted
+    ) as reader:
+        yield from async_import_reader(
+            conn,
+            reader,
+            pedfile,
+            project,
+            batch_size=batch_size,
+            bulk=bulk,
+            append=append,
+            resume=resume,
+            packed_genotypes=packed_genotypes,
+            dictionary_threshold=dictionary_threshold,
+            include_fields=include_fields,
+            exclude_fields=exclude_fields,
+            include_samples=include_samples,
+            exclude_samples=exclude_samples,
+            filters=filters,
+            bed=bed,
+            fts_fields=fts_fields,
+        )
 
 
 def import_file(conn, filename, pedfile=None, project={}):
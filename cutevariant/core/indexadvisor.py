@@ -0,0 +1,487 @@
+"""Index advisor: indexes for the fields frequently used by queries
+
+Fields used by the conditions and the sort of slow queries are recorded in
+the store of cached data of the project (index_advisor table; see
+:meth:`cutevariant.core.sql.get_cache_connection`) with the duration of the
+queries. Single-column and composite indexes on the fields of variants and
+annotations are then suggested for the fields that cost the most time, within
+a budget of disk size. Indexes are only created on request (``index apply``
+command of the CLI, :class:`IndexAdvisorThread`).
+
+Composite indexes follow the usual rule of B-trees: columns tested for
+equality first, then one column tested with a range or the sort column.
+Conditions that can't use an index (!=, LIKE, regular expressions, etc.)
+are not recorded.
+
+Indexes created by the advisor are named ``idx_advisor_<table>_<columns>``;
+other indexes are never dropped.
+
+Example::
+
+    >>> record_query(conn, {"AND": [{"field": "gene", "operator": "=", ...}]}, 0.8)
+    >>> suggestions = get_index_suggestions(conn)
+    >>> apply_index_suggestions(conn, suggestions)
+"""
+# Standard imports
+import json
+import re
+import sqlite3
+import threading
+
+# Custom imports
+from cutevariant.core import sql
+from cutevariant.core.querybuilder import (
+    filters_to_flat,
+    get_default_tables_and_sample_ids,
+)
+import cutevariant.commons as cm
+
+LOGGER = cm.logger()
+
+INDEX_PREFIX = "idx_advisor_"
+INDEXED_TABLES = ("variants", "annotations")
+EQUALITY_OPERATORS = ("=", "==", "IN", "IS")
+RANGE_OPERATORS = ("<", "<=", ">", ">=")
+# Maximum number of columns of composite indexes
+MAX_COLUMNS = 3
+# Number of rows read to estimate the size of an index
+SIZE_SAMPLE = 1000
+
+
+def create_table_index_advisor(conn: sqlite3.Connection):
+    """Create "index_advisor" table if it doesn't exist
+
+    Statistics of the queries by shape:
+
+        - shape: JSON list of the fields of the queries (see
+          :meth:`get_query_shape`)
+        - count: Number of queries with this shape
+        - duration: Total duration of these queries (seconds)
+
+    :param conn: Sqlite3 Connection to the store of cached data of the
+        project (see :meth:`cutevariant.core.sql.get_cache_connection`)
+    """
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS index_advisor (
+        shape TEXT PRIMARY KEY,
+        count INTEGER NOT NULL,
+        duration REAL NOT NULL
+        )"""
+    )
+
+
+def get_field_table(field, default_tables: dict):
+    """Return the table and the column of the given field
+
+    :param field: Name of a field ("name" or "category.name") or sample
+        function (tuple).
+    :param default_tables: Names of the fields as keys, their categories as
+        values (see :meth:`cutevariant.core.querybuilder.build_sql_query`).
+    :return: (table, column) tuple; None if the field is not a column of
+        variants or annotations.
+    """
+    if not isinstance(field, str):
+        # Sample functions: sample_has_variant is indexed by its primary key
+        return None
+    match = re.match(r"^(\w+)\.(\w+)$", field)
+    if match:
+        table, column = match[1], match[2]
+    else:
+        table, column = default_tables.get(field), field
+
+    if table not in INDEXED_TABLES or column == "id":
+        return None
+    return table, column
+
+
+def get_query_shape(filters: dict, order_by=None):
+    """Return the fields of a query that could use an index
+
+    Fields are not resolved to columns: the shape of a query doesn't depend
+    on the project.
+
+    :param filters: Nested tree of conditions.
+    :param order_by: Field used to sort the variants (or None).
+    :return: (equalities, ranges, order_by) tuple: sorted names of the fields
+        tested for equality and with a range, and the sort field. Sample
+        functions are ignored.
+    :rtype: <tuple <tuple <str>>, <tuple <str>>, <str>>
+    """
+    equalities, ranges = set(), set()
+    for condition in filters_to_flat(filters):
+        if not isinstance(condition["field"], str):
+            # Sample functions: sample_has_variant is indexed by its primary key
+            continue
+        operator = str(condition["operator"]).upper()
+        if operator in EQUALITY_OPERATORS:
+            equalities.add(condition["field"])
+        elif operator in RANGE_OPERATORS:
+            ranges.add(condition["field"])
+    if not isinstance(order_by, str):
+        order_by = None
+    return tuple(sorted(equalities)), tuple(sorted(ranges)), order_by
+
+
+def get_shape_indexes(shape, default_tables: dict):
+    """Return the indexes that could be used by queries of the given shape
+
+    Each field tested for equality or with a range gives a single-column
+    index; fields of the same table give a composite index (equality
+    columns, then a range column or the sort column).
+
+    :param shape: (equalities, ranges, order_by) tuple (see
+        :meth:`get_query_shape`).
+    :param default_tables: Names of the fields as keys, their categories as
+        values.
+    :return: Set of (table, columns) tuples; columns are tuples of names.
+    :rtype: <set <tuple <str>, <tuple <str>>>>
+    """
+    fields_equalities, fields_ranges, order_by = shape
+    equalities, ranges = dict(), dict()
+    for fields, columns in ((fields_equalities, equalities), (fields_ranges, ranges)):
+        for field in fields:
+            field_table = get_field_table(field, default_tables)
+            if field_table:
+                table, column = field_table
+                columns.setdefault(table, set()).add(column)
+
+    sort = get_field_table(order_by, default_tables) if order_by else None
+
+    indexes = set()
+    for table in INDEXED_TABLES:
+        table_equalities = sorted(equalities.get(table, ()))
+        table_ranges = sorted(ranges.get(table, set()) - set(table_equalities))
+        for column in table_equalities + table_ranges:
+            indexes.add((table, (column,)))
+
+        composite = list(table_equalities)
+        if table_ranges:
+            composite.append(table_ranges[0])
+        elif sort and sort[0] == table and sort[1] not in composite:
+            composite.append(sort[1])
+        indexes.add((table, tuple(composite[:MAX_COLUMNS])))
+
+    return {(table, columns) for table, columns in indexes if columns}
+
+
+def get_query_indexes(filters: dict, order_by, default_tables: dict):
+    """Return the indexes that could be used by a query
+
+    See :meth:`get_shape_indexes`.
+
+    :param filters: Nested tree of conditions.
+    :param order_by: Field used to sort the variants (or None).
+    :param default_tables: Names of the fields as keys, their categories as
+        values.
+    :return: Set of (table, columns) tuples; columns are tuples of names.
+    :rtype: <set <tuple <str>, <tuple <str>>>>
+    """
+    return get_shape_indexes(get_query_shape(filters, order_by), default_tables)
+
+
+def record_query(
+    conn: sqlite3.Connection,
+    filters: dict,
+    duration: float,
+    order_by=None,
+    min_duration=cm.INDEX_ADVISOR_MIN_DURATION,
+):
+    """Record the shape of a query in index_advisor table
+
+    Statistics are written in the store of cached data of the project,
+    never in the project. Fast queries are not recorded: they don't need
+    indexes and the writes would slow them down. Errors (locked store,
+    etc.) are ignored.
+
+    :param conn: Sqlite3 Connection of the project
+    :param filters: Nested tree of conditions of the query.
+    :param duration: Duration of the query (seconds).
+    :key order_by: Field used to sort the variants.
+    :key min_duration: Queries faster than this duration (seconds) are not
+        recorded.
+    """
+    if duration < min_duration:
+        return
+    shape = get_query_shape(filters, order_by)
+    if not any(shape):
+        return
+    cache_conn = sql.get_cache_connection(conn)
+    if cache_conn is None:
+        return
+
+    try:
+        create_table_index_advisor(cache_conn)
+    except sqlite3.OperationalError as e:
+        LOGGER.debug("record_query:: index_advisor table not created: %s", e)
+        return
+
+    sql.try_write(
+        cache_conn,
+        [
+            (
+                """INSERT INTO index_advisor VALUES (?, 1, ?)
+                ON CONFLICT (shape) DO UPDATE SET
+                count = count + 1, duration = duration + excluded.duration""",
+                (json.dumps(shape), duration),
+            )
+        ],
+    )
+
+
+def get_index_stats(conn: sqlite3.Connection):
+    """Return the statistics of the recorded queries by index
+
+    Shapes of the queries are resolved with the current fields of the
+    project.
+
+    :param conn: Sqlite3 Connection of the project
+    :return: (table, columns) tuples as keys, [count, duration] lists as
+        values: number and total duration (seconds) of the queries that
+        could use each index.
+    :rtype: <dict <tuple <str>, <tuple <str>>>: <list <int>, <float>>>
+    """
+    cache_conn = sql.get_cache_connection(conn)
+    if cache_conn is None:
+        return {}
+    try:
+        shapes = cache_conn.execute(
+            "SELECT shape, count, duration FROM index_advisor"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        # No recorded query, or locked store
+        return {}
+
+    default_tables, _ = get_default_tables_and_sample_ids(conn)
+    stats = dict()
+    for shape, count, duration in shapes:
+        equalities, ranges, order_by = json.loads(shape)
+        shape = (tuple(equalities), tuple(ranges), order_by)
+        for index in get_shape_indexes(shape, default_tables):
+            index_stats = stats.setdefault(index, [0, 0.0])
+            index_stats[0] += count
+            index_stats[1] += duration
+    return stats
+
+
+def get_index_name(table: str, columns) -> str:
+    """Return the name of the advisor index of the given columns"""
+    return re.sub(r"\W", "_", f"{INDEX_PREFIX}{table}_{'_'.join(columns)}")
+
+
+def get_indexed_columns(conn: sqlite3.Connection, table: str) -> list:
+    """Return the columns of the indexes of the given table
+
+    :return: Tuples of columns, in the order of each index.
+    :rtype: <list <tuple <str>>>
+    """
+    return [
+        tuple(
+            column[2] for column in conn.execute(f"PRAGMA index_info('{index[1]}')")
+        )
+        for index in conn.execute(f"PRAGMA index_list('{table}')")
+    ]
+
+
+def estimate_index_size(conn: sqlite3.Connection, table: str, columns) -> int:
+    """Estimate the disk size of an index on the given columns
+
+    The average size of the values is measured on the first rows of the
+    table; each entry also stores the rowid and a record header.
+
+    :return: Size in bytes.
+    """
+    lengths = " + ".join(f'IFNULL(LENGTH("{column}"), 0)' for column in columns)
+    selected = ", ".join(f'"{column}"' for column in columns)
+    average = conn.execute(
+        f"SELECT AVG({lengths}) FROM (SELECT {selected} FROM {table} LIMIT ?)",
+        (SIZE_SAMPLE,),
+    ).fetchone()[0]
+    count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    return int(count * ((average or 0) + 8 + len(columns)))
+
+
+def get_index_size(conn: sqlite3.Connection, name: str, table: str, columns) -> int:
+    """Return the disk size of an existing index
+
+    The dbstat virtual table is used if SQLite is compiled with it;
+    otherwise the size is estimated.
+    """
+    try:
+        size = conn.execute(
+            "SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (name,)
+        ).fetchone()[0]
+    except sqlite3.OperationalError:
+        size = None
+    if size is None:
+        return estimate_index_size(conn, table, columns)
+    return size
+
+
+def get_advisor_indexes(conn: sqlite3.Connection):
+    """Yield the indexes created by the advisor
+
+    :return: Generator of dicts with "name", "table", "columns" and "size"
+        keys.
+    :rtype: <generator <dict>>
+    """
+    indexes = conn.execute(
+        "SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' "
+        "AND name LIKE ? ESCAPE '\\'",
+        (INDEX_PREFIX.replace("_", "\\_") + "%",),
+    ).fetchall()
+    for name, table in indexes:
+        columns = tuple(
+            column[2] for column in conn.execute(f"PRAGMA index_info('{name}')")
+        )
+        yield {
+            "name": name,
+            "table": table,
+            "columns": columns,
+            "size": get_index_size(conn, name, table, columns),
+        }
+
+
+def get_index_suggestions(
+    conn: sqlite3.Connection,
+    budget=cm.INDEX_ADVISOR_BUDGET,
+    min_count=cm.INDEX_ADVISOR_MIN_COUNT,
+):
+    """Return the indexes that would speed up the recorded queries
+
+    Sets of columns are ranked by the total duration of their queries;
+    columns already covered by the first columns of an index are skipped.
+    Indexes are suggested while their total size, with the size of the
+    indexes already created by the advisor, is within the budget.
+
+    :param conn: Sqlite3 Connection
+    :key budget: Maximum size of the indexes of the advisor (bytes).
+    :key min_count: Minimum number of queries on the same columns.
+    :return: Dicts with "name", "table", "columns", "count", "duration" and
+        "size" (estimate, bytes) keys.
+    :rtype: <list <dict>>
+    """
+    stats = sorted(
+        (
+            (table, columns, count, duration)
+            for (table, columns), (count, duration) in get_index_stats(conn).items()
+            if count >= min_count
+        ),
+        key=lambda stat: (-stat[3], stat[0], stat[1]),
+    )
+    if not stats:
+        return []
+
+    remaining = budget - sum(index["size"] for index in get_advisor_indexes(conn))
+    indexed = {table: get_indexed_columns(conn, table) for table in INDEXED_TABLES}
+    table_columns = {
+        table: set(sql.get_table_columns(conn, table)) for table in indexed
+    }
+
+    suggestions = []
+    for table, columns, count, duration in stats:
+        if not set(columns).issubset(table_columns[table]):
+            # Removed fields
+            continue
+        if any(index[: len(columns)] == columns for index in indexed[table]):
+            continue
+
+        size = estimate_index_size(conn, table, columns)
+        if size > remaining:
+            continue
+        remaining -= size
+        indexed[table].append(columns)
+        suggestions.append(
+            {
+                "name": get_index_name(table, columns),
+                "table": table,
+                "columns": columns,
+                "count": count,
+                "duration": duration,
+                "size": size,
+            }
+        )
+    return suggestions
+
+
+def get_indexes(conn: sqlite3.Connection):
+    """Yield the indexes created by the advisor, then its suggestions
+
+    :return: Generator of dicts with "name", "table", "columns" (comma
+        separated), "size" and "status" ("created" or "suggested") keys.
+    :rtype: <generator <dict>>
+    """
+    created = [dict(index, status="created") for index in get_advisor_indexes(conn)]
+    suggested = [
+        {key: index[key] for key in ("name", "table", "columns", "size")}
+        for index in get_index_suggestions(conn)
+    ]
+    for index in created + suggested:
+        index.setdefault("status", "suggested")
+        yield dict(index, columns=",".join(index["columns"]))
+
+
+def apply_index_suggestions(conn: sqlite3.Connection, suggestions):
+    """Create the given indexes
+
+    :param conn: Sqlite3 Connection
+    :param suggestions: Dicts with "name", "table" and "columns" keys
+        (see :meth:`get_index_suggestions`).
+    :return: Names of the created indexes.
+    :rtype: <list <str>>
+    """
+    names = []
+    for suggestion in suggestions:
+        columns = ", ".join(f'"{column}"' for column in suggestion["columns"])
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {suggestion['name']} "
+            f"ON {suggestion['table']} ({columns})"
+        )
+        conn.commit()
+        LOGGER.debug("apply_index_suggestions:: %s created", suggestion["name"])
+        names.append(suggestion["name"])
+    return names
+
+
+def drop_advisor_index(conn: sqlite3.Connection, name: str) -> bool:
+    """Drop an index created by the advisor
+
+    :param conn: Sqlite3 Connection
+    :param name: Name of the index.
+    :return: True if the index has been dropped; False if it doesn't exist
+        or if it was not created by the advisor.
+    """
+    if name not in {index["name"] for index in get_advisor_indexes(conn)}:
+        return False
+    conn.execute(f"DROP INDEX {name}")
+    conn.commit()
+    return True
+
+
+class IndexAdvisorThread(threading.Thread):
+    """Create the suggested indexes of a project in the background
+
+    The thread is never started automatically: index creation must be
+    requested by the user. It uses its own connection; indexes are created
+    one by one, so other connections keep reading the project meanwhile. If the project
+    is locked or read only, nothing is created.
+    """
+
+    def __init__(self, filepath, budget=cm.INDEX_ADVISOR_BUDGET):
+        """
+        :param filepath: Path of the project.
+        :key budget: Maximum size of the indexes of the advisor (bytes).
+        """
+        super().__init__(daemon=True)
+        self.filepath = filepath
+        self.budget = budget
+        self.created = []
+
+    def run(self):
+        conn = sql.get_sql_connection(self.filepath)
+        try:
+            suggestions = get_index_suggestions(conn, budget=self.budget)
+            self.created = apply_index_suggestions(conn, suggestions)
+        except sqlite3.OperationalError as e:
+            LOGGER.debug("IndexAdvisorThread:: indexes not created: %s", e)
+        finally:
+            conn.close()
@@ -0,0 +1,236 @@
+"""Sorted genomic intervals
+
+Intervals (of a BED file for example) are merged and sorted by chromosome,
+then positions are tested with a sweep: for positions given in increasing
+order (i.e. variants of a sorted VCF file), each interval is visited once.
+
+Like :meth:`cutevariant.core.sql.create_selection_from_bed`, a position
+`pos` is in an interval if `start <= pos <= end`.
+
+Intervals stored in the database are indexed with the binning scheme of the
+UCSC genome browser: each interval is assigned to the smallest bin (of
+128 kb, 1 Mb, 8 Mb, 64 Mb or 512 Mb) that contains it, so the intervals
+that may contain a position are found in only 5 bins (see :meth:`ucsc_bin`
+and :meth:`containing_bins_sql`).
+
+Regions of queries are written like ``chr1:12000-13000`` (1-based, both
+ends included), ``chr1:12000`` or ``chr1`` (see :meth:`parse_region`).
+
+Example::
+
+    >>> sweep = IntervalSweep(load_intervals(BedReader("capture.bed")))
+    >>> sweep.contains("chr1", 12000)
+    True
+"""
+# Standard imports
+import bisect
+import re
+
+# UCSC binning: offsets of the levels of bins (from the smallest bins),
+# size of the smallest bins (2^17) and ratio between levels (2^3)
+BIN_OFFSETS = (512 + 64 + 8 + 1, 64 + 8 + 1, 8 + 1, 1, 0)
+BIN_FIRST_SHIFT = 17
+BIN_NEXT_SHIFT = 3
+# Bin of the intervals beyond the last bin (512 Mb); always searched
+EXTENDED_BIN = -1
+MAX_BIN_POSITION = 1 << (BIN_FIRST_SHIFT + BIN_NEXT_SHIFT * (len(BIN_OFFSETS) - 1))
+
+
+class UnsortedIntervalsError(ValueError):
+    """Intervals are not grouped by chromosome and sorted by start"""
+
+
+def load_intervals(bed_intervals) -> dict:
+    """Group the given intervals by chromosome, sort and merge them
+
+    :param bed_intervals: Iterable of dicts with "chrom", "start" and "end"
+        keys (see :class:`cutevariant.core.reader.BedReader`).
+    :return: Chromosomes as keys, sorted lists of non overlapping
+        (start, end) tuples as values.
+    :rtype: <dict <str>: <list <tuple <int>, <int>>>>
+    """
+    intervals = dict()
+    for interval in bed_intervals:
+        intervals.setdefault(interval["chrom"], []).append(
+            (int(interval["start"]), int(interval["end"]))
+        )
+
+    for chrom, chrom_intervals in intervals.items():
+        chrom_intervals.sort()
+        merged = [chrom_intervals[0]]
+        for start, end in chrom_intervals[1:]:
+            last_start, last_end = merged[-1]
+            if start <= last_end + 1:
+                # Overlapping or adjacent intervals
+                merged[-1] = (last_start, max(last_end, end))
+            else:
+                merged.append((start, end))
+        intervals[chrom] = merged
+
+    return intervals
+
+
+def merge_sorted_intervals(bed_intervals):
+    """Merge the given sorted intervals while they are read
+
+    Unlike :meth:`load_intervals`, intervals are not kept in memory: they
+    must be grouped by chromosome (in any order of chromosomes) and sorted
+    by start.
+
+    :param bed_intervals: Iterable of dicts with "chrom", "start" and "end"
+        keys (see :class:`cutevariant.core.reader.BedReader`).
+    :return: Generator of non overlapping (chrom, start, end) tuples.
+    :rtype: <generator <tuple <str>, <int>, <int>>>
+    :raises UnsortedIntervalsError: When an interval is out of order.
+    """
+    seen_chroms = set()
+    chrom = start = end = None
+    for interval in bed_intervals:
+        interval_chrom = interval["chrom"]
+        interval_start, interval_end = int(interval["start"]), int(interval["end"])
+        if interval_chrom != chrom:
+            if interval_chrom in seen_chroms:
+                raise UnsortedIntervalsError(f"{interval_chrom} is not grouped")
+            if chrom is not None:
+                yield chrom, start, end
+            seen_chroms.add(interval_chrom)
+            chrom, start, end = interval_chrom, interval_start, interval_end
+        elif interval_start < start:
+            raise UnsortedIntervalsError(f"{chrom}:{interval_start} is not sorted")
+        elif interval_start <= end + 1:
+            # Overlapping or adjacent intervals
+            end = max(end, interval_end)
+        else:
+            yield chrom, start, end
+            start, end = interval_start, interval_end
+
+    if chrom is not None:
+        yield chrom, start, end
+
+
+def intersect_sorted(positions, intervals):
+    """Yield the keys of the positions contained in the given intervals
+
+    Both iterables are read once, in a single sweep.
+
+    :param positions: Iterable of (key, pos) tuples sorted by position.
+    :param intervals: Iterable of non overlapping (start, end) tuples sorted
+        by start.
+    :return: Generator of keys.
+    """
+    intervals = iter(intervals)
+    start, end = next(intervals, (None, None))
+    for key, pos in positions:
+        while start is not None and end < pos:
+            start, end = next(intervals, (None, None))
+        if start is None:
+            return
+        if start <= pos:
+            yield key
+
+
+class IntervalSweep:
+    """Test positions against sorted intervals
+
+    The index of the current interval is kept between calls: while positions
+    increase on a chromosome, the sweep only moves forward. A new chromosome
+    or a position lower than the previous one (unsorted input) falls back to
+    a binary search.
+
+    Attributes:
+        starts (dict): Chromosomes as keys, sorted starts of intervals as values.
+        ends (dict): Chromosomes as keys, sorted ends of intervals as values.
+    """
+
+    def __init__(self, intervals: dict):
+        """
+        :param intervals: Merged intervals as returned by :meth:`load_intervals`.
+        """
+        self.starts = {
+            chrom: [start for start, _ in values] for chrom, values in intervals.items()
+        }
+        self.ends = {
+            chrom: [end for _, end in values] for chrom, values in intervals.items()
+        }
+        self._chrom = None
+        self._pos = None
+        self._index = 0
+
+    def contains(self, chrom, pos) -> bool:
+        """Return True if the given position is in one of the intervals"""
+        ends = self.ends.get(chrom)
+        if not ends:
+            return False
+
+        if chrom != self._chrom or pos < self._pos:
+            self._chrom = chrom
+            self._index = bisect.bisect_left(ends, pos)
+        else:
+            while self._index < len(ends) and ends[self._index] < pos:
+                self._index += 1
+        self._pos = pos
+
+        return self._index < len(ends) and self.starts[chrom][self._index] <= pos
+
+
+def ucsc_bin(start: int, end: int) -> int:
+    """Return the smallest UCSC bin that contains the given interval
+
+    :param start: First position of the interval.
+    :param end: Last position of the interval (included).
+    :return: Number of the bin; :data:`EXTENDED_BIN` for intervals beyond
+        the largest bin.
+    """
+    if start < 0 or end >= MAX_BIN_POSITION:
+        return EXTENDED_BIN
+    start_bin = start >> BIN_FIRST_SHIFT
+    end_bin = end >> BIN_FIRST_SHIFT
+    for offset in BIN_OFFSETS:
+        if start_bin == end_bin:
+            return offset + start_bin
+        start_bin >>= BIN_NEXT_SHIFT
+        end_bin >>= BIN_NEXT_SHIFT
+    return EXTENDED_BIN
+
+
+def containing_bins(pos: int) -> list:
+    """Return the bins of the intervals that may contain the given position"""
+    return [
+        offset + (pos >> (BIN_FIRST_SHIFT + BIN_NEXT_SHIFT * level))
+        for level, offset in enumerate(BIN_OFFSETS)
+    ] + [EXTENDED_BIN]
+
+
+def containing_bins_sql(pos_column: str) -> str:
+    """Return the SQL expression of :meth:`containing_bins`
+
+    Example::
+
+        >>> f"bed_table.bin IN ({containing_bins_sql('variants.pos')})"
+    """
+    return ", ".join(
+        f"{offset} + ({pos_column} >> {BIN_FIRST_SHIFT + BIN_NEXT_SHIFT * level})"
+        for level, offset in enumerate(BIN_OFFSETS)
+    ) + f", {EXTENDED_BIN}"
+
+
+def parse_region(region: str) -> tuple:
+    """Parse the given region (``chr1:12000-13000``, ``chr1:12000``, ``chr1``)
+
+    Positions may contain commas (``chr1:12,000-13,000``).
+
+    :return: (chrom, start, end) tuple; start and end are None for a
+        whole chromosome.
+    :raises ValueError: If the region is not valid.
+    """
+    match = re.match(r"^\s*([^:\s]+)(?::([\d,]+)(?:-([\d,]+))?)?\s*$", str(region))
+    if not match:
+        raise ValueError(f"Invalid region: {region}")
+    chrom, start, end = match.groups()
+    if start is None:
+        return chrom, None, None
+    start = int(start.replace(",", ""))
+    end = int(end.replace(",", "")) if end else start
+    if end < start:
+        raise ValueError(f"Invalid region: {region}")
+    return chrom, start, end
@@ -0,0 +1,332 @@
+"""Filters of variants evaluated during the import
+
+Variants are tested before their insertion in the database with:
+
+    - conditions written like the WHERE clause of a VQL query
+      (``qual > 30 AND impact = 'HIGH'``);
+    - the intervals of a BED file, tested with a sorted sweep
+      (see :mod:`cutevariant.core.intervals`).
+
+Conditions have the semantics of the SQL queries built by
+:mod:`cutevariant.core.querybuilder` on the imported data: a variant is kept
+if the conditions are true for at least one of its annotations (or for the
+variant alone if it has no annotation), comparisons with NULL values are
+false, strings are compared to numbers as numbers, LIKE is case insensitive.
+Rejected variants never reach the database.
+
+.. note:: Values are tested as they are stored: the FILTER column of
+    variants that passed all filters is an empty string, not "PASS".
+
+Example::
+
+    >>> prefilter = VariantFilter("qual > 30 AND impact = 'HIGH'", bed="panel.bed")
+    >>> variants = prefilter.filter(reader.get_extra_variants())
+"""
+# Standard imports
+import re
+import operator
+from ast import literal_eval
+
+# Custom imports
+from cutevariant.core import vql
+from cutevariant.core.intervals import load_intervals, parse_region, IntervalSweep
+from cutevariant.core.reader.bedreader import BedReader
+from cutevariant.core.querybuilder import WORDSET_FUNC_NAME, REGION_FIELD_NAME
+
+# Key of the JSON objects that store tuples of conditions
+TUPLE_KEY = "__tuple__"
+
+
+def parse_where(raw_where: str) -> dict:
+    """Parse the WHERE clause of a VQL query
+
+    :param raw_where: Conditions without the WHERE keyword (``pos > 10``).
+    :return: Nested tree of conditions
+        (see :meth:`cutevariant.core.querybuilder.filters_to_sql`).
+    :rtype: <dict>
+    :raises vql.VQLSyntaxError: If the conditions are not valid.
+    """
+    return vql.parse_one_vql(f"SELECT chr FROM variants WHERE {raw_where}")["filters"]
+
+
+def serialize_filters(filters):
+    """Return the given nested tree of conditions as JSON compatible data
+
+    JSON has no tuples: tuples (IN values, sample fields, wordsets) are
+    stored as ``{"__tuple__": [...]}`` objects (see :meth:`deserialize_filters`).
+    """
+    if isinstance(filters, tuple):
+        return {TUPLE_KEY: [serialize_filters(item) for item in filters]}
+    if isinstance(filters, list):
+        return [serialize_filters(item) for item in filters]
+    if isinstance(filters, dict):
+        return {key: serialize_filters(value) for key, value in filters.items()}
+    return filters
+
+
+def deserialize_filters(data):
+    """Return the nested tree of conditions of data from :meth:`serialize_filters`"""
+    if isinstance(data, list):
+        return [deserialize_filters(item) for item in data]
+    if isinstance(data, dict):
+        if list(data) == [TUPLE_KEY]:
+            return tuple(deserialize_filters(item) for item in data[TUPLE_KEY])
+        return {key: deserialize_filters(value) for key, value in data.items()}
+    return data
+
+
+def like_to_regexp(pattern: str):
+    """Compile the given SQL LIKE pattern (% and _ wildcards) to a regexp"""
+    return re.compile(
+        "".join(
+            ".*" if char == "%" else "." if char == "_" else re.escape(char)
+            for char in pattern
+        ),
+        re.IGNORECASE | re.DOTALL,
+    )
+
+
+def coerce(value, expected):
+    """Cast the given value to a number if it is compared to a number
+
+    SQLite converts TEXT values to numbers in comparisons with numeric columns.
+    """
+    if isinstance(expected, (int, float)) and isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+def comparison(func):
+    """Return a test of a value with func; NULL values never match"""
+
+    def test(value, expected):
+        if value is None or expected is None:
+            return False
+        try:
+            return func(coerce(value, expected), coerce(expected, value))
+        except TypeError:
+            # Not comparable (str and int, etc.)
+            return False
+
+    return test
+
+
+def membership(value, expected):
+    return any(comparison(operator.eq)(value, item) for item in expected)
+
+
+OPERATORS = {
+    "=": comparison(operator.eq),
+    "!=": comparison(operator.ne),
+    ">": comparison(operator.gt),
+    ">=": comparison(operator.ge),
+    "<": comparison(operator.lt),
+    "<=": comparison(operator.le),
+    "IN": comparison(membership),
+    "NOT IN": comparison(lambda value, expected: not membership(value, expected)),
+    "LIKE": comparison(lambda value, regexp: bool(regexp.fullmatch(str(value)))),
+    "NOT LIKE": comparison(lambda value, regexp: not regexp.fullmatch(str(value))),
+    "HAS": comparison(lambda value, text: str(text).lower() in str(value).lower()),
+    "~": comparison(lambda value, regexp: bool(regexp.search(str(value)))),
+    "!~": comparison(lambda value, regexp: not regexp.search(str(value))),
+    "IS": lambda value, expected: (value is None) == (expected is None),
+    "IS NOT": lambda value, expected: (value is None) != (expected is None),
+}
+
+
+def get_field_getter(field, default_tables=None):
+    """Return a function that reads the value of the given field in a row
+
+    Rows are (variant, annotation, samples) tuples; samples are indexed by
+    their names.
+
+    :param field: Name of a field, "category.name" or sample function
+        (("sample", "boby", "gt") for ``sample["boby"].gt``).
+    :key default_tables: Names of the fields ("name" and "category.name")
+        as keys, their categories as values. Default: None, any field is
+        accepted and names without category are variant fields.
+    :raises ValueError: If the field is unknown.
+    """
+    if isinstance(field, tuple):
+        _, sample_name, field_name = field
+        return lambda row: row[2].get(sample_name, {}).get(field_name)
+
+    if default_tables is not None and field not in default_tables:
+        raise ValueError(f"Unknown field: {field}")
+
+    match = re.match(r"^(\w+)\.(\w+)$", field)
+    if match:
+        table, field = match[1], match[2]
+    elif default_tables is None:
+        table = "variants"
+    else:
+        table = default_tables[field]
+
+    if table == "variants":
+        return lambda row: row[0].get(field)
+    if table == "annotations":
+        return lambda row: row[1].get(field) if row[1] else None
+    raise ValueError(f"Field {field} of {table} can't be tested; use sample[...]")
+
+
+def compile_region(operator: str, value):
+    """Compile a condition on genomic regions (``region = 'chr1:1-1000'``)
+
+    See :meth:`cutevariant.core.querybuilder.region_to_sql`.
+
+    :return: Function that takes a (variant, annotation, samples) tuple and
+        returns a boolean.
+    :raises ValueError: If the operator or a region is not valid.
+    """
+    op = operator.upper()
+    if op not in ("=", "!=", "IN", "NOT IN"):
+        raise ValueError(f"Operator {op} can't be used with regions")
+    if op in ("IN", "NOT IN") and isinstance(value, str):
+        try:
+            value = literal_eval(value)
+        except (ValueError, SyntaxError):
+            pass
+    regions = [
+        parse_region(region)
+        for region in (value if isinstance(value, tuple) else (value,))
+    ]
+
+    def in_regions(row):
+        chrom, pos = str(row[0]["chr"]), row[0]["pos"]
+        return any(
+            chrom == region_chrom and (start is None or start <= pos <= end)
+            for region_chrom, start, end in regions
+        )
+
+    if op in ("!=", "NOT IN"):
+        return lambda row: not in_regions(row)
+    return in_regions
+
+
+def compile_filters(filters: dict, default_tables=None):
+    """Compile the given tree of conditions to a Python function
+
+    :param filters: Nested tree of conditions
+        (see :meth:`cutevariant.core.querybuilder.filters_to_sql`).
+    :key default_tables: Names of the fields as keys, their categories as
+        values. See :meth:`get_field_getter`.
+    :return: Function that takes a (variant, annotation, samples) tuple and
+        returns a boolean; None if there is no condition.
+    :raises ValueError: If a field or an operator is not supported.
+    """
+    if not filters:
+        return None
+
+    if len(filters) == 3:
+        if filters["field"] == REGION_FIELD_NAME and REGION_FIELD_NAME not in (
+            default_tables or ()
+        ):
+            return compile_region(filters["operator"], filters["value"])
+
+        getter = get_field_getter(filters["field"], default_tables)
+        op = filters["operator"].upper()
+        value = filters["value"]
+        if op not in OPERATORS:
+            raise ValueError(f"Operator {op} is not supported during the import")
+
+        if op in ("IN", "NOT IN") and isinstance(value, str):
+            # Same casting as in filters_to_sql
+            try:
+                value = literal_eval(value)
+            except ValueError:
+                pass
+        if isinstance(value, tuple) and value and value[0] == WORDSET_FUNC_NAME:
+            raise ValueError("Wordsets can't be used during the import")
+        if op in ("IN", "NOT IN") and not isinstance(value, tuple):
+            value = (value,)
+        elif op in ("IS", "IS NOT"):
+            value = None if value in ("NULL", None) else value
+        elif op in ("LIKE", "NOT LIKE"):
+            value = like_to_regexp(str(value))
+        elif op in ("~", "!~"):
+            value = re.compile(str(value))
+
+        test = OPERATORS[op]
+        return lambda row: test(getter(row), value)
+
+    # Logical operator
+    key = list(filters.keys())[0]
+    logic_op = key.upper()
+    children = [compile_filters(child, default_tables) for child in filters[key]]
+    children = [child for child in children if child]
+    if not children:
+        return None
+    if logic_op == "OR":
+        return lambda row: any(child(row) for child in children)
+    return lambda row: all(child(row) for child in children)
+
+
+class VariantFilter:
+    """Test variants parsed by readers against conditions and intervals
+
+    Attributes:
+        filters (dict): Nested tree of conditions.
+        sweep (IntervalSweep): Intervals of the BED file; None without BED file.
+        rejected_count (int): Number of variants rejected by :meth:`filter`.
+    """
+
+    def __init__(self, filters=None, bed=None, fields=None):
+        """
+        :key filters: WHERE clause of a VQL query (str) or nested tree of
+            conditions (dict).
+        :key bed: Path of a BED file (or BED data as string); variants
+            outside its intervals are rejected.
+        :key fields: Fields of the reader (dicts with "name" and "category"
+            keys); used to check and to find the category of the fields
+            used by the conditions.
+        :raises vql.VQLSyntaxError: If filters can't be parsed.
+        :raises ValueError: If a field or an operator is not supported.
+        """
+        if isinstance(filters, str):
+            filters = parse_where(filters)
+        self.filters = filters or {}
+
+        default_tables = None
+        if fields is not None:
+            default_tables = dict()
+            # Names of variants fields have the priority
+            for field in fields:
+                if field["category"] in ("variants", "annotations"):
+                    default_tables.setdefault(field["name"], field["category"])
+                    default_tables[f"{field['category']}.{field['name']}"] = field[
+                        "category"
+                    ]
+        self.condition = compile_filters(self.filters, default_tables)
+
+        self.sweep = IntervalSweep(load_intervals(BedReader(bed))) if bed else None
+        self.rejected_count = 0
+
+    def __call__(self, variant: dict) -> bool:
+        """Return True if the given variant must be imported"""
+        if self.sweep and not self.sweep.contains(variant["chr"], variant["pos"]):
+            return False
+
+        if self.condition is None:
+            return True
+
+        samples = {sample["name"]: sample for sample in variant.get("samples", ())}
+        annotations = variant.get("annotations") or [None]
+        return any(
+            self.condition((variant, annotation, samples)) for annotation in annotations
+        )
+
+    def filter(self, variants):
+        """Yield the variants that must be imported
+
+        :param variants: Variants of a reader.
+        :return: Generator of variants.
+        :rtype: <generator <dict>>
+        """
+        for variant in variants:
+            if self(variant):
+                yield variant
+            else:
+                self.rejected_count += 1
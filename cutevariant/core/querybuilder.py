@@ -49,11 +49,13 @@
 # Standard imports
 import sqlite3
 import re
-from functools import lru_cache
+from functools import lru_cache, partial
 from ast import literal_eval
 
 # Custom imports
 from cutevariant.core import sql
+from cutevariant.core import genotypes
+from cutevariant.core.intervals import parse_region
 from cutevariant.commons import logger
 
 LOGGER = logger()
@@ -64,6 +66,11 @@
 GENOTYPE_FUNC_NAME = "sample"
 # WORDSET["truc"]
 WORDSET_FUNC_NAME = "WORDSET"
+# region = 'chr1:12000-13000'
+REGION_FIELD_NAME = "region"
+# Lists of values of IN conditions longer than this are stored in temporary
+# tables (see sql.create_temp_values)
+MAX_INLINE_VALUES = 100
 
 
 def filters_to_flat(filters: dict):
@@ -111,7 +118,9 @@ def recursive_generator(filters):
     return list(recursive_generator(filters))
 
 
-def field_function_to_sql(field_function: tuple, use_as=False):
+def field_function_to_sql(
+    field_function: tuple, use_as=False, samples_ids={}, packed_genotypes=None
+):
     """Convert VQL function to a a jointure field name
 
     Examples:
@@ -120,6 +129,21 @@ def field_function_to_sql(field_function: tuple, use_as=False):
         >>> field = ("genotype", "boby", "gt")
         >>> field_function_to_sql(field)
         "`genotype_boby`.`gt`"
+
+        >>> # Packed genotypes are decoded in place
+        >>> field_function_to_sql(
+        ...     ("sample", "boby", "gt"),
+        ...     samples_ids={"boby": 1},
+        ...     packed_genotypes={"gt": {"name": "gt", "type": "int"}},
+        ... )
+        "genotype_gt(`genotypes`.`gt`, 0)"
+
+    Args:
+        samples_ids (dict): association map between samples name and id
+        packed_genotypes (dict/None): Sample fields packed in genotypes table
+            (names as keys, fields as values); None if the project doesn't
+            pack its genotypes.
+            See :meth:`get_packed_genotypes`.
     """
     func_name, arg_name, field_name = field_function
 
@@ -133,6 +157,14 @@ def field_function_to_sql(field_function: tuple, use_as=False):
     else:
         suffix = ""
 
+    if packed_genotypes is not None and field_name:
+        field = packed_genotypes.get(field_name)
+        if field and arg_name in samples_ids:
+            index = genotypes.sample_index(samples_ids[arg_name])
+            return genotypes.get_sql_expression(field, index) + suffix
+        # Unknown sample or field
+        return "NULL" + suffix
+
     if field_name:
         return f"`{func_name}_{arg_name}`.`{field_name}`" + suffix
     return f"`{func_name}_{arg_name}`" + suffix
@@ -164,9 +196,61 @@ def wordset_data_to_sql(wordset_expr: tuple):
     """
     func_name, arg_name = wordset_expr
     assert func_name == WORDSET_FUNC_NAME
+    arg_name = str(arg_name).replace("'", "''")
     return f"(SELECT value FROM wordsets WHERE name = '{arg_name}')"
 
 
+def region_to_sql(operator: str, value) -> str:
+    """Get the SQL version of a region condition (`region = 'chr1:1-1000'`)
+
+    Regions are tested on the (chr, pos) index of variants; positions are
+    1-based and both ends are included (see
+    :meth:`cutevariant.core.intervals.parse_region`).
+
+    Example:
+
+        .. code-block:: sql
+
+            SELECT ... WHERE region IN ('chr1:12000-13000', 'chr2')
+            -- will be replaced by:
+            SELECT ... WHERE ((`variants`.`chr` = 'chr1' AND `variants`.`pos`
+            BETWEEN 12000 AND 13000) OR (`variants`.`chr` = 'chr2'))
+
+    Args:
+        operator (str): =, !=, IN or NOT IN
+        value (str/tuple): Region or tuple of regions
+    Returns:
+        (str): SQL expression
+    Raises:
+        ValueError: If the operator or a region is not valid
+    """
+    operator = operator.upper()
+    if operator not in ("=", "!=", "IN", "NOT IN"):
+        raise ValueError(f"Operator {operator} can't be used with regions")
+
+    if operator in ("IN", "NOT IN") and isinstance(value, str):
+        try:
+            value = literal_eval(value)
+        except (ValueError, SyntaxError):
+            pass
+    regions = value if isinstance(value, tuple) else (value,)
+
+    conditions = []
+    for region in regions:
+        chrom, start, end = parse_region(region)
+        condition = "`variants`.`chr` = '%s'" % chrom.replace("'", "''")
+        if start is not None:
+            condition += f" AND `variants`.`pos` BETWEEN {start} AND {end}"
+        conditions.append(f"({condition})")
+
+    sql_filter = " OR ".join(conditions)
+    if len(conditions) > 1:
+        sql_filter = f"({sql_filter})"
+    if operator in ("!=", "NOT IN"):
+        sql_filter = f"NOT {sql_filter}"
+    return sql_filter
+
+
 def wordset_data_to_vql(wordset_expr: tuple):
     """Get the VQL version of a Wordset expression (`(WORDSET', 'boby')`)
 
@@ -207,12 +291,118 @@ def fields_to_vql(field) -> str:
     return field
 
 
-def fields_to_sql(field, default_tables={}, use_as=False) -> str:
+def get_dictionary_field(field, default_tables={}, dictionary_fields=()):
+    """Return the name of the annotation field if its values are encoded
+
+    Args:
+        field (str or tuple): Column name from a table
+        default_tables (dict, optional): association between field name and table origin
+        dictionary_fields (set, optional): Encoded annotation fields.
+            See :meth:`get_dictionary_fields`.
+
+    Returns:
+        (str/None): Name of the field; None if the field is not encoded.
+
+    Examples:
+        >>> get_dictionary_field("annotations.impact", dictionary_fields={"impact"})
+        "impact"
+    """
+    if not dictionary_fields or isinstance(field, tuple):
+        return None
+
+    match = re.match(r"^(\w+)\.(\w+)", field)
+    if match:
+        table, field = match[1], match[2]
+    else:
+        table = default_tables.get(field)
+
+    if table == "annotations" and field in dictionary_fields:
+        return field
+    return None
+
+
+def fts_filter_to_sql(
+    field, operator: str, value, default_tables={}, fts_fields={}
+):
+    """Return a condition on a full-text index of the given field
+
+    Conditions on fields indexed by FTS5 trigram tables (see
+    :meth:`cutevariant.core.sql.create_fts_indexes`) are rewritten to
+    subqueries on these tables, when they search at least 3 characters:
+
+        - `field HAS 'text'` (case insensitive substring) and `field ~ 'text'`
+          (regular expression without special characters) are tested with
+          MATCH; regular expressions are then checked on the matching rows;
+        - `field LIKE 'pattern'` is tested on the FTS table, where LIKE uses
+          the index.
+
+    Args:
+        field (str or tuple): Field name
+        operator (str): Upper case operator (HAS, LIKE, REGEXP)
+        value: Value of the condition
+        default_tables (dict, optional): association between field name and table origin
+        fts_fields (dict, optional): Indexed fields by table.
+            See :meth:`get_fts_fields`.
+
+    Returns:
+        (str/None): SQL condition; None if the condition can't use the index.
+
+    Examples:
+        >>> fts_filter_to_sql("gene", "HAS", "CFT", {"gene": "annotations"},
+        ...     {"annotations": ["gene"]})
+        "`annotations`.`rowid` IN (SELECT rowid FROM fts_annotations WHERE ..."
+    """
+    if not fts_fields or isinstance(field, tuple) or not isinstance(value, str):
+        return None
+
+    match = re.match(r"^(\w+)\.(\w+)$", field)
+    if match:
+        table, column = match[1], match[2]
+    else:
+        table, column = default_tables.get(field), field
+    if column not in fts_fields.get(table, ()):
+        return None
+
+    rowid = "`variants`.`id`" if table == "variants" else "`annotations`.`rowid`"
+    quoted = value.replace("'", "''")
+    phrase = quoted.replace('"', '""')
+    subquery = f"{rowid} IN (SELECT rowid FROM fts_{table} WHERE \"{column}\" %s)"
+
+    if operator == "HAS" and len(value) >= 3:
+        return subquery % f"MATCH '\"{phrase}\"'"
+
+    if operator == "LIKE" and re.search(r"[^%_]{3}", value):
+        return subquery % f"LIKE '{quoted}'"
+
+    if operator == "REGEXP" and re.fullmatch(r"[^.^$*+?{}\[\]\\|()]{3,}", value):
+        return "(%s AND `%s`.`%s` REGEXP '%s')" % (
+            subquery % f"MATCH '\"{phrase}\"'",
+            table,
+            column,
+            quoted,
+        )
+    return None
+
+
+def fields_to_sql(
+    field,
+    default_tables={},
+    use_as=False,
+    samples_ids={},
+    packed_genotypes=None,
+    dictionary_fields=(),
+) -> str:
     """Return field as SQL syntax
 
     Args:
         field (str or tuple): Column name from a table
         default_tables (dict, optional): association between field name and table origin
+        samples_ids (dict, optional): association map between samples name and id
+        packed_genotypes (dict/None, optional): Sample fields packed in
+            genotypes table. See :meth:`field_function_to_sql`.
+        dictionary_fields (set, optional): Encoded annotation fields; their
+            values are read from annotation_dictionary table.
+            See :meth:`get_dictionary_fields`.
 
     Returns:
         str: Sql field
@@ -230,7 +420,12 @@ def fields_to_sql(field, default_tables={}, use_as=False) -> str:
     if isinstance(field, tuple):
         # If it is "genotype.name.truc then it is field function"
         # ("genotype", "boby", "gt") => `genotype_boby`.GT
-        return field_function_to_sql(field, use_as)
+        return field_function_to_sql(field, use_as, samples_ids, packed_genotypes)
+
+    dictionary_field = get_dictionary_field(field, default_tables, dictionary_fields)
+    if dictionary_field:
+        sql_field = sql.get_decoded_annotation_field(dictionary_field)
+        return f"{sql_field} AS `{dictionary_field}`" if use_as else sql_field
 
     # extract variants.chr => (variants, chr) => `variants`.`chr`
     match = re.match(r"^(\w+)\.(\w+)", field)
@@ -249,12 +444,33 @@ def fields_to_sql(field, default_tables={}, use_as=False) -> str:
     return f"`{table}`.`{field}`"
 
 
-def filters_to_sql(filters, default_tables={}):
+def filters_to_sql(
+    filters,
+    default_tables={},
+    samples_ids={},
+    packed_genotypes=None,
+    dictionary_fields=(),
+    fts_fields={},
+    temp_values=None,
+):
     """Return filters as SQL syntax
 
     Args:
         filters (dict): Nested tree of conditions
         default_tables (dict, optional): Association between field names and tables
+        samples_ids (dict, optional): association map between samples name and id
+        packed_genotypes (dict/None, optional): Sample fields packed in
+            genotypes table. See :meth:`field_function_to_sql`.
+        dictionary_fields (set, optional): Encoded annotation fields;
+            conditions are tested on annotation_dictionary table and the
+            matching codes are searched in annotations table.
+            See :meth:`get_dictionary_fields`.
+        fts_fields (dict, optional): Fields with full-text indexes by table;
+            substring searches use the indexes. See :meth:`fts_filter_to_sql`.
+        temp_values (callable, optional): Function that stores a list of
+            values in a temporary table and returns a subquery on it; used
+            for the lists of IN conditions longer than `MAX_INLINE_VALUES`.
+            See :meth:`cutevariant.core.sql.create_temp_values`.
 
     Returns:
         str: SQL WHERE expression
@@ -264,7 +480,11 @@ def filters_to_sql(filters, default_tables={}):
         "`variants`.`pos` > 34 AND `variants`.`af` = 10"
 
     Note:
-        There is a recursive function inside to parse the nested tree of conditions
+        There is a recursive function inside to parse the nested tree of conditions.
+        The `region` pseudo field tests genomic regions (unless the project
+        has a field with this name). See :meth:`region_to_sql`.
+        `field HAS 'text'` is true if the field contains the text (case
+        insensitive).
     """
 
     def is_field(node):
@@ -275,14 +495,33 @@ def recursive(node):
             return ""
 
         if is_field(node):
+            if (
+                node["field"] == REGION_FIELD_NAME
+                and REGION_FIELD_NAME not in default_tables
+            ):
+                # Not a field of the project: genomic regions
+                return region_to_sql(node["operator"], node["value"])
+
             # print("Node to SQL", node)
-            field = fields_to_sql(node["field"], default_tables)
+            field = fields_to_sql(
+                node["field"],
+                default_tables,
+                samples_ids=samples_ids,
+                packed_genotypes=packed_genotypes,
+                dictionary_fields=dictionary_fields,
+            )
             value = node["value"]
             operator = node["operator"].upper()
 
             if operator == "~":
                 operator = "REGEXP"
 
+            fts_filter = fts_filter_to_sql(
+                node["field"], operator, value, default_tables, fts_fields
+            )
+            if fts_filter:
+                return fts_filter
+
             if operator in ("IN", "NOT IN") and isinstance(value, str):
                 # node: {'field': 'ref', 'operator': 'IN', 'value': "('A', 'T', 'G', 'C')"}
                 # wanted: "ref IN ('A', 'T', 'G', 'C')"
@@ -305,10 +544,34 @@ def recursive(node):
                 # => Get SQL statement
                 if value[0] == WORDSET_FUNC_NAME:
                     value = wordset_data_to_sql(value)
+                elif temp_values and len(value) > MAX_INLINE_VALUES:
+                    # Long list: bound in a temporary table (semi-join)
+                    value = "(%s)" % temp_values(value)
                 elif len(value) == 1:
                     # Remove trailing comma in tuple with 1 element ("xxx",)
                     value = str(value).replace(",", "")
 
+            if operator == "HAS":
+                # Substring: escape the wildcards of LIKE
+                operator = "LIKE"
+                value = re.sub(r"([%_\\])", r"\\\1", str(node["value"]))
+                value = "'%%%s%%' ESCAPE '\\'" % value.replace("'", "''")
+
+            dictionary_field = get_dictionary_field(
+                node["field"], default_tables, dictionary_fields
+            )
+            if dictionary_field and operator not in ("IS", "IS NOT"):
+                # Test the values of the dictionary, then search their codes
+                return (
+                    f"`annotations`.`{dictionary_field}` IN (SELECT code FROM "
+                    f"annotation_dictionary WHERE field = '{dictionary_field}' "
+                    f"AND value {operator} {value})"
+                )
+
+            if dictionary_field:
+                # NULL values are not encoded
+                field = f"`annotations`.`{dictionary_field}`"
+
             # Strings must be space separated because of operators (IN, etc.)
             return "%s %s %s" % (field, operator, value)
 
@@ -406,6 +669,137 @@ def recursive(node):
     return vql_filters
 
 
+def get_keyset_fields(fields, order_by=None, default_tables={}):
+    """Return the fields that sort the rows of a query in a unique order
+
+    Rows are sorted by the order_by field then by `variants.id`. The rows of
+    a variant differ only by their annotations: selected annotation fields
+    are added to break the remaining ties (other fields have 1 value per
+    variant and per sample).
+
+    Args:
+        fields (list): Selected fields
+        order_by (str/None): Order by field
+        default_tables (dict): association between field name and table origin
+
+    Returns:
+        (list): Fields of the sort key, order_by first.
+
+    Examples:
+        >>> get_keyset_fields(["chr", "gene"], "pos", {"gene": "annotations"})
+        ["pos", "variants.id", "gene"]
+    """
+    keyset_fields = [order_by] if order_by else []
+    if order_by not in ("id", "variants.id"):
+        keyset_fields.append("variants.id")
+    for field in fields:
+        if isinstance(field, tuple) or field in keyset_fields:
+            continue
+        match = re.match(r"^(\w+)\.(\w+)", field)
+        table = match[1] if match else default_tables.get(field)
+        if table == "annotations":
+            keyset_fields.append(field)
+    return keyset_fields
+
+
+def get_keyset_cursor(variant: dict, keyset_fields) -> tuple:
+    """Return the position of the given row in the order of a keyset query
+
+    Args:
+        variant (dict): Row returned by :meth:`cutevariant.core.command.select_cmd`
+        keyset_fields (list): Fields of the sort key. See :meth:`get_keyset_fields`.
+
+    Returns:
+        (tuple): Values of the sort key; cursor of :meth:`build_sql_query`.
+
+    Raises:
+        KeyError: If a field of the sort key is not in the row.
+    """
+    return tuple(
+        variant[
+            fields_to_vql(field) if isinstance(field, tuple) else field.split(".")[-1]
+        ]
+        for field in keyset_fields
+    )
+
+
+def keyset_to_sql(sql_fields, cursor, descending=False, params=None):
+    """Return the conditions of the rows after the cursor in the given order
+
+    NULL values are lower than any other value, like in SQLite sorts.
+
+    The first field is bounded (`>=` or `<=` the cursor) so that SQLite seeks
+    to the cursor in an index of this field instead of scanning the rows
+    before it. In descending order, the NULL values of the first field come
+    after the others but are excluded by the bound: they are selected by a
+    second condition.
+
+    Values of the cursor are bound as named parameters (`:keyset_0`, etc.).
+
+    Args:
+        sql_fields (list): SQL expressions of the sort key
+        cursor (tuple): Values of the sort key of the last row seen
+        descending (bool): Rows sorted in descending order
+        params (dict): Named parameters of the query; the values of the
+            cursor are added to it.
+
+    Returns:
+        list: SQL WHERE expressions; the rows after the cursor are the rows of
+            the first expression, then the rows of the second one (if any).
+
+    Examples:
+        >>> params = {}
+        >>> keyset_to_sql(["`variants`.`pos`"], (10,), params=params)
+        ["(`variants`.`pos` >= :keyset_0 AND (`variants`.`pos` > :keyset_0))"]
+        >>> params
+        {"keyset_0": 10}
+    """
+    if params is None:
+        params = {}
+
+    placeholders = []
+    for index, value in enumerate(cursor):
+        placeholders.append(f":keyset_{index}")
+        if value is not None:
+            params[f"keyset_{index}"] = value
+
+    def after(field, value, placeholder, nulls_after=True):
+        if value is None:
+            # Only non NULL values are greater than NULL
+            return "0" if descending else f"{field} IS NOT NULL"
+        if descending:
+            if nulls_after:
+                return f"({field} < {placeholder} OR {field} IS NULL)"
+            return f"{field} < {placeholder}"
+        return f"{field} > {placeholder}"
+
+    def equal(field, value, placeholder):
+        return f"{field} IS NULL" if value is None else f"{field} = {placeholder}"
+
+    items = list(zip(sql_fields, cursor, placeholders))
+    terms = []
+    for index, (field, value, placeholder) in enumerate(items):
+        equalities = [equal(*item) for item in items[:index]]
+        # NULL values of the first field are selected by another condition
+        conditions = equalities + [after(field, value, placeholder, index > 0)]
+        if len(conditions) == 1:
+            terms.append(conditions[0])
+        else:
+            terms.append("(" + " AND ".join(conditions) + ")")
+    condition = "(" + " OR ".join(terms) + ")"
+
+    field, value, placeholder = items[0]
+    if value is None:
+        # No bound: NULL values are at the beginning of the index
+        return [condition]
+
+    bound = f"{field} {'<=' if descending else '>='} {placeholder}"
+    conditions = [f"({bound} AND {condition})"]
+    if descending:
+        conditions.append(f"{field} IS NULL")
+    return conditions
+
+
 def build_vql_query(fields, source="variants", filters={}, group_by=[], having={}):
     """Build VQL SELECT query
 
@@ -444,6 +838,14 @@ def build_sql_query(
     having={},  # {"op":">", "value": 3  }
     default_tables={},
     samples_ids={},
+    packed_genotypes=None,
+    dictionary_fields=(),
+    fts_fields={},
+    temp_values=None,
+    keyset=False,
+    cursor=None,
+    backward=False,
+    params=None,
     **kwargs,
 ):
     """Build SQL SELECT query
@@ -461,10 +863,57 @@ def build_sql_query(
         group_by (list/None): list of field you want to group
         default_tables (dict): association map between fields and sql table origin
         samples_ids (dict): association map between samples name and id
+        packed_genotypes (dict/None): Sample fields packed in genotypes table;
+            they are decoded in place instead of joining sample_has_variant
+            table for each sample. See :meth:`field_function_to_sql`.
+            Note: sample_has_variant is INNER JOINed, so variants without a
+            row for a selected sample (e.g. variants imported before the
+            sample was appended) are not returned; genotypes is LEFT JOINed,
+            so such variants are returned with missing values (gt -1, NULL).
+            Filter on the sample gt (e.g. `gt != -1`) to get the same rows.
+        dictionary_fields (set): Encoded annotation fields; their values are
+            decoded from annotation_dictionary table.
+            See :meth:`get_dictionary_fields`.
+        fts_fields (dict): Fields with full-text indexes by table.
+            See :meth:`get_fts_fields`.
+        temp_values (callable/None): Function that stores the long lists of
+            values of IN conditions in temporary tables.
+            See :meth:`filters_to_sql`.
+        keyset (bool): Sort rows in a unique order (order_by, variants.id
+            and selected annotation fields) to page them with cursors
+            instead of OFFSET. See :meth:`get_keyset_fields`.
+        cursor (tuple/None): Position of the last row of the previous page;
+            only the rows after it are returned (keyset pagination: SQLite
+            seeks to the cursor instead of scanning the skipped rows).
+            Implies keyset. See :meth:`get_keyset_cursor`.
+        backward (bool): Return the rows before the cursor, in reverse order
+            (previous page).
+        params (dict/None): Named parameters of the query; the values of the
+            cursor are added to it (see :meth:`keyset_to_sql`). Required with
+            cursor.
+
+    Raises:
+        ValueError: If keyset pagination is used with group_by, or if a cursor
+            is given without params.
     """
+    keyset = keyset or cursor is not None
+    if keyset and group_by:
+        raise ValueError("Keyset pagination can't be used with GROUP BY")
+    if cursor is not None and params is None:
+        raise ValueError("The values of the cursor are bound to params")
+
+    # Arguments of fields_to_sql for sample fields and encoded annotations
+    genotype_kwargs = {
+        "samples_ids": samples_ids,
+        "packed_genotypes": packed_genotypes,
+        "dictionary_fields": dictionary_fields,
+    }
+
     # Create fields
     sql_fields = ["`variants`.`id`"] + [
-        fields_to_sql(col, default_tables, use_as=True) for col in fields if col != "id"
+        fields_to_sql(col, default_tables, use_as=True, **genotype_kwargs)
+        for col in fields
+        if col != "id"
     ]
 
     # if group_by:
@@ -521,6 +970,12 @@ def build_sql_query(
     samples = set(samples)
 
     ## Create Sample Join
+    if packed_genotypes is not None:
+        # All the samples are in the same row
+        if samples:
+            sql_query += " LEFT JOIN genotypes ON genotypes.variant_id = variants.id"
+        samples = set()
+
     for sample_name in samples:
         # Optimisation ?
         # sample_id = self.cache_samples_ids[sample_name]
@@ -529,27 +984,73 @@ def build_sql_query(
             sql_query += f""" INNER JOIN sample_has_variant `{GENOTYPE_FUNC_NAME}_{sample_name}` ON `{GENOTYPE_FUNC_NAME}_{sample_name}`.variant_id = variants.id AND `{GENOTYPE_FUNC_NAME}_{sample_name}`.sample_id = {sample_id}"""
 
     # Add Where Clause
+    where_clause = ""
     if filters:
-        where_clause = filters_to_sql(filters, default_tables)
-        if where_clause:
-            sql_query += " WHERE " + where_clause
+        where_clause = filters_to_sql(
+            filters,
+            default_tables,
+            fts_fields=fts_fields,
+            temp_values=temp_values,
+            **genotype_kwargs,
+        )
+
+    # Rows after the cursor: consecutive sets of rows (see keyset_to_sql)
+    keyset_clauses = [None]
+    if keyset:
+        keyset_fields = [
+            fields_to_sql(field, default_tables, **genotype_kwargs)
+            for field in get_keyset_fields(fields, order_by, default_tables)
+        ]
+        # Sort order of the rows, reversed to read previous pages
+        descending = bool(order_by and order_desc) != backward
+        if cursor is not None:
+            keyset_clauses = keyset_to_sql(keyset_fields, cursor, descending, params)
 
     # Add Group By
+    group_by_clause = ""
     if group_by:
-        sql_query += " GROUP BY " + ",".join(
-            [fields_to_sql(g, default_tables, use_as=False) for g in group_by]
+        group_by_clause = " GROUP BY " + ",".join(
+            [
+                fields_to_sql(g, default_tables, use_as=False, **genotype_kwargs)
+                for g in group_by
+            ]
         )
         if having:
             operator = having["op"]
             val = having["value"]
-            sql_query += f" HAVING count {operator} {val}"
+            group_by_clause += f" HAVING count {operator} {val}"
 
     # Add Order By
-    if order_by:
+    order_by_clause = ""
+    if keyset:
+        orientation = "DESC" if descending else "ASC"
+        order_by_clause = " ORDER BY " + ",".join(
+            f"{field} {orientation}" for field in keyset_fields
+        )
+    elif order_by:
         # TODO : sqlite escape field with quote
         orientation = "DESC" if order_desc else "ASC"
-        order_by = fields_to_sql(order_by, default_tables)
-        sql_query += f" ORDER BY {order_by} {orientation}"
+        order_by = fields_to_sql(order_by, default_tables, **genotype_kwargs)
+        order_by_clause = f" ORDER BY {order_by} {orientation}"
+
+    queries = []
+    for keyset_clause in keyset_clauses:
+        conditions = [clause for clause in (where_clause, keyset_clause) if clause]
+        query = sql_query
+        if len(conditions) == 1:
+            query += " WHERE " + conditions[0]
+        elif conditions:
+            query += f" WHERE ({where_clause}) AND {keyset_clause}"
+        queries.append(query + group_by_clause + order_by_clause)
+
+    if len(queries) > 1:
+        # Sets of rows are read one after the other, each one with its index
+        inner_limit = limit + offset if limit else -1
+        sql_query = " UNION ALL ".join(
+            f"SELECT * FROM ({query} LIMIT {inner_limit})" for query in queries
+        )
+    else:
+        sql_query = queries[0]
 
     if limit:
         sql_query += f" LIMIT {limit} OFFSET {offset}"
@@ -605,6 +1106,10 @@ def build_full_sql_query(
         having=having,
         default_tables=default_tables,
         samples_ids=sample_ids,
+        packed_genotypes=get_packed_genotypes(conn),
+        dictionary_fields=get_dictionary_fields(conn),
+        fts_fields=get_fts_fields(conn),
+        temp_values=partial(sql.create_temp_values, conn),
         **kwargs,
     )
     return query
@@ -626,3 +1131,50 @@ def get_default_tables_and_sample_ids(conn):
     sample_ids = {i["name"]: i["id"] for i in sql.get_samples(conn)}
 
     return default_tables, sample_ids
+
+
+@lru_cache()
+def get_packed_genotypes(conn):
+    """Handy function to cache the sample fields packed in genotypes table
+
+    This function is used for every queries built in :meth:`build_full_sql_query`
+
+    Returns:
+        (dict/None): Names of sample fields as keys, fields as values;
+            None if the genotypes of the project are not packed.
+    """
+    if not sql.has_packed_genotypes(conn):
+        return None
+    return {
+        field["name"]: field
+        for field in sql.get_field_by_category(conn, "samples")
+        if genotypes.is_packable(field)
+    }
+
+
+@lru_cache()
+def get_dictionary_fields(conn):
+    """Handy function to cache the encoded annotation fields
+
+    This function is used for every queries built in :meth:`build_full_sql_query`
+
+    Warnings:
+        Do not forget to clear this cache after an import; encoded fields can
+        be decoded when new values are added.
+
+    Returns:
+        (frozenset): Names of the annotation fields stored as integer codes.
+    """
+    return frozenset(sql.get_annotation_dictionary_settings(conn)[0])
+
+
+@lru_cache()
+def get_fts_fields(conn):
+    """Handy function to cache the fields with full-text indexes
+
+    This function is used for every queries built in :meth:`build_full_sql_query`
+
+    Returns:
+        (dict): Tables as keys, lists of indexed fields as values.
+    """
+    return sql.get_fts_fields(conn)
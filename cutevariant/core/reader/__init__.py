@@ -1,7 +1,9 @@
 """Expose of high-level reader classes"""
 from .vcfreader import VcfReader
+from .vcftokenizer import VcfTokenizer
 from .csvreader import CsvReader
 from .fakereader import FakeReader
 from .bedreader import BedReader
 from .pedreader import PedReader
+from .bgzf import BgzfReader, open_gzip
 from .abstractreader import check_field_schema, check_variant_schema
@@ -1,11 +1,48 @@
 from abc import ABC, abstractmethod
 import io
-import gzip
+import os
+import itertools as it
 from collections import Counter
 import cutevariant.commons as cm
 
 LOGGER = cm.logger()
 
+try:
+    import numpy as np
+except ImportError:
+    # Genotype counters are computed variant by variant
+    np = None
+    LOGGER.debug("NumPy is not available: genotype counters will not be vectorized")
+
+# Number of variants whose genotype counters are computed at once
+COUNTER_CHUNK_SIZE = 1000
+
+# Fields always imported whatever the selection of fields (category, name)
+MANDATORY_FIELDS = (
+    ("variants", "chr"),
+    ("variants", "pos"),
+    ("variants", "ref"),
+    ("variants", "alt"),
+    ("samples", "gt"),
+)
+
+
+def match_field(field: dict, names) -> bool:
+    """Return True if the given field is designated by one of the given names
+
+    Names are either names of fields of any category ("dp"), or names
+    prefixed by a category ("samples.dp").
+
+    Examples:
+        >>> match_field({"name": "dp", "category": "samples"}, ["dp"])
+        True
+        >>> match_field({"name": "dp", "category": "samples"}, ["variants.dp"])
+        False
+    """
+    return (
+        field["name"] in names or f"{field['category']}.{field['name']}" in names
+    )
+
 
 class AbstractReader(ABC):
     """Base class for all Readers required to import variants into the database.
@@ -16,13 +53,18 @@ class AbstractReader(ABC):
 
         device: A file object typically returned by open(); Can be None if
             FakeReader type is instanciated.
-        file_size: File size in bytes
+        file_size: File size in bytes (compressed size for gz files)
             See Also: :meth:`self.get_total_file_size`
-        number_lines: Number of lines in the file (compressed or not).
-            See Also: :meth:`self.compute_number_lines`
-        read_bytes: Current bytes readed (progression = read_bytes / file_size)
-            It's a fallback if number_lines can't be computed.
+        read_bytes: Current position in bytes in the file (compressed
+            position for gz files); progression = read_bytes / file_size
+            See Also: :meth:`self.get_progress`
         samples: List of samples in the file (default: empty)
+        included_fields: Names of the fields to import (default: None, all);
+            See Also: :meth:`select_fields`
+        excluded_fields: Names of the fields not to import
+        included_samples: Names of the samples to import (default: None, all);
+            See Also: :meth:`select_samples`
+        excluded_samples: Names of the samples not to import
 
     Example:
         >>> with open(filename,"r") as file:
@@ -32,12 +74,13 @@ class AbstractReader(ABC):
 
     def __init__(self, device):
         self.device = device
-        self.number_lines = None
-        self.read_bytes = 0
         self.samples = list()
+        self.included_fields = None
+        self.excluded_fields = set()
+        self.included_samples = None
+        self.excluded_samples = set()
 
         self.file_size = self.get_total_file_size()
-        self.compute_number_lines()
 
     @classmethod
     @abstractmethod
@@ -121,6 +164,66 @@ def get_samples(self) -> list:
         """
         return []
 
+    def select_fields(self, include=None, exclude=None):
+        """Choose the fields of the file to be imported
+
+        Fields are designated by their names ("dp"), or by their names
+        prefixed by their category ("samples.dp").
+        Mandatory fields (chr, pos, ref, alt, gt) are always selected;
+        extra fields (see :meth:`get_extra_fields`) are not concerned.
+
+        Readers that support the selection don't decode the values of the
+        fields that are not selected.
+
+        Args:
+            include (list/None): Allow list; None to select all the fields.
+            exclude (list/None): Deny list, applied after the allow list.
+        """
+        self.included_fields = None if include is None else set(include)
+        self.excluded_fields = set(exclude or ())
+
+    def select_samples(self, include=None, exclude=None):
+        """Choose the samples of the file to be imported
+
+        Args:
+            include (list/None): Allow list; None to select all the samples.
+            exclude (list/None): Deny list, applied after the allow list.
+        """
+        self.included_samples = None if include is None else set(include)
+        self.excluded_samples = set(exclude or ())
+
+    def is_field_selected(self, field: dict) -> bool:
+        """Return True if the given field is imported
+
+        See Also: :meth:`select_fields`
+        """
+        if (field["category"], field["name"]) in MANDATORY_FIELDS:
+            return True
+        if self.included_fields is not None and not match_field(
+            field, self.included_fields
+        ):
+            return False
+        return not match_field(field, self.excluded_fields)
+
+    def filter_fields(self, fields):
+        """Yield the selected fields among the given ones
+
+        See Also: :meth:`select_fields`
+        """
+        return (field for field in fields if self.is_field_selected(field))
+
+    def filter_samples(self, samples) -> list:
+        """Return the selected samples among the given names
+
+        See Also: :meth:`select_samples`
+        """
+        return [
+            name
+            for name in samples
+            if (self.included_samples is None or name in self.included_samples)
+            and name not in self.excluded_samples
+        ]
+
     def get_metadatas(self) -> dict:
         """Get meta data
 
@@ -293,65 +396,15 @@ def get_extra_variants(self, **kwargs):
         Raises:
             AssertionError: If sample(s) are both in cases and controls.
         """
-        case_and_control_samples_found = False
-        if "case" in kwargs and "control" in kwargs:
-            # Samples can't be both in cases and controls
-            case_samples = kwargs["case"]
-            control_samples = kwargs["control"]
-            assert not set(case_samples) & set(control_samples), \
-                "Found sample both in cases and controls!"
-            case_and_control_samples_found = True
-
-        for variant in self.get_variants():
-            variant["favorite"] = False
-            variant["comment"] = ""
-            variant["classification"] = 3
-
-            # For now set the first annotation as a major transcripts
-            if "annotations" in variant:
-                variant["annotation_count"] = len(variant["annotations"])
-
-            # Count genotype by control and case
-            genotype_counter = Counter()
-            if "samples" in variant:
-                for sample in variant["samples"]:
-                    genotype_counter[sample["gt"]] += 1
-
-            variant["count_hom"] = genotype_counter[2]
-            variant["count_het"] = genotype_counter[1]
-            variant["count_ref"] = genotype_counter[0]
-            # Number of variants (not 0/0)
-            variant["count_var"] = genotype_counter[1] + genotype_counter[2]
-
-            variant["is_indel"] = len(variant["ref"]) != len(variant["alt"])
-            variant["is_snp"] = len(variant["ref"]) == len(variant["alt"])
-
-            # Count genotype by control and case
-            if case_and_control_samples_found:
-
-                case_counter = Counter()
-                control_counter = Counter()
-
-                if "samples" in variant:
-                    # Note: No garantee that samples from DB are all qualified
-                    # by PED data.
-                    # So some samples from variants may not be in case/control samples.
-                    for sample in variant["samples"]:
-                        if sample["name"] in case_samples:
-                            case_counter[sample["gt"]] += 1
-
-                        elif sample["name"] in control_samples:
-                            control_counter[sample["gt"]] += 1
-
-                variant["case_count_hom"] = case_counter[2]
-                variant["case_count_het"] = case_counter[1]
-                variant["case_count_ref"] = case_counter[0]
-
-                variant["control_count_hom"] = control_counter[2]
-                variant["control_count_het"] = control_counter[1]
-                variant["control_count_ref"] = control_counter[0]
-
-            yield variant
+        case_samples, control_samples = get_case_control_samples(**kwargs)
+        counter = GenotypeCounter(self.get_samples(), case_samples, control_samples)
+
+        variants = iter(self.get_variants())
+        while True:
+            chunk = list(it.islice(variants, COUNTER_CHUNK_SIZE))
+            if not chunk:
+                break
+            yield from counter.compute_extra_fields(chunk)
 
     def get_extra_fields_by_category(self, category: str):
         """Syntaxic suggar to get fields according their category
@@ -380,75 +433,299 @@ def get_variants_count(self) -> int:
         """
         return len(tuple(self.get_variants()))
 
+    def set_start_offset(self, offset) -> bool:
+        """Start the reading of the variants at the record at the given offset
+
+        Readers that support it set the offset of the record of each variant
+        in its :data:`cutevariant.commons.RECORD_OFFSET_KEY` key; an
+        interrupted import is resumed from there without parsing the records
+        before it.
+
+        Override this method to support offsets.
+
+        Args:
+            offset (int): Offset of a record, taken from a variant
+
+        Returns:
+            bool: False if the reader doesn't support offsets; the variants
+            are read from the beginning of the file.
+        """
+        return False
+
+    def get_raw_device(self):
+        """Return the file object of the file on disk wrapped by the device
+
+        Text devices are opened over a binary buffer; gzip devices are
+        opened over the compressed file.
+        """
+        device = getattr(self.device, "buffer", self.device)
+        return getattr(device, "fileobj", device)
+
     def get_total_file_size(self) -> int:
-        """Compute file size int bytes"""
+        """Compute file size in bytes
+
+        For compressed files, this is the size of the compressed data;
+        there is no need to decompress them.
+        """
         # FakeReader is used ?
         if not self.device:
             return 0
 
-        filename = self.device.name
+        device = self.get_raw_device()
+        try:
+            return os.fstat(device.fileno()).st_size
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            # In memory file: go to EOF and get position in bytes
+            position = device.tell()
+            size = device.seek(0, 2)
+            device.seek(position)
+            return size
+
+    @property
+    def read_bytes(self) -> int:
+        """Get the current position in bytes in the file on disk
+
+        The position is taken from the file under the buffers of the
+        device; for compressed files, it is the number of compressed bytes
+        read so far.
+        """
+        # FakeReader is used ?
+        if not self.device:
+            return 0
 
-        if cm.is_gz_file(filename):
-            return cm.get_uncompressed_size(filename)
-        # Go to EOF and get position in bytes
-        size = self.device.seek(0, 2)
-        # Rewind the file
-        self.device.seek(0)
-        return size
+        try:
+            return self.get_raw_device().tell()
+        except (OSError, ValueError):
+            # Closed file or file not seekable
+            return 0
 
-    def compute_number_lines(self):
-        """Get a sample of lines in file if possible and if the end of file is
-        not reached compute an evaluation of the global number of lines.
+    def get_progress(self) -> float:
+        """Get the progression of the reading of the file
 
-        Returns:
-            Nothing but sets `self.number_lines` attribute.
+        :return: Percentage of the bytes of the file already read.
         """
+        if not self.file_size:
+            return 0
+        return min(self.read_bytes / self.file_size * 100, 100)
+
+
+def get_case_control_samples(**kwargs):
+    """Return case and control sample names given to get_extra_variants
+
+    Args:
+        **kwargs (optional): case and control sample names
+
+    Returns:
+        (tuple): case and control samples; (None, None) if they are not
+            both given.
+
+    Raises:
+        AssertionError: If sample(s) are both in cases and controls.
+    """
+    if "case" in kwargs and "control" in kwargs:
+        # Samples can't be both in cases and controls
+        case_samples = kwargs["case"]
+        control_samples = kwargs["control"]
+        assert not set(case_samples) & set(control_samples), \
+            "Found sample both in cases and controls!"
+        return case_samples, control_samples
+    return None, None
 
-        def find_lines_in_text_file(text_file_handler):
-            """Get first 15000 lines
-
-            PS: don't care of headers (# lines), the influence is marginal on big
-            files and also on small files (so quick to insert that the wrong number
-            of lines is invisible).
-            """
-            first_lines = []
-            for _ in range(15000):
-                try:
-                    first_lines.append(len(next(text_file_handler)))
-                except StopIteration:
-                    # EOF: exact number of lines is known
-                    self.number_lines = len(first_lines)
-                    break
-
-            if self.number_lines is None:
-                self.number_lines = int(
-                    self.file_size / (sum(first_lines) / len(first_lines))
-                )
 
-            LOGGER.debug(
-                "nb lines evaluated: %s; size: %s; lines used: %s",
-                self.number_lines,
-                self.file_size,
-                len(first_lines),
+def compute_extra_fields(variant, case_samples=None, control_samples=None):
+    """Add extra information to the given variant
+
+    This function is used by :meth:`AbstractReader.get_extra_variants` and
+    must stay at the module level: parallel readers call it from worker
+    processes.
+
+    .. note:: The given variant is modified in place.
+
+    .. seealso:: :class:`GenotypeCounter` to process many variants at once.
+
+    Args:
+        variant (dict): A variant as yielded by get_variants()
+        case_samples (list): Case sample names; None if not available
+        control_samples (list): Control sample names; None if not available
+
+    Returns:
+        (dict): The variant
+    """
+    _set_default_fields(variant)
+
+    # Count genotype by control and case
+    genotype_counter = Counter()
+    if "samples" in variant:
+        for sample in variant["samples"]:
+            genotype_counter[sample["gt"]] += 1
+
+    # Count genotype by control and case
+    case_counter = None
+    control_counter = None
+    if case_samples is not None and control_samples is not None:
+
+        case_counter = Counter()
+        control_counter = Counter()
+
+        if "samples" in variant:
+            # Note: No garantee that samples from DB are all qualified
+            # by PED data.
+            # So some samples from variants may not be in case/control samples.
+            for sample in variant["samples"]:
+                if sample["name"] in case_samples:
+                    case_counter[sample["gt"]] += 1
+
+                elif sample["name"] in control_samples:
+                    control_counter[sample["gt"]] += 1
+
+    return _set_counters(variant, genotype_counter, case_counter, control_counter)
+
+
+def _set_default_fields(variant):
+    """Add extra fields that don't depend on genotypes to the given variant"""
+    variant["favorite"] = False
+    variant["comment"] = ""
+    variant["classification"] = 3
+
+    # For now set the first annotation as a major transcripts
+    if "annotations" in variant:
+        variant["annotation_count"] = len(variant["annotations"])
+
+
+def _set_counters(variant, genotype_counter, case_counter=None, control_counter=None):
+    """Add genotype counters to the given variant
+
+    Counters are mappings with genotype codes (0, 1, 2) as keys and numbers of
+    samples as values; case and control counters are set if they are not None.
+    """
+    variant["count_hom"] = genotype_counter[2]
+    variant["count_het"] = genotype_counter[1]
+    variant["count_ref"] = genotype_counter[0]
+    # Number of variants (not 0/0)
+    variant["count_var"] = genotype_counter[1] + genotype_counter[2]
+
+    variant["is_indel"] = len(variant["ref"]) != len(variant["alt"])
+    variant["is_snp"] = len(variant["ref"]) == len(variant["alt"])
+
+    if case_counter is not None and control_counter is not None:
+        variant["case_count_hom"] = case_counter[2]
+        variant["case_count_het"] = case_counter[1]
+        variant["case_count_ref"] = case_counter[0]
+
+        variant["control_count_hom"] = control_counter[2]
+        variant["control_count_het"] = control_counter[1]
+        variant["control_count_ref"] = control_counter[0]
+
+    return variant
+
+
+class GenotypeCounter:
+    """Compute extra fields of chunks of variants with NumPy
+
+    Genotypes of a chunk of variants are gathered in a matrix
+    (variants x samples) and counted for all the variants at once.
+    Masks of case and control samples are built once.
+
+    The results are the same as :meth:`compute_extra_fields`, which is used
+    for variants whose samples are not in the expected order (i.e. samples
+    filtered by the importer), or for all the variants if NumPy is not
+    installed.
+
+    Attributes:
+        samples (list): Names of the samples in the order of the variants
+        case_samples (list): Case sample names; None if not available
+        control_samples (list): Control sample names; None if not available
+    """
+
+    def __init__(self, samples, case_samples=None, control_samples=None):
+        self.samples = list(samples)
+        # Expected order of the samples of the variants
+        self.sample_names = tuple(self.samples)
+        self.case_samples = case_samples
+        self.control_samples = control_samples
+        self.with_phenotypes = case_samples is not None and control_samples is not None
+
+        if np is not None and self.with_phenotypes:
+            case_samples = set(case_samples)
+            control_samples = set(control_samples)
+            self.case_mask = np.array(
+                [name in case_samples for name in self.samples], dtype=bool
             )
+            # Samples in cases are not counted in controls
+            self.control_mask = np.array(
+                [name in control_samples for name in self.samples], dtype=bool
+            ) & ~self.case_mask
+
+    def is_vectorizable(self, variant) -> bool:
+        """Return True if the samples of the variant are in the expected order"""
+        samples = variant.get("samples")
+        return (
+            bool(samples)
+            and len(samples) == len(self.sample_names)
+            and tuple(sample["name"] for sample in samples) == self.sample_names
+        )
 
-        # FakeReader is used ?
-        if not self.device:
-            return 0
+    def compute_extra_fields(self, variants: list) -> list:
+        """Add extra information to the given variants
 
-        # Detect type of file handler
-        if isinstance(self.device, (io.RawIOBase, io.BufferedIOBase)):
-            # Binary opened file => assert that it is a vcf.gz file
-            with gzip.open(self.device.name, "rb") as file_obj:
-                find_lines_in_text_file(file_obj)
-        elif isinstance(self.device, io.TextIOBase):
-            find_lines_in_text_file(self.device)
+        .. note:: The given variants are modified in place.
+
+        .. seealso:: :meth:`compute_extra_fields`
+
+        Args:
+            variants (list): Variants as yielded by get_variants()
+
+        Returns:
+            (list): The variants
+        """
+        if np is None or not self.samples:
+            return [
+                compute_extra_fields(variant, self.case_samples, self.control_samples)
+                for variant in variants
+            ]
+
+        # Variants with all the samples in order
+        vectorized = []
+        for variant in variants:
+            if self.is_vectorizable(variant):
+                vectorized.append(variant)
+            else:
+                compute_extra_fields(variant, self.case_samples, self.control_samples)
+
+        if not vectorized:
+            return variants
+
+        # Genotype matrix (variants x samples) filled in one pass
+        genotypes = np.fromiter(
+            (sample["gt"] for variant in vectorized for sample in variant["samples"]),
+            dtype=np.int8,
+            count=len(vectorized) * len(self.samples),
+        ).reshape(len(vectorized), len(self.samples))
+        # 1 boolean matrix per genotype code: 0, 1, 2
+        matrices = [genotypes == code for code in range(3)]
+        # Python ints: number of samples by code for each variant
+        counters = zip(*(matrix.sum(axis=1).tolist() for matrix in matrices))
+
+        if self.with_phenotypes:
+            case_counters = zip(
+                *(matrix[:, self.case_mask].sum(axis=1).tolist() for matrix in matrices)
+            )
+            control_counters = zip(
+                *(
+                    matrix[:, self.control_mask].sum(axis=1).tolist()
+                    for matrix in matrices
+                )
+            )
         else:
-            LOGGER.error("Unknown file handler type: %s", type(self.device))
-            raise TypeError("Unknown file handler type: %s" % type(self.device))
+            case_counters = control_counters = it.repeat(None)
+
+        for variant, counter, case_counter, control_counter in zip(
+            vectorized, counters, case_counters, control_counters
+        ):
+            _set_default_fields(variant)
+            _set_counters(variant, counter, case_counter, control_counter)
 
-        # Rewind the file
-        self.device.seek(0)
+        return variants
 
 
 def check_variant_schema(variant: dict):
@@ -516,6 +793,8 @@ def check_field_schema(field: dict):
             "category": lambda x: x in ["variants", "annotations", "samples"],
             "description": str,
             Optional("constraint", default="NULL"): str,
+            # Number of values (VCF Number); None if it varies
+            Optional("number"): lambda x: x is None or isinstance(x, int),
         }
     )
 
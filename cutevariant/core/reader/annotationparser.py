@@ -223,6 +223,9 @@ def __init__(self):
         # insurance that the fields have been processed before variants.
         self.annotation_field_name = None
 
+        # Name of the field of the file that contains the annotations
+        self.annotation_key = None
+
     def handle_descriptions(self, raw_fields: list):
         """Construct annotation_field_name with the fields of the file, and
         yield fields (dictionnaries) with the full description of fields of the file.
@@ -346,6 +349,7 @@ def __init__(self):
         # Dict of dicts
         # annotation field name as keys, descriptions (name/value) as values
         self.annotation_default_fields = VEP_ANNOTATION_DEFAULT_FIELDS
+        self.annotation_key = "csq"
 
     def parse_fields(self, fields):
         """Generate fields description
@@ -423,6 +427,7 @@ def __init__(self):
         # Dict of dicts
         # annotation field name as keys, descriptions (name/value) as values
         self.annotation_default_fields = SNPEFF_ANNOTATION_DEFAULT_FIELDS
+        self.annotation_key = "ann"
 
     def parse_fields(self, fields):
         """Generate fields description
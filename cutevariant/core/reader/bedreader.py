@@ -1,12 +1,12 @@
 """Module to handle BED files"""
 # Standard imports
-import gzip
 import csv
 import os
 import io
 import re
 
 # Custom imports
+from .bgzf import open_gzip
 import cutevariant.commons as cm
 
 LOGGER = cm.logger()
@@ -98,8 +98,8 @@ def __iter__(self):
             yield from self.get_intervals(io.StringIO(self.filepath))
         else:
             if self.is_gz_file:
-                # Handle gzip file
-                with gzip.open(self.filepath, "rt") as stream:
+                # Handle gzip file (multi-threaded decompression of BGZF files)
+                with open_gzip(self.filepath) as stream:
                     yield from self.get_intervals(stream)
             else:
                 # Handle text file
@@ -0,0 +1,277 @@
+"""Multi-threaded reader of BGZF files
+
+BGZF (Blocked GNU Zip Format, written by bgzip and used by tabix) files are
+series of independent gzip members of at most 64 KiB of uncompressed data.
+Each member can be inflated without the previous ones: blocks are read
+sequentially in the current thread and inflated in a pool of threads
+(zlib releases the GIL), then delivered in the order of the file.
+
+Example:
+    >>> with open_gzip("examples/test.vcf.gz") as stream:
+    ...     for line in stream:
+    ...         print(line)
+"""
+# Standard imports
+import io
+import os
+import gzip
+import zlib
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Custom imports
+import cutevariant.commons as cm
+
+LOGGER = cm.logger()
+
+
+def inflate_block(block: bytes) -> bytes:
+    """Decompress the given BGZF block
+
+    :param block: Whole gzip member (header, compressed data, crc32 and size).
+    :return: Uncompressed data.
+    :raises OSError: If the data doesn't match the checksum or the size of
+        the block.
+    """
+    extra_length = int.from_bytes(block[10:12], byteorder="little")
+    crc, size = struct.unpack("<II", block[-8:])
+    data = zlib.decompress(block[12 + extra_length : -8], -zlib.MAX_WBITS)
+    if len(data) != size or zlib.crc32(data) != crc:
+        raise OSError("BGZF block corrupted (CRC or size mismatch)")
+    return data
+
+
+def is_bgzf_file(filepath) -> bool:
+    """Return a boolean according to the BGZF compression of the file"""
+    with open(filepath, "rb") as file_obj:
+        return cm.get_bgzf_block_size(file_obj) is not None
+
+
+class BgzfReader(io.BufferedIOBase):
+    """Binary stream of the uncompressed data of a BGZF file
+
+    Blocks are inflated in advance in a pool of threads;
+    at most `window` blocks are kept in memory.
+
+    Like :class:`gzip.GzipFile`, the compressed file object is available in
+    the `fileobj` attribute; its position is the number of compressed bytes
+    read so far.
+
+    Seeking is supported, but seeking backwards restarts the decompression
+    from the beginning of the file. Seeking forwards skips whole blocks
+    without inflating them (their uncompressed size is in their trailer).
+
+    Attributes:
+        fileobj: Compressed file object.
+        threads (int): Number of threads used to inflate blocks.
+        window (int): Number of blocks inflated in advance.
+    """
+
+    def __init__(self, filename=None, fileobj=None, threads=None, window=None):
+        """
+        :key filename: Path of the file; ignored if fileobj is given.
+        :key fileobj: Binary file object; it is not closed with the stream.
+        :key threads: Number of threads used to inflate blocks
+            (default: number of CPUs).
+        :key window: Maximum number of blocks inflated in advance
+            (default: 4 per thread).
+        """
+        super().__init__()
+        if fileobj is None:
+            fileobj = open(filename, "rb")
+            self._own_fileobj = True
+        else:
+            self._own_fileobj = False
+
+        self.fileobj = fileobj
+        self.threads = threads or os.cpu_count() or 1
+        self.window = window or 4 * self.threads
+        self._executor = ThreadPoolExecutor(self.threads)
+        self._start = fileobj.tell()
+        self._reset()
+
+    @property
+    def name(self):
+        return getattr(self.fileobj, "name", None)
+
+    def _reset(self):
+        """Go back to the first block of the file"""
+        self._pending = deque()
+        self.fileobj.seek(self._start)
+        self._buffer = b""
+        self._offset = 0
+        self._position = 0
+        self._eof = False
+
+    def _read_block(self):
+        """Read the next compressed block of the file
+
+        :return: The offset of the block in the file and the block;
+            None at the end of the file.
+        :raises OSError: If the data is not a BGZF block.
+        """
+        start = self.fileobj.tell()
+        size = cm.get_bgzf_block_size(self.fileobj)
+        self.fileobj.seek(start)
+        if size is None:
+            if self.fileobj.read(1):
+                raise OSError(f"Not a BGZF block at offset {start}")
+            return None
+        return start, self.fileobj.read(size)
+
+    def _skip_blocks(self, offset):
+        """Skip the blocks that end before the given uncompressed offset
+
+        Blocks are not inflated: only their headers and trailers are read.
+        Blocks already inflated in advance are dropped.
+        """
+        # Drop the rest of the current block
+        self._position += len(self._buffer) - self._offset
+        self._buffer = b""
+        self._offset = 0
+        if self._pending:
+            self.fileobj.seek(self._pending[0][0])
+            for _, future in self._pending:
+                future.cancel()
+            self._pending.clear()
+        self._eof = False
+
+        while True:
+            start = self.fileobj.tell()
+            size = cm.get_bgzf_block_size(self.fileobj)
+            if size is None:
+                break
+            # ISIZE: uncompressed size of the block
+            self.fileobj.seek(start + size - 4)
+            block_size = int.from_bytes(self.fileobj.read(4), byteorder="little")
+            if self._position + block_size > offset:
+                break
+            self._position += block_size
+        self.fileobj.seek(start)
+
+    def _next_block(self) -> bool:
+        """Replace the current buffer by the next inflated block
+
+        :return: False at the end of the file.
+        """
+        while not self._eof and len(self._pending) < self.window:
+            block = self._read_block()
+            if block is None:
+                self._eof = True
+                break
+            start, block = block
+            self._pending.append((start, self._executor.submit(inflate_block, block)))
+
+        if not self._pending:
+            return False
+
+        self._buffer = self._pending.popleft()[1].result()
+        self._offset = 0
+        return True
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read1(self, size=-1) -> bytes:
+        """Read at most size bytes with at most one block inflated"""
+        self._check_not_closed()
+        # Skip empty blocks (i.e. EOF marker)
+        while self._offset >= len(self._buffer):
+            if not self._next_block():
+                return b""
+
+        if size is None or size < 0:
+            end = len(self._buffer)
+        else:
+            end = min(self._offset + size, len(self._buffer))
+        data = self._buffer[self._offset : end]
+        self._offset = end
+        self._position += len(data)
+        return data
+
+    def read(self, size=-1) -> bytes:
+        """Read size bytes, or all the remaining data if size is negative"""
+        chunks = []
+        remaining = -1 if size is None else size
+        while remaining:
+            data = self.read1(remaining)
+            if not data:
+                break
+            chunks.append(data)
+            if remaining > 0:
+                remaining -= len(data)
+        return b"".join(chunks)
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def tell(self) -> int:
+        """Return the position in the uncompressed data"""
+        self._check_not_closed()
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET) -> int:
+        """Change the position in the uncompressed data
+
+        Only SEEK_SET and SEEK_CUR are supported.
+        """
+        self._check_not_closed()
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("Seeking from the end is not supported")
+
+        if offset < self._position:
+            for _, future in self._pending:
+                future.cancel()
+            self._reset()
+
+        if offset > self._position + len(self._buffer) - self._offset:
+            self._skip_blocks(offset)
+
+        while self._position < offset:
+            if not self.read1(offset - self._position):
+                break
+        return self._position
+
+    def close(self):
+        if self.closed:
+            return
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=True)
+        if self._own_fileobj:
+            self.fileobj.close()
+        super().close()
+
+    def _check_not_closed(self):
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+
+
+def open_gzip(filepath, threads=None, encoding="utf-8"):
+    """Open the given gzip file in text mode
+
+    BGZF files are decompressed in a pool of threads by :class:`BgzfReader`;
+    other gzip files are decompressed in the current thread by
+    :class:`gzip.GzipFile`.
+
+    :param filepath: Path of a gzip file.
+    :key threads: Number of threads used for BGZF files
+        (default: number of CPUs).
+    :key encoding: Text encoding.
+    :return: Text stream.
+    :rtype: <io.TextIOWrapper>
+    """
+    if is_bgzf_file(filepath):
+        return io.TextIOWrapper(BgzfReader(filepath, threads=threads), encoding=encoding)
+
+    LOGGER.debug("open_gzip: %s is not a BGZF file; single thread decoding", filepath)
+    return gzip.open(filepath, "rt", encoding=encoding)
@@ -1,5 +1,10 @@
 # Standard imports
 import csv
+import heapq
+import pickle
+import tempfile
+from itertools import groupby, islice
+from operator import itemgetter
 
 # Custom imports
 from .abstractreader import AbstractReader
@@ -8,6 +13,55 @@
 
 LOGGER = logger()
 
+# Number of rows sorted in memory before being written in a temporary file
+DEFAULT_SORT_BUFFER_SIZE = 100000
+
+
+def external_sort(iterable, key=None, buffer_size=DEFAULT_SORT_BUFFER_SIZE):
+    """Sort the items of the given iterable with a bounded memory usage
+
+    Items are sorted by chunks of `buffer_size` items; sorted chunks are
+    pickled in temporary files and merged lazily.
+    The sort is stable: equal items are returned in their original order.
+
+    :param iterable: Iterable of picklable items.
+    :key key: Function of one argument used to extract a comparison key.
+    :key buffer_size: Maximum number of items kept in memory.
+    :return: Generator of sorted items.
+    :rtype: <generator>
+    """
+
+    def read_chunk(file):
+        """Yield items from the given temporary file"""
+        file.seek(0)
+        while True:
+            try:
+                yield pickle.load(file)
+            except EOFError:
+                return
+
+    iterator = iter(iterable)
+    chunk = sorted(islice(iterator, buffer_size), key=key)
+    if len(chunk) < buffer_size:
+        # Everything fits in memory
+        yield from chunk
+        return
+
+    files = []
+    try:
+        while chunk:
+            file = tempfile.TemporaryFile()
+            for item in chunk:
+                pickle.dump(item, file, pickle.HIGHEST_PROTOCOL)
+            files.append(file)
+            chunk = sorted(islice(iterator, buffer_size), key=key)
+
+        LOGGER.debug("external_sort: merge of %s temporary files", len(files))
+        yield from heapq.merge(*(read_chunk(file) for file in files), key=key)
+    finally:
+        for file in files:
+            file.close()
+
 
 class CsvReader(AbstractReader):
     """VEP parser to extract data from CSV file
@@ -36,11 +90,27 @@ class CsvReader(AbstractReader):
         PUBMED   MOTIF_NAME   MOTIF_POS   HIGH_INF_POS   MOTIF_SCORE_CHANGE
         LRT_pred   LRT_score   MutationTaster_model   MutationTaster_pred
         SIFT_pred   SIFT_score   clinvar_clnsig   clinvar_rs   clinvar_trait
+
+    Variants are yielded as soon as all their transcripts are read:
+    rows of the same variant must be consecutive (`presorted` input, as
+    written by VEP), or the rows are sorted by variant beforehand with a
+    bounded memory usage (see :meth:`external_sort`).
     """
 
-    def __init__(self, device):
-        # Note: number of lines is computed in parent class
+    def __init__(
+        self, device, presorted=False, sort_buffer_size=DEFAULT_SORT_BUFFER_SIZE
+    ):
+        """
+        :param device: File object.
+        :key presorted: The transcripts of each variant are on consecutive
+            rows; rows are not sorted.
+        :key sort_buffer_size: Maximum number of rows sorted in memory;
+            sorted rows are written in temporary files beyond this limit.
+        """
+        # Note: file size is computed in parent class
         super().__init__(device)
+        self.presorted = presorted
+        self.sort_buffer_size = sort_buffer_size
 
         # Quick tests on the input file...
         first_line = device.readline()
@@ -101,7 +171,8 @@ def get_fields(self):
         LOGGER.debug("CsvReader::get_fields: called")
         if not self.fields:
             LOGGER.debug("CsvReader::get_fields: parse")
-            self.fields = tuple(self.parse_fields())
+            # Keep only selected fields (see AbstractReader.select_fields)
+            self.fields = tuple(self.filter_fields(self.parse_fields()))
         return self.fields
 
     def get_variants(self):
@@ -169,30 +240,62 @@ def parse_variants(self):
         .. todo: Handle samples
 
         .. note:: Each line is a transcript; there are many transcripts per variant.
+            Transcripts are grouped by variant, see :meth:`parse_rows`.
 
         :return: Generator of variants.
         :rtype: <generator <dict>>
         """
+        if self.annotation_parser.annotation_field_name is None:
+            raise Exception("Cannot parse variant without parsing fields first")
 
-        def add_annotation_to_variant():
-            """Add annotation to the current variant"""
-            # No annotation parsed
-            if not annotation:
-                return
-            annotations = variant.get("annotations")
+        rows = self.parse_rows()
+        if not self.presorted:
+            # Group the transcripts of each variant
+            rows = external_sort(
+                rows, key=self.sort_key, buffer_size=self.sort_buffer_size
+            )
+
+        variant_count = 0
+        for primary_key, transcripts in groupby(rows, key=itemgetter(0)):
+            variant = dict()
+            variant["chr"], variant["pos"], variant["ref"], variant["alt"] = primary_key
+
+            annotations = [annotation for _, annotation in transcripts if annotation]
             if annotations:
-                # Update
-                annotations.append(annotation)
-            else:
-                # Set
-                variant["annotations"] = [annotation]
+                variant["annotations"] = annotations
 
-        if self.annotation_parser.annotation_field_name is None:
-            raise Exception("Cannot parse variant without parsing fields first")
+            # testing purpose
+            #            variant["samples"] = [
+            #                {"name": "boby", "gt": 0},
+            #                {"name": "sacha", "gt": 1},
+            #                {"name": "olivier", "gt": 2},
+            #            ]
 
-        variants = dict()
-        transcript_idx = 0
-        for transcript_idx, row in enumerate(self.csv_reader, 1):
+            variant_count += 1
+            yield variant
+
+        LOGGER.info(
+            "CsvReader::parse_variants: transcripts %s, variants %s",
+            self.transcript_count,
+            variant_count,
+        )
+
+    def parse_rows(self):
+        """Read file and parse the transcript of each row
+
+        :return: Generator of primary keys (chr, pos, ref, alt)
+            and annotations.
+        :rtype: <generator <tuple <tuple>, <dict>>>
+        """
+        # Values of the other columns are not kept
+        selected = {
+            field["name"]
+            for field in self.get_fields()
+            if field["category"] == "annotations"
+        }
+
+        self.transcript_count = 0
+        for self.transcript_count, row in enumerate(self.csv_reader, 1):
 
             # Build primary key by mapping existing fields in the original file
             chrom, pos = self.location_to_chr_pos(row["Location"])
@@ -203,10 +306,6 @@ def add_annotation_to_variant():
                 # Check consistency
                 assert row["GIVEN_REF"] == row["USED_REF"], "GIVEN_REF != USED_REF"
 
-            primary_key = (chrom, pos, ref, alt)
-            # Get previous variant with same primary key (previous transcript)
-            variant = variants.get(primary_key, dict())
-
             # filtre les champs non voulus, cherche ceux qui restent dans
             # VEP_ANNOTATION_DEFAULT_FIELDS pour savoir s'ils sont supportés;
             # sinon les ajoute en lower case en fallback
@@ -221,7 +320,8 @@ def add_annotation_to_variant():
                     # Use supported field name
                     lower_key = field_descript["name"]
 
-                annotation[lower_key] = row[raw_key]
+                if lower_key in selected:
+                    annotation[lower_key] = row[raw_key]
 
             # Quicker ?
             # annotation = {
@@ -229,34 +329,16 @@ def add_annotation_to_variant():
             #    for key, value in row.items() if key.lower() not in self.ignored_columns
             # }
 
-            if variant:
-                # Variant already created
-                # Append current annotation to the previous ones
-                add_annotation_to_variant()
-                continue
+            yield (chrom, pos, ref, alt), annotation
 
-            # New variant
-            variant["chr"], variant["pos"], variant["ref"], variant["alt"] = primary_key
-
-            # Set current annotation
-            add_annotation_to_variant()
+    @staticmethod
+    def sort_key(row):
+        """Return the key used to sort the rows returned by :meth:`parse_rows`
 
-            # testing purpose
-            #            variant["samples"] = [
-            #                {"name": "boby", "gt": 0},
-            #                {"name": "sacha", "gt": 1},
-            #                {"name": "olivier", "gt": 2},
-            #            ]
-
-            variants[primary_key] = variant
-
-        LOGGER.info(
-            "CsvReader::parse_variants: transcripts %s, variants %s",
-            transcript_idx, len(variants)
-        )
-
-        for variant in variants.values():
-            yield dict(variant)
+        Positions are compared as numbers.
+        """
+        (chrom, pos, ref, alt), _ = row
+        return chrom, int(pos) if pos.isdigit() else -1, pos, ref, alt
 
     def location_to_chr_pos(self, location: str):
         """Parse VEP `Location` field to extract `chr`, `pos` fields
@@ -1,10 +1,20 @@
 # Standard imports
+import io
+import gzip
+import multiprocessing
+from collections import deque
 import vcf
 
 # Custom imports
-from .abstractreader import AbstractReader, sanitize_field_name
+from .abstractreader import (
+    AbstractReader,
+    sanitize_field_name,
+    get_case_control_samples,
+    GenotypeCounter,
+)
 from .annotationparser import VepParser, SnpEffParser
-from cutevariant.commons import logger
+from .vcftokenizer import VcfTokenizer
+from cutevariant.commons import logger, RECORD_OFFSET_KEY
 
 
 # Fixing PyVCF bug
@@ -30,6 +40,262 @@ def _map(self, func, iterable, bad=[".", "", "NA"]):
 }
 
 
+def parse_records(vcf_reader, infos=None, formats=None, samples=None):
+    """Yield variants from the records of the given PyVCF reader
+
+    .. seealso:: :meth:`VcfReader.parse_variants`
+
+    :param vcf_reader: PyVCF reader; the header must have been read.
+    :key infos: Keys of the INFO fields to keep (default: None, all).
+    :key formats: Keys of the FORMAT fields to keep (default: None, all).
+    :key samples: Names of the samples to keep (default: None, all).
+        See :meth:`VcfReader.get_selection`.
+    :return: Generator of variants.
+    :rtype: <generator <dict>>
+    """
+    # Genotype format fields
+    format_fields = set(
+        map(str.lower, vcf_reader.formats if formats is None else formats)
+    )
+    # Remove gt field (added manually later)
+    format_fields.discard("gt")
+
+    for record in vcf_reader:
+
+        # split row with multiple alt
+        for index, alt in enumerate(record.ALT):
+            # Remap some columns
+            variant = {
+                "chr": record.CHROM,
+                "pos": record.POS,
+                "ref": record.REF,
+                "alt": str(alt),
+                "rsid": record.ID,  # Avoid id column duplication in DB
+                "qual": record.QUAL,
+                "filter": "" if record.FILTER is None else ",".join(record.FILTER),
+            }
+
+            forbidden_field = ("chr", "pos", "ref", "alt", "rsid", "qual", "filter")
+
+            # Parse info
+            for name in record.INFO:
+                if infos is not None and name not in infos:
+                    continue
+                if name.lower() not in forbidden_field:
+                    if isinstance(record.INFO[name], list):
+                        variant[name.lower()] = ",".join(
+                            [str(i) for i in record.INFO[name]]
+                        )
+                    else:
+                        variant[name.lower()] = record.INFO[name]
+
+            # Parse sample(s)
+            if record.samples:
+                variant["samples"] = []
+                for sample in record.samples:
+                    if samples is not None and sample.sample not in samples:
+                        continue
+                    # New sample data
+                    sample_data = {
+                        "name": sample.sample,
+                        "gt": -1 if sample.gt_type is None else sample.gt_type
+                    }
+
+                    # Load sample fields
+                    # 1 genotype field per format
+                    # In theory: All same fields for each sample
+                    #print("FORMAT FIELD",format_fields, sample["GQ"])
+                    for gt_field in format_fields:
+                        try:
+                            value = sample[gt_field.upper()]
+                            if isinstance(value, list):
+                                value = ",".join(str(i) for i in value)
+                            sample_data[gt_field] = value
+                        except AttributeError:
+                            # Some fields defined in VCF header by FORMAT data
+                            # are not in genotype fields of records...
+                            # LOGGER.debug(
+                            #     "VCFReader::parse: alt index %s; %s not defined in genotype ", index, gt_field
+                            # )
+                            pass
+                    variant["samples"].append(sample_data)
+
+            yield variant
+
+
+def strip_line(line, infos=None, formats=None, sample_columns=None):
+    """Remove the unselected INFO keys, FORMAT keys and samples of a VCF line
+
+    PyVCF decodes all the values of the records; they are removed from the
+    raw line before.
+
+    :param line: VCF body line.
+    :key infos: Keys of the INFO fields to keep (default: None, all).
+    :key formats: Keys of the FORMAT fields to keep (default: None, all).
+    :key sample_columns: Indexes of the sample columns to keep
+        (default: None, all).
+    :return: The line with the selected values only.
+    :rtype: <str>
+    """
+    row = line.split("\t")
+    if infos is not None and len(row) > 7:
+        items = row[7].split(";")
+        row[7] = ";".join(item for item in items if item.split("=", 1)[0] in infos)
+        row[7] = row[7] or "."
+
+    if len(row) > 9:
+        samples = row[9:]
+        if sample_columns is not None:
+            samples = [samples[index] for index in sample_columns]
+
+        keys = row[8].split(":")
+        if formats is not None and row[8] != "." and not formats.issuperset(keys):
+            indexes = [index for index, key in enumerate(keys) if key in formats]
+            # Samples without selected values are kept with a missing genotype
+            row[8] = ":".join(keys[index] for index in indexes) or "GT"
+            # Trailing values may be dropped in samples
+            samples = [
+                ":".join(values[index] for index in indexes if index < len(values))
+                or "."
+                for values in (sample.split(":") for sample in samples)
+            ]
+        row[9:] = samples
+
+    return "\t".join(row)
+
+
+def iter_lines(stream, offset=0, encoding="utf-8", chunk_size=1 << 20):
+    """Yield the lines of the given binary stream with their offsets
+
+    :param stream: Binary stream (uncompressed data) read from its current
+        position.
+    :key offset: Offset of the current position of the stream.
+    :key encoding: Text encoding of the lines.
+    :key chunk_size: Number of bytes read at once.
+    :return: Generator of tuples: offset of the line in the stream, line
+        without its end of line character.
+    :rtype: <generator <tuple <int>, <str>>>
+    """
+    rest = b""
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            break
+        lines = (rest + data).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            yield offset, line.decode(encoding)
+            offset += len(line) + 1
+    if rest:
+        yield offset, rest.decode(encoding)
+
+
+def parse_lines(lines, vcf_reader, tokenizer=None, selection=(None, None, None)):
+    """Yield variants from the given VCF body lines with their offsets
+
+    The offset of the record of each variant is set in its
+    :data:`cutevariant.commons.RECORD_OFFSET_KEY` key.
+
+    :param lines: Iterable of tuples: offset of the line (or None if
+        unknown), line. See :meth:`iter_lines`.
+    :param vcf_reader: PyVCF reader; the header must have been read.
+    :key tokenizer: :class:`VcfTokenizer` used instead of PyVCF if given.
+    :key selection: INFO keys, FORMAT keys and samples to parse
+        (see :meth:`VcfReader.get_selection`).
+    :return: Generator of variants.
+    :rtype: <generator <dict>>
+    """
+    offset = None
+
+    def body():
+        # Records are parsed one by one: offset is the one of the current record
+        nonlocal offset
+        for offset, line in lines:
+            yield line
+
+    if tokenizer:
+        variants = tokenizer.parse_lines(body())
+    elif selection == (None, None, None):
+        vcf_reader.reader = (line.strip() for line in body() if line.strip())
+        variants = parse_records(vcf_reader)
+    else:
+        # Unselected values are not decoded by PyVCF
+        infos, formats, samples = selection
+        sample_columns = None
+        if samples is not None:
+            sample_columns = [
+                index
+                for index, name in enumerate(vcf_reader.samples)
+                if name in samples
+            ]
+            vcf_reader.samples = [vcf_reader.samples[index] for index in sample_columns]
+            vcf_reader._sample_indexes = {
+                name: index for index, name in enumerate(vcf_reader.samples)
+            }
+        vcf_reader.reader = (
+            strip_line(line.strip(), infos, formats, sample_columns)
+            for line in body()
+            if line.strip()
+        )
+        variants = parse_records(vcf_reader, *selection)
+
+    for variant in variants:
+        variant[RECORD_OFFSET_KEY] = offset
+        yield variant
+
+
+# Parallel parsing ############################################################
+# Worker processes are initialized once with the VCF header and the objects
+# required to parse chunks of records. These objects are module-level globals
+# in each worker process.
+_worker_state = dict()
+
+
+def _init_parse_worker(
+    header, annotation_parser, case_samples, control_samples, fast_parser, selection
+):
+    """Initialize a worker process of the pool used by VcfReader
+
+    :param selection: INFO keys, FORMAT keys and samples to parse
+        (see :meth:`VcfReader.get_selection`).
+    """
+    _worker_state["header"] = header
+    _worker_state["tokenizer"] = None
+    _worker_state["selection"] = selection
+    vcf_reader = vcf.VCFReader(io.StringIO(header), strict_whitespace=True)
+    if fast_parser:
+        _worker_state["tokenizer"] = VcfTokenizer(vcf_reader, *selection)
+    _worker_state["annotation_parser"] = annotation_parser
+    # Masks of case and control samples are built once per worker
+    samples = selection[2]
+    _worker_state["counter"] = GenotypeCounter(
+        [name for name in vcf_reader.samples if samples is None or name in samples],
+        case_samples,
+        control_samples,
+    )
+
+
+def _parse_chunk(chunk: list):
+    """Parse a chunk of VCF records in a worker process
+
+    :param chunk: VCF body lines (without header) with their offsets;
+        see :meth:`iter_lines`.
+    :return: List of variants with their extra information.
+    :rtype: <list <dict>>
+    """
+    vcf_reader = vcf.VCFReader(
+        io.StringIO(_worker_state["header"]), strict_whitespace=True
+    )
+    variants = parse_lines(
+        chunk, vcf_reader, _worker_state["tokenizer"], _worker_state["selection"]
+    )
+    annotation_parser = _worker_state["annotation_parser"]
+    if annotation_parser:
+        variants = annotation_parser.parse_variants(variants)
+
+    return _worker_state["counter"].compute_extra_fields(list(variants))
+
+
 class VcfReader(AbstractReader):
     """VCF parser to extract data from vcf file
 
@@ -37,24 +303,45 @@ class VcfReader(AbstractReader):
 
     Attributes:
         annotation_parser (object): Support "VepParser()" and "SnpeffParser()"
+        processes (int): Number of processes used to parse the records
+            in :meth:`get_extra_variants`; 1 to parse them in the current process.
+        chunk_size (int): Number of records sent at once to a worker process.
+        fast_parser (bool): Use :class:`VcfTokenizer` instead of PyVCF to
+            parse the records.
     """
 
-    def __init__(self, device, annotation_parser: str = None):
+    def __init__(
+        self,
+        device,
+        annotation_parser: str = None,
+        processes: int = 1,
+        chunk_size: int = 1000,
+        fast_parser: bool = False,
+    ):
         """Construct a VCF Reader
 
         .. note::
-            Number of lines `number_lines` AND `file_size` is computed in
-            AbstractReader class.
+            `file_size` is computed in AbstractReader class.
 
         :param device: File device handler returned by open.
         :key annotation_parser (str): "vep" or "snpeff"
             This argument forces the reader to use a specific parser for
             the annotations. By default it's None: no parser will be used,
             annotations will not be taken into account.
+        :key processes (int): Number of worker processes used to parse
+            the records (default: 1, no worker process).
+        :key chunk_size (int): Number of records parsed at once by a worker.
+        :key fast_parser (bool): Parse records with the lightweight
+            :class:`VcfTokenizer` instead of PyVCF (default: False).
         """
         # Note: number of lines is computed in parent class
         super().__init__(device)
-        vcf_reader = vcf.VCFReader(device, strict_whitespace=True)
+        self.processes = max(1, processes or 1)
+        self.chunk_size = chunk_size
+        self.fast_parser = fast_parser
+        # Offset of the first record to read; see set_start_offset()
+        self.start_offset = None
+        vcf_reader = self._create_vcf_reader()
         self.samples = vcf_reader.samples
         self.annotation_parser = None
         self.metadata = vcf_reader.metadata
@@ -90,11 +377,63 @@ def get_fields(self):
             if self.annotation_parser:
                 # If "ANN" is a field in the current VCF:
                 # Remove and parse special annotations
-                self.fields = tuple(self.annotation_parser.parse_fields(fields))
-            else:
-                self.fields = fields
+                fields = tuple(self.annotation_parser.parse_fields(fields))
+
+            # Keep only selected fields
+            self.fields = tuple(self.filter_fields(fields))
+            if self.annotation_parser:
+                # Values of the other annotation fields are not kept
+                selected = {
+                    field["name"]
+                    for field in self.fields
+                    if field["category"] == "annotations"
+                }
+                self.annotation_parser.annotation_field_name = [
+                    name if name in selected else None
+                    for name in self.annotation_parser.annotation_field_name
+                ]
         return self.fields
 
+    def get_selection(self, vcf_reader):
+        """Return the keys of INFO and FORMAT fields and the samples to parse
+
+        They are computed from the selected fields and samples.
+        See :meth:`AbstractReader.select_fields` and
+        :meth:`AbstractReader.select_samples`.
+
+        .. note:: Unselected fields and samples are removed from the lines
+            before PyVCF decodes them (see :meth:`strip_line`).
+
+        :param vcf_reader: PyVCF reader; the header must have been read.
+        :return: Sets of INFO keys, FORMAT keys and sample names;
+            None for all of them.
+        :rtype: <tuple <set>, <set>, <set>>
+        """
+        fields = {(field["category"], field["name"]) for field in self.get_fields()}
+
+        infos, formats, samples = None, None, None
+        if self.included_fields is not None or self.excluded_fields:
+            infos = {
+                key for key in vcf_reader.infos if ("variants", key.lower()) in fields
+            }
+            if self.annotation_parser and any(
+                category == "annotations" for category, _ in fields
+            ):
+                infos |= {
+                    key
+                    for key in vcf_reader.infos
+                    if key.lower() == self.annotation_parser.annotation_key
+                }
+            formats = {
+                key for key in vcf_reader.formats if ("samples", key.lower()) in fields
+            }
+            formats.add("GT")
+
+        if self.included_samples is not None or self.excluded_samples:
+            samples = set(self.get_samples())
+
+        return infos, formats, samples
+
     def get_variants(self):
         """Get variants as an iterable of dictionnaries
 
@@ -116,6 +455,143 @@ def get_variants(self):
         else:
             yield from self.parse_variants()
 
+    def get_extra_variants(self, **kwargs):
+        """Yield variants with extra information computed.
+
+        Records are parsed in a pool of worker processes if `processes` is
+        greater than 1. Variants are yielded in the order of the file.
+
+        .. seealso:: :meth:`AbstractReader.get_extra_variants`
+        """
+        if self.processes == 1:
+            yield from super().get_extra_variants(**kwargs)
+            return
+
+        case_samples, control_samples = get_case_control_samples(**kwargs)
+
+        if self.fields is None:
+            # The annotation parser must know the fields before the variants
+            self.get_fields()
+
+        header, chunks = self._read_chunks()
+        selection = self.get_selection(
+            vcf.VCFReader(io.StringIO(header), strict_whitespace=True)
+        )
+
+        with multiprocessing.Pool(
+            self.processes,
+            initializer=_init_parse_worker,
+            initargs=(
+                header,
+                self.annotation_parser,
+                case_samples,
+                control_samples,
+                self.fast_parser,
+                selection,
+            ),
+        ) as pool:
+            # Keep a bounded window of pending chunks: results are consumed in
+            # the order of submission, and the file is not loaded in memory.
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(_parse_chunk, (chunk,)))
+                if len(pending) >= self.processes * 2:
+                    yield from pending.popleft().get()
+
+            while pending:
+                yield from pending.popleft().get()
+
+    def _create_vcf_reader(self):
+        """Return a PyVCF reader that reads the device from its current position
+
+        Binary devices are decompressed by PyVCF; text devices are already
+        decompressed (see :meth:`cutevariant.core.reader.bgzf.open_gzip`),
+        even if their names end with ".gz".
+        """
+        return vcf.VCFReader(
+            self.device,
+            strict_whitespace=True,
+            compressed=not isinstance(self.device, io.TextIOBase),
+        )
+
+    def set_start_offset(self, offset) -> bool:
+        """Start the reading of the variants at the record at the given offset
+
+        Offsets are the positions of the records in the uncompressed file.
+        Seeking in BGZF files doesn't inflate the skipped blocks.
+
+        .. seealso:: :meth:`AbstractReader.set_start_offset`
+        """
+        self.device.seek(0)
+        if self._get_binary_stream() is None:
+            return False
+        self.start_offset = offset
+        return True
+
+    def _get_binary_stream(self):
+        """Return the binary stream of the uncompressed data under the device
+
+        :return: The stream; None if the device is not over a binary
+            stream (i.e. io.StringIO).
+        """
+        if isinstance(self.device, (io.RawIOBase, io.BufferedIOBase)):
+            # Binary opened file => assert that it is a vcf.gz file
+            return gzip.GzipFile(fileobj=self.device)
+        return getattr(self.device, "buffer", None)
+
+    def _read_lines(self):
+        """Split the file into its header and its body lines
+
+        Lines are read from the uncompressed binary stream under the device
+        to know their offsets; lines of devices without binary stream are
+        read as is, with None offsets.
+        Body lines start at `start_offset` if it is set.
+
+        :return: The header and a generator of tuples (offset, line).
+            See :meth:`iter_lines`.
+        :rtype: <tuple <str>, <generator <tuple <int>, <str>>>>
+        """
+        self.device.seek(0)
+        stream = self._get_binary_stream()
+        encoding = getattr(self.device, "encoding", None) or "utf-8"
+        if stream is None:
+            lines = ((None, line) for line in self.device)
+        else:
+            stream.seek(0)
+            lines = iter_lines(stream, encoding=encoding)
+
+        header = []
+        for _, line in lines:
+            header.append(line.rstrip("\r\n") + "\n")
+            if line.startswith("#CHROM"):
+                break
+
+        if self.start_offset and stream is not None:
+            stream.seek(self.start_offset)
+            lines = iter_lines(stream, self.start_offset, encoding)
+        return "".join(header), lines
+
+    def _read_chunks(self):
+        """Split the file into its header and chunks of records
+
+        :return: The header and a generator of chunks of `chunk_size` lines
+            with their offsets. See :meth:`_read_lines`.
+        :rtype: <tuple <str>, <generator <list>>>
+        """
+        header, lines = self._read_lines()
+
+        def chunks():
+            chunk = []
+            for line in lines:
+                chunk.append(line)
+                if len(chunk) == self.chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+        return header, chunks()
+
     def parse_variants(self):
         """Read file and parse variants
 
@@ -145,71 +621,12 @@ def parse_variants(self):
         :rtype: <generator <dict>>
         """
         # loop over record
-        self.device.seek(0)
-        vcf_reader = vcf.VCFReader(self.device, strict_whitespace=True) # TODO use class attr
-
-        # Genotype format fields
-        format_fields = set(map(str.lower, vcf_reader.formats))
-        # Remove gt field (added manually later)
-        format_fields.discard("gt")
-
-        for record in vcf_reader:
-
-            # split row with multiple alt
-            for index, alt in enumerate(record.ALT):
-                # Remap some columns
-                variant = {
-                    "chr": record.CHROM,
-                    "pos": record.POS,
-                    "ref": record.REF,
-                    "alt": str(alt),
-                    "rsid": record.ID,  # Avoid id column duplication in DB
-                    "qual": record.QUAL,
-                    "filter": "" if record.FILTER is None else ",".join(record.FILTER),
-                }
+        header, lines = self._read_lines()
+        vcf_reader = vcf.VCFReader(io.StringIO(header), strict_whitespace=True)
+        selection = self.get_selection(vcf_reader)
 
-                forbidden_field = ("chr", "pos", "ref", "alt", "rsid", "qual", "filter")
-
-                # Parse info
-                for name in record.INFO:
-                    if name.lower() not in forbidden_field:
-                        if isinstance(record.INFO[name], list):
-                            variant[name.lower()] = ",".join(
-                                [str(i) for i in record.INFO[name]]
-                            )
-                        else:
-                            variant[name.lower()] = record.INFO[name]
-
-                # Parse sample(s)
-                if record.samples:
-                    variant["samples"] = []
-                    for sample in record.samples:
-                        # New sample data
-                        sample_data = {
-                            "name": sample.sample,
-                            "gt": -1 if sample.gt_type is None else sample.gt_type
-                        }
-
-                        # Load sample fields
-                        # 1 genotype field per format
-                        # In theory: All same fields for each sample
-                        #print("FORMAT FIELD",format_fields, sample["GQ"])
-                        for gt_field in format_fields:
-                            try:
-                                value = sample[gt_field.upper()]
-                                if isinstance(value, list):
-                                    value = ",".join(str(i) for i in value)
-                                sample_data[gt_field] = value
-                            except AttributeError:
-                                # Some fields defined in VCF header by FORMAT data
-                                # are not in genotype fields of records...
-                                # LOGGER.debug(
-                                #     "VCFReader::parse: alt index %s; %s not defined in genotype ", index, gt_field
-                                # )
-                                pass
-                        variant["samples"].append(sample_data)
-
-                yield variant
+        tokenizer = VcfTokenizer(vcf_reader, *selection) if self.fast_parser else None
+        yield from parse_lines(lines, vcf_reader, tokenizer, selection)
 
     def parse_fields(self):
         """Extract fields informations from VCF fields
@@ -274,7 +691,7 @@ def parse_fields(self):
 
         # Read VCF
         self.device.seek(0)
-        vcf_reader = vcf.VCFReader(self.device, strict_whitespace=True)
+        vcf_reader = self._create_vcf_reader()
 
         # Read VCF INFO fields
         for field_name, info in vcf_reader.infos.items():
@@ -303,11 +720,16 @@ def parse_fields(self):
                 "category": "samples",
                 "description": description,
                 "type": VCF_TYPE_MAPPING[info.type],
+                # Multiple values are joined in strings ("64,0")
+                "number": info.num,
             }
 
     def get_samples(self):
-        """Return list of samples (individual ids)."""
-        return self.samples
+        """Return list of selected samples (individual ids).
+
+        .. seealso:: :meth:`AbstractReader.select_samples`
+        """
+        return self.filter_samples(self.samples)
 
     def _set_annotation_parser(self, parser: str):
         """Set the given annotation parser"""
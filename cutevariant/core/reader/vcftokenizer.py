@@ -0,0 +1,322 @@
+"""Lightweight parser of VCF records
+
+PyVCF builds a `_Record` object per line and a `_Call` object per sample,
+then VcfReader reads back every FORMAT key of each call.
+This module splits the lines with plain string operations, decodes only the
+INFO and FORMAT fields declared in the header (the ones yielded by
+:meth:`cutevariant.core.reader.vcfreader.VcfReader.parse_fields`), and
+computes genotype codes directly from the GT strings.
+
+Variants have the same values as the ones built from PyVCF records
+by :meth:`cutevariant.core.reader.vcfreader.parse_records`.
+"""
+# Standard imports
+import re
+from vcf.parser import RESERVED_FORMAT_CODES, INTEGER, FLOAT, FLAG, STRING
+
+# Values converted to None by PyVCF
+MISSING_VALUES = (".", "", "NA")
+
+# Variant fields that can't be overridden by INFO fields
+FORBIDDEN_FIELDS = ("chr", "pos", "ref", "alt", "rsid", "qual", "filter")
+
+ALLELE_DELIMITER = re.compile(r"[|/]")
+
+# Characters of alternative alleles that are not simple substitutions
+# (breakends, structural variants)
+SPECIAL_ALT_CHARS = re.compile(r"[\[\]<]")
+
+
+def _map(func, values):
+    """``map``, but make missing values None."""
+    return [func(x) if x not in MISSING_VALUES else None for x in values]
+
+
+def _parse_filter(value: str):
+    """Parse FILTER column (or FT genotype field) like PyVCF does"""
+    if value == ".":
+        return None
+    if value == "PASS":
+        return []
+    return value.split(";")
+
+
+def _join(value):
+    """Join list values with commas like VcfReader does for PyVCF values"""
+    if isinstance(value, list):
+        return ",".join(str(i) for i in value)
+    return value
+
+
+def get_gt_type(gt: str) -> int:
+    """Return the genotype code of the given GT string
+
+    0: homozygous_ref, 1: heterozygous, 2: homozygous_alt, -1: not called
+    (See `_Call.gt_type` in PyVCF)
+    """
+    if gt is None:
+        return -1
+
+    alleles = [None if allele == "." else allele for allele in ALLELE_DELIMITER.split(gt)]
+    if all(allele is None for allele in alleles):
+        return -1
+
+    first = alleles[0]
+    if all(allele == first for allele in alleles[1:]):
+        return 0 if first == "0" else 2
+    return 1
+
+
+class VcfTokenizer:
+    """Parser of VCF lines into variants
+
+    The header must be parsed beforehand by PyVCF.
+
+    Example:
+        >>> vcf_reader = vcf.VCFReader(device, strict_whitespace=True)
+        >>> tokenizer = VcfTokenizer(vcf_reader)
+        >>> for variant in tokenizer.parse_lines(vcf_reader.reader):
+        ...     print(variant["chr"], variant["pos"])
+
+    Attributes:
+        samples (list): Names of the decoded samples in the order of the columns
+        sample_indexes (list): Indexes of the columns of the decoded samples
+        infos (dict): INFO ids as keys, tuple of PyVCF type code and a boolean
+            True if the field has a single value as values.
+        formats (dict): FORMAT ids as keys, tuple of PyVCF type code and
+            number of values as values.
+    """
+
+    def __init__(self, vcf_reader, infos=None, formats=None, samples=None):
+        """
+        :param vcf_reader: PyVCF reader; its header must have been read.
+        :key infos: Keys of the INFO fields to decode (default: None, all).
+        :key formats: Keys of the FORMAT fields to decode (default: None, all).
+        :key samples: Names of the samples to decode (default: None, all).
+        """
+        # Indexes of the columns of the decoded samples
+        self.sample_indexes = [
+            index
+            for index, name in enumerate(vcf_reader.samples)
+            if samples is None or name in samples
+        ]
+        self.samples = [vcf_reader.samples[index] for index in self.sample_indexes]
+        self.infos = {
+            key: (info.type_code, info.num == 1)
+            for key, info in vcf_reader.infos.items()
+            if infos is None or key in infos
+        }
+        self.formats = {
+            key: (fmt.type_code, fmt.num) for key, fmt in vcf_reader.formats.items()
+        }
+        # Genotype format fields; gt field is computed separately
+        self.format_fields = set(
+            map(str.lower, vcf_reader.formats if formats is None else formats)
+        )
+        self.format_fields.discard("gt")
+
+        # Used for breakends and structural variants
+        self._parse_alt = vcf_reader._parse_alt
+        self._format_cache = dict()
+
+    def parse_lines(self, lines):
+        """Yield variants from the given VCF body lines
+
+        1 variant is created for each alternative allele of each record.
+
+        .. seealso:: :meth:`cutevariant.core.reader.vcfreader.VcfReader.parse_variants`
+
+        :param lines: Iterable of VCF lines without header.
+        :return: Generator of variants.
+        :rtype: <generator <dict>>
+        """
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+
+            row = line.split("\t")
+
+            try:
+                qual = int(row[5])
+            except ValueError:
+                try:
+                    qual = float(row[5])
+                except ValueError:
+                    qual = None
+
+            filters = _parse_filter(row[6])
+            record = {
+                "chr": row[0],
+                "pos": int(row[1]),
+                "ref": row[3],
+                "rsid": None if row[2] == "." else row[2],
+                "qual": qual,
+                "filter": "" if filters is None else ",".join(filters),
+            }
+            info = self.parse_info(row[7])
+
+            fmt = row[8] if len(row) > 8 else None
+            samples = None
+            if fmt is not None and fmt != "." and self.samples:
+                samples = self.parse_samples(fmt, row[9:])
+
+            for alt in row[4].split(","):
+                variant = {
+                    "chr": record["chr"],
+                    "pos": record["pos"],
+                    "ref": record["ref"],
+                    "alt": self.parse_alt(alt),
+                    "rsid": record["rsid"],
+                    "qual": record["qual"],
+                    "filter": record["filter"],
+                }
+                variant.update(info)
+
+                if samples:
+                    # Each variant has its own copy of sample data
+                    variant["samples"] = [dict(sample) for sample in samples]
+
+                yield variant
+
+    def parse_alt(self, alt: str) -> str:
+        """Return the alternative allele as written by PyVCF"""
+        if alt in MISSING_VALUES:
+            return "None"
+        if SPECIAL_ALT_CHARS.search(alt) or (
+            len(alt) > 1 and (alt[0] == "." or alt[-1] == ".")
+        ):
+            return str(self._parse_alt(alt))
+        return alt
+
+    def parse_info(self, info: str) -> dict:
+        """Decode INFO column
+
+        Only fields declared in the header are decoded; fields whose names
+        are variant fields (chr, pos, etc.) are skipped.
+
+        :return: Lower case names of fields as keys.
+        """
+        data = dict()
+        if info == ".":
+            return data
+
+        for entry in info.split(";"):
+            key, sep, value = entry.partition("=")
+            try:
+                type_code, single = self.infos[key]
+            except KeyError:
+                # Not declared in the header => not in the fields of the DB
+                continue
+
+            name = key.lower()
+            if name in FORBIDDEN_FIELDS:
+                continue
+
+            if type_code == FLAG or not sep:
+                data[name] = True
+                continue
+
+            values = value.split(",")
+            if type_code == INTEGER:
+                try:
+                    values = _map(int, values)
+                except ValueError:
+                    values = _map(float, values)
+            elif type_code == FLOAT:
+                values = _map(float, values)
+            else:
+                values = _map(str, values)
+
+            data[name] = values[0] if single else _join(values)
+
+        return data
+
+    def parse_samples(self, fmt: str, columns: list) -> list:
+        """Decode genotype columns
+
+        :param fmt: FORMAT column
+        :param columns: Genotype columns of the record
+        :return: List of sample data with at least "name" and "gt" keys.
+        :rtype: <list <dict>>
+        """
+        gt_index, decoders = self._get_format_decoders(fmt)
+
+        samples = []
+        for name, column_index in zip(self.samples, self.sample_indexes):
+            if column_index >= len(columns):
+                break
+            values = columns[column_index].split(":")
+            count = len(values)
+
+            sample = {
+                "name": name,
+                "gt": get_gt_type(
+                    values[gt_index] if gt_index is not None and gt_index < count else None
+                ),
+            }
+
+            for field_name, index, type_code, number in decoders:
+                value = values[index] if index < count else None
+                sample[field_name] = self.decode_format_value(value, field_name, type_code, number)
+
+            samples.append(sample)
+        return samples
+
+    def _get_format_decoders(self, fmt: str):
+        """Return the index of GT and the decoders of the fields of FORMAT
+
+        Decoders are tuples of field name, index, type code, and number of values.
+        Only fields declared in the header are decoded.
+        """
+        if fmt in self._format_cache:
+            return self._format_cache[fmt]
+
+        keys = fmt.split(":")
+        gt_index = keys.index("GT") if "GT" in keys else None
+
+        decoders = []
+        for field_name in self.format_fields:
+            key = field_name.upper()
+            if key not in keys:
+                # Field not in genotype fields of this record
+                continue
+            type_code, number = self.formats.get(
+                key, (RESERVED_FORMAT_CODES.get(key, STRING), None)
+            )
+            decoders.append((field_name, keys.index(key), type_code, number))
+
+        self._format_cache[fmt] = gt_index, decoders
+        return gt_index, decoders
+
+    @staticmethod
+    def decode_format_value(value, field_name, type_code, number):
+        """Decode the value of a genotype field"""
+        if value is None:
+            return None
+
+        if field_name == "ft":
+            return _join(_parse_filter(value))
+
+        if value in ("", "."):
+            return None
+
+        if number == 1:
+            if type_code == INTEGER:
+                try:
+                    return int(value)
+                except ValueError:
+                    return float(value)
+            if type_code == FLOAT:
+                return float(value)
+            return value
+
+        values = value.split(",")
+        if type_code == INTEGER:
+            try:
+                values = _map(int, values)
+            except ValueError:
+                values = _map(float, values)
+        elif type_code == FLOAT:
+            values = _map(float, values)
+        return _join(values)
@@ -4,7 +4,7 @@
 import vcf
 
 # Custom imports
-from cutevariant.core.reader import VcfReader, CsvReader
+from cutevariant.core.reader import VcfReader, CsvReader, open_gzip
 import cutevariant.commons as cm
 
 
@@ -40,7 +40,7 @@ def detect_vcf_annotation(filepath):
 
 
 @contextmanager
-def create_reader(filepath):
+def create_reader(filepath, processes=1, fast_parser=False, presorted=False):
     """Context manager that wraps the given file and return an accurate reader
 
     A detection of the file type is made as well as a detection of the
@@ -51,6 +51,12 @@ def create_reader(filepath):
         - vcf.gz: snpeff, vep
         - vcf: snpeff, vep
         - csv, tsv, txt: vep
+
+    :key processes: Number of processes used to parse VCF files.
+    :key fast_parser: Parse VCF files with the lightweight tokenizer instead
+        of PyVCF.
+    :key presorted: The transcripts of each variant are on consecutive lines
+        of CSV files; they are not sorted.
     """
     path = pathlib.Path(filepath)
 
@@ -62,8 +68,14 @@ def create_reader(filepath):
 
     if ".vcf" in path.suffixes and ".gz" in path.suffixes:
         annotation_detected = detect_vcf_annotation(filepath)
-        device = open(filepath, "rb")
-        reader = VcfReader(device, annotation_parser=annotation_detected)
+        # BGZF files are decompressed in a pool of threads
+        device = open_gzip(filepath)
+        reader = VcfReader(
+            device,
+            annotation_parser=annotation_detected,
+            processes=processes,
+            fast_parser=fast_parser,
+        )
         yield reader
         device.close()
         return
@@ -71,14 +83,19 @@ def create_reader(filepath):
     if ".vcf" in path.suffixes:
         annotation_detected = detect_vcf_annotation(filepath)
         device = open(filepath, "r")
-        reader = VcfReader(device, annotation_parser=annotation_detected)
+        reader = VcfReader(
+            device,
+            annotation_parser=annotation_detected,
+            processes=processes,
+            fast_parser=fast_parser,
+        )
         yield reader
         device.close()
         return
 
     if {".tsv", ".csv", ".txt"} & set(path.suffixes):
         device = open(filepath, "r")
-        reader = CsvReader(device)
+        reader = CsvReader(device, presorted=presorted)
         yield reader
         device.close()
         return
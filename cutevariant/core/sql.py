@@ -26,9 +26,13 @@
 
 # Standard imports
 import sqlite3
+import json
 from collections import defaultdict
 import re
 import logging
+import time
+import hashlib
+import os
 from pkg_resources import parse_version
 from functools import partial, lru_cache
 import itertools as it
@@ -36,6 +40,15 @@
 
 # Custom imports
 import cutevariant.commons as cm
+from cutevariant.core import genotypes
+from cutevariant.core.intervals import (
+    load_intervals,
+    merge_sorted_intervals,
+    intersect_sorted,
+    ucsc_bin,
+    containing_bins_sql,
+    UnsortedIntervalsError,
+)
 
 LOGGER = cm.logger()
 
@@ -43,6 +56,27 @@
 ## Misc functions ==============================================================
 
 
+class ProjectConnection(sqlite3.Connection):
+    """Connection to a project and to the store of its cached data
+
+    The store is opened on demand by :meth:`get_cache_connection` and closed
+    with the project.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_conn = None
+        # Last accesses to cached results not yet written in the store
+        # (normalized query as key, time as value)
+        self.cache_accesses = dict()
+
+    def close(self):
+        if self.cache_conn is not None:
+            self.cache_conn.close()
+            self.cache_conn = None
+        super().close()
+
+
 def get_sql_connection(filepath):
     """Open a SQLite database and return the connection object
 
@@ -54,7 +88,7 @@ def get_sql_connection(filepath):
             The connection is initialized with `row_factory = Row`.
             So all results are accessible via indexes or keys.
     """
-    connection = sqlite3.connect(filepath)
+    connection = sqlite3.connect(filepath, factory=ProjectConnection)
     # Activate Foreign keys
     connection.execute("PRAGMA foreign_keys = ON")
     connection.row_factory = sqlite3.Row
@@ -68,6 +102,8 @@ def regexp(expr, item):
         return re.search(expr, str(item)) is not None
 
     connection.create_function("REGEXP", 2, regexp)
+    # Decoders of packed genotypes
+    genotypes.register_functions(connection)
 
     if LOGGER.getEffectiveLevel() == logging.DEBUG:
         # Enable tracebacks from custom functions in DEBUG mode only
@@ -85,6 +121,7 @@ def drop_table(conn, table_name):
     """
     cursor = conn.cursor()
     cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+    bump_write_counter(cursor)
     conn.commit()
 
 
@@ -97,6 +134,7 @@ def clear_table(conn: sqlite3.Connection, table_name):
     """
     cursor = conn.cursor()
     cursor.execute(f"DELETE  FROM {table_name}")
+    bump_write_counter(cursor)
     conn.commit()
 
 
@@ -140,6 +178,68 @@ def create_indexes(conn: sqlite3.Connection):
         LOGGER.debug("create_indexes:: sqlite3.%s: %s", e.__class__.__name__, str(e))
 
 
+def begin_bulk_load(conn: sqlite3.Connection):
+    """Tune the connection for massive insertions
+
+    Journal is kept in memory, synchronous writes and foreign keys checks are
+    disabled; cache is enlarged and temporary tables are kept in memory.
+    See :data:`cutevariant.commons.BULK_LOAD_PRAGMAS`.
+
+    Args:
+        conn (sqlite3.Connection): Sqlite3 Connection
+
+    Returns:
+        (dict): Previous values of the modified pragmas; must be given to
+            :meth:`end_bulk_load`.
+
+    Warning:
+        The database may be corrupted if the program crashes while bulk load
+        is enabled.
+    """
+    # Pragmas like journal_mode or foreign_keys can't be changed in a transaction
+    conn.commit()
+    previous_settings = {
+        pragma: conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+        for pragma in cm.BULK_LOAD_PRAGMAS
+    }
+    for pragma, value in cm.BULK_LOAD_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+
+    LOGGER.debug("begin_bulk_load:: previous settings: %s", previous_settings)
+    return previous_settings
+
+
+def end_bulk_load(conn: sqlite3.Connection, previous_settings: dict):
+    """Restore the settings of the connection and run the deferred foreign
+    keys checks
+
+    Args:
+        conn (sqlite3.Connection): Sqlite3 Connection
+        previous_settings (dict): Settings returned by :meth:`begin_bulk_load`
+
+    Raises:
+        sqlite3.IntegrityError: If foreign keys constraints are violated by
+            data inserted during the bulk load.
+    """
+    conn.commit()
+    for pragma, value in previous_settings.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+
+    # Deferred foreign keys checks
+    violations = conn.execute("PRAGMA foreign_key_check").fetchall()
+    if violations:
+        for table, rowid, parent, _ in violations[:10]:
+            LOGGER.error(
+                "end_bulk_load:: row %s of table %s has no parent in %s",
+                rowid,
+                table,
+                parent,
+            )
+        raise sqlite3.IntegrityError(
+            f"{len(violations)} foreign key constraint(s) violated during bulk load"
+        )
+
+
 def count_query(conn, query):
     """Count elements from the given query or table
 
@@ -150,6 +250,35 @@ def count_query(conn, query):
     return conn.execute(f"SELECT COUNT(*) as count FROM ({query})").fetchone()[0]
 
 
+def get_query_plan(conn, query, params=()):
+    """Return the plan of the given query (EXPLAIN QUERY PLAN)
+
+    Args:
+        conn (sqlite3.Connection): Sqlite3 Connection
+        query (str): SQL query
+        params (tuple/dict): Parameters bound to the query
+
+    Returns:
+        list[dict]: Steps of the plan in the order of the tree, with `id`,
+            `parent`, `depth` (0 for the top level steps) and `detail` keys.
+    """
+    depths = {0: -1}
+    plan = []
+    for step_id, parent, _, detail in conn.execute(
+        f"EXPLAIN QUERY PLAN {query}", params
+    ):
+        depths[step_id] = depths.get(parent, -1) + 1
+        plan.append(
+            {
+                "id": step_id,
+                "parent": parent,
+                "depth": depths[step_id],
+                "detail": detail,
+            }
+        )
+    return plan
+
+
 ## project table ===============================================================
 
 
@@ -181,12 +310,16 @@ def create_project(conn: sqlite3.Connection, name: str, reference: str):
 def create_table_metadatas(conn: sqlite3.Connection):
     """Create table metdata
 
+    The store of the data cached for a previous project with the same path
+    is removed (see :meth:`remove_cache_store`).
+
     Args:
         conn (sqlite3.Connection): Sqlite3 Connection
     """
     conn.execute(
         "CREATE TABLE metadatas (id INTEGER PRIMARY KEY, key TEXT, value TEXT)"
     )
+    remove_cache_store(conn)
 
 
 def insert_many_metadatas(conn: sqlite3.Connection, metadatas={}):
@@ -204,6 +337,37 @@ def insert_many_metadatas(conn: sqlite3.Connection, metadatas={}):
         conn.commit()
 
 
+def update_metadatas(conn: sqlite3.Connection, metadatas: dict):
+    """Insert or replace the given metadatas
+
+    Args:
+        conn (sqlite3.Connection/sqlite3.Cursor): Sqlite3 Connection.
+            If a cursor is given, no commit is done; the update is part of the
+            current transaction.
+        metadatas (dict): matadata fieldname as keys
+    """
+    cursor = conn.cursor() if isinstance(conn, sqlite3.Connection) else conn
+    cursor.executemany(
+        "DELETE FROM metadatas WHERE key = ?", ((key,) for key in metadatas)
+    )
+    cursor.executemany(
+        "INSERT INTO metadatas (key,value) VALUES (?,?)", list(metadatas.items())
+    )
+    if isinstance(conn, sqlite3.Connection):
+        conn.commit()
+
+
+def delete_metadatas(conn: sqlite3.Connection, keys: list):
+    """Delete metadatas with the given fieldnames
+
+    Args:
+        conn (sqlite3.Connection): Sqlite3 Connection
+        keys (list): matadata fieldnames
+    """
+    conn.executemany("DELETE FROM metadatas WHERE key = ?", ((key,) for key in keys))
+    conn.commit()
+
+
 def get_metadatas(conn: sqlite3.Connection):
     """Return a dictionary of metadatas
 
@@ -215,6 +379,60 @@ def get_metadatas(conn: sqlite3.Connection):
     return {data["key"]: data["value"] for data in g}
 
 
+@lru_cache(maxsize=32)
+def read_write_counter(conn: sqlite3.Connection, data_version: int) -> int:
+    """Read the write counter of the project; see :meth:`get_write_counter`"""
+    try:
+        row = conn.execute(
+            "SELECT value FROM metadatas WHERE key = ?", (cm.WRITE_COUNTER_KEY,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # No metadatas table
+        return 0
+    return int(row[0]) if row else 0
+
+
+def get_write_counter(conn: sqlite3.Connection) -> int:
+    """Return the number of writes in the project
+
+    The counter is read again only if the database has been modified by
+    another connection (`PRAGMA data_version`) or by :meth:`bump_write_counter`.
+
+    Args:
+        conn (sqlite3.Connection): Sqlite3 Connection
+    """
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    return read_write_counter(conn, data_version)
+
+
+def bump_write_counter(conn: sqlite3.Connection):
+    """Increment the write counter of the project
+
+    Called by the functions that modify the data of queries (variants,
+    selections, wordsets): results stored in query_cache table become obsolete.
+    See :meth:`get_cached_result`.
+
+    Args:
+        conn (sqlite3.Connection/sqlite3.Cursor): Sqlite3 Connection.
+            No commit is done; the update is part of the current transaction.
+    """
+    cursor = conn.cursor() if isinstance(conn, sqlite3.Connection) else conn
+    try:
+        cursor.execute(
+            "UPDATE metadatas SET value = CAST(value AS INTEGER) + 1 WHERE key = ?",
+            (cm.WRITE_COUNTER_KEY,),
+        )
+        if not cursor.rowcount:
+            cursor.execute(
+                "INSERT INTO metadatas (key, value) VALUES (?, 1)",
+                (cm.WRITE_COUNTER_KEY,),
+            )
+    except sqlite3.OperationalError:
+        # No metadatas table: nothing can be cached
+        pass
+    read_write_counter.cache_clear()
+
+
 ## selections & sets tables ====================================================
 
 
@@ -237,6 +455,7 @@ def delete_by_name(conn: sqlite3.Connection, name: str, table_name: str = None):
 
     cursor = conn.cursor()
     cursor.execute(f"DELETE FROM `{table_name}` WHERE name = ?", (name,))
+    bump_write_counter(cursor)
     conn.commit()
     return cursor.rowcount
 
@@ -289,7 +508,7 @@ def create_selections_indexes(conn: sqlite3.Connection):
         * This function should be called after batch insertions.
         * This function ensures the unicity of selections names.
     """
-    conn.execute("CREATE UNIQUE INDEX idx_selections ON selections (name)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_selections ON selections (name)")
 
 
 def create_selection_has_variant_indexes(conn: sqlite3.Connection):
@@ -305,7 +524,7 @@ def create_selection_has_variant_indexes(conn: sqlite3.Connection):
         conn (sqlite3.Connection/sqlite3.Cursor): Sqlite3 connection
     """
     conn.execute(
-        "CREATE INDEX idx_selection_has_variant ON selection_has_variant (selection_id)"
+        "CREATE INDEX IF NOT EXISTS idx_selection_has_variant ON selection_has_variant (selection_id)"
     )
 
 
@@ -336,6 +555,7 @@ def insert_selection(conn, query: str, name="no_name", count=0):
         "INSERT INTO selections (name, count, query) VALUES (?,?,?)",
         (name, count, query),
     )
+    bump_write_counter(cursor)
     if isinstance(conn, sqlite3.Connection):
         # Commit only if connection is given. => avoid not consistent DB
         conn.commit()
@@ -425,6 +645,15 @@ def create_selection_from_bed(
     BED file will be referenced into the table selection_has_variant under
     a new selection.
 
+    Intervals are merged and stored in bed_table with their UCSC bins
+    (see :mod:`cutevariant.core.intervals`). The smallest side drives the
+    join:
+
+        - few intervals: each interval is a range scan of the
+          (chr, pos) index of variants;
+        - few variants: the intervals that may contain each variant are
+          searched in 5 bins of bed_table.
+
     Args:
         conn (sqlite3.connection): Sqlite3 connection
         source (str): Selection name (source); Ex: "variants" (default)
@@ -439,43 +668,169 @@ def create_selection_from_bed(
     cur = conn.cursor()
 
     # Create temporary table
+    # chr has the type of variants.chr: same affinity, so the joins use indexes
     cur.execute("DROP TABLE IF exists bed_table")
     cur.execute(
         """CREATE TABLE bed_table (
         id INTEGER PRIMARY KEY ASC,
         bin INTEGER DEFAULT 0,
-        chr TEXT,
+        chr str,
         start INTEGER,
         end INTEGER,
         name INTEGER)"""
     )
 
+    # Merged intervals: a variant is found only once
+    intervals = [
+        (ucsc_bin(start, end), chrom, start, end)
+        for chrom, chrom_intervals in load_intervals(bed_intervals).items()
+        for start, end in chrom_intervals
+    ]
     cur.executemany(
-        "INSERT INTO bed_table (chr, start, end, name) VALUES (:chrom,:start,:end,:name)",
-        bed_intervals
+        "INSERT INTO bed_table (bin, chr, start, end) VALUES (?,?,?,?)", intervals
+    )
+    cur.execute("CREATE INDEX idx_bed_table ON bed_table (chr, bin, start)")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_variants_chr_pos ON variants (chr, pos)"
     )
 
+    source_count = cur.execute(
+        "SELECT count FROM selections WHERE name = ?", (source,)
+    ).fetchone()
+    source_count = source_count[0] if source_count else 0
+
     if source == "variants":
-        source_query = "SELECT variants.id AS variant_id FROM variants"
+        source_join = ""
     else:
-        source_query = f"""
-        SELECT variants.id AS variant_id FROM variants
+        source_join = f"""
         INNER JOIN selections ON selections.name = '{source}'
-        INNER JOIN selection_has_variant AS sv ON sv.selection_id = selections.id AND sv.variant_id = variants.id 
-        """
+        INNER JOIN selection_has_variant AS sv ON sv.selection_id = selections.id AND sv.variant_id = variants.id"""
 
-    query = (
-        source_query
-        + """
-        INNER JOIN bed_table ON
+    # CROSS JOIN: SQLite keeps the order of the tables around it
+    if len(intervals) <= source_count:
+        query = f"""
+        SELECT variants.id AS variant_id FROM bed_table
+        CROSS JOIN variants ON
         variants.chr = bed_table.chr AND
         variants.pos >= bed_table.start AND
-        variants.pos <= bed_table.end"""
-    )
+        variants.pos <= bed_table.end{source_join}"""
+    else:
+        query = f"""
+        SELECT variants.id AS variant_id FROM variants{source_join}
+        CROSS JOIN bed_table ON
+        bed_table.chr = variants.chr AND
+        bed_table.bin IN ({containing_bins_sql("variants.pos")}) AND
+        bed_table.start <= variants.pos AND
+        bed_table.end >= variants.pos"""
 
     return create_selection_from_sql(conn, query, target, from_selection=True)
 
 
+def create_selection_from_sorted_bed(
+    conn: sqlite3.Connection,
+    source: str,
+    target: str,
+    bed_intervals,
+    batch_size=cm.DEFAULT_BATCH_SIZE,
+):
+    """Create a new selection with a sort-merge sweep of the given intervals
+
+    Alternative to the SQL join of :meth:`create_selection_from_bed` with the
+    same results: for each chromosome of the BED file, the variants of the
+    source are read ordered by position through the (chr, pos) index and
+    swept along the merged intervals; matching ids are inserted in batches.
+    Time is linear and memory doesn't depend on the number of intervals.
+
+    Intervals are streamed if they are grouped by chromosome and sorted by
+    start (see :meth:`cutevariant.core.intervals.merge_sorted_intervals`);
+    otherwise, they are read again and sorted in memory.
+
+    Args:
+        conn (sqlite3.connection): Sqlite3 connection
+        source (str): Selection name (source); Ex: "variants" (default)
+        target (str): Selection name (target)
+        bed_intervals (BedReader/list [dict]): Intervals with (chrom, start,
+            end) keys; can be iterated twice
+        batch_size (int): Number of variants ids inserted at once
+
+    Returns:
+        selection_id, if lines have been inserted; None otherwise.
+    """
+    try:
+        return sweep_intervals(
+            conn, source, target, merge_sorted_intervals(bed_intervals), batch_size
+        )
+    except UnsortedIntervalsError as e:
+        LOGGER.debug("create_selection_from_sorted_bed:: %s; sorting intervals", e)
+        conn.rollback()
+
+    intervals = (
+        (chrom, start, end)
+        for chrom, chrom_intervals in load_intervals(bed_intervals).items()
+        for start, end in chrom_intervals
+    )
+    return sweep_intervals(conn, source, target, intervals, batch_size)
+
+
+def sweep_intervals(
+    conn: sqlite3.Connection, source: str, target: str, intervals, batch_size: int
+):
+    """Insert the variants of source contained in the given intervals
+
+    See :meth:`create_selection_from_sorted_bed`.
+
+    Args:
+        intervals (iterable): Non overlapping (chrom, start, end) tuples
+            grouped by chromosome and sorted by start
+
+    Returns:
+        selection_id, if lines have been inserted; None otherwise (rollback).
+    """
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_variants_chr_pos ON variants (chr, pos)"
+    )
+    if source == "variants":
+        variants_query = "SELECT id, pos FROM variants WHERE chr = ? ORDER BY pos"
+    else:
+        variants_query = """SELECT variants.id, variants.pos FROM variants
+        INNER JOIN selections ON selections.name = ?
+        INNER JOIN selection_has_variant AS sv
+        ON sv.selection_id = selections.id AND sv.variant_id = variants.id
+        WHERE variants.chr = ? ORDER BY variants.pos"""
+
+    cursor = conn.cursor()
+    selection_id = insert_selection(cursor, "", name=target, count=0)
+
+    count = 0
+    batch = []
+    for chrom, chrom_intervals in it.groupby(intervals, key=lambda item: item[0]):
+        parameters = (chrom,) if source == "variants" else (source, chrom)
+        # Another cursor: ids are inserted while variants are read
+        variants = conn.execute(variants_query, parameters)
+        chrom_intervals = ((start, end) for _, start, end in chrom_intervals)
+        for variant_id in intersect_sorted(variants, chrom_intervals):
+            batch.append((variant_id, selection_id))
+            if len(batch) >= batch_size:
+                cursor.executemany(
+                    "INSERT INTO selection_has_variant VALUES (?, ?)", batch
+                )
+                count += len(batch)
+                batch = []
+    if batch:
+        cursor.executemany("INSERT INTO selection_has_variant VALUES (?, ?)", batch)
+        count += len(batch)
+
+    if count:
+        cursor.execute(
+            "UPDATE selections SET count = ? WHERE id = ?", (count, selection_id)
+        )
+        conn.commit()
+        return selection_id
+    # Must alert a user because no selection is created here
+    conn.rollback()
+    return None
+
+
 def get_selections(conn: sqlite3.Connection):
     """Get selections in "selections" table
 
@@ -508,6 +863,7 @@ def delete_selection(conn: sqlite3.Connection, selection_id: int):
     """
     cursor = conn.cursor()
     cursor.execute("DELETE FROM selections WHERE rowid = ?", (selection_id,))
+    bump_write_counter(cursor)
     conn.commit()
     return cursor.rowcount
 
@@ -526,6 +882,7 @@ def edit_selection(conn: sqlite3.Connection, selection: dict):
     conn.execute(
         "UPDATE selections SET name=:name, count=:count WHERE id = :id", selection
     )
+    bump_write_counter(conn)
     conn.commit()
     return cursor.rowcount
 
@@ -617,6 +974,7 @@ def import_wordset_from_file(conn: sqlite3.Connection, wordset_name, filename):
         "INSERT INTO wordsets (name, value) VALUES (?,?)",
         it.zip_longest(tuple(), data, fillvalue=wordset_name),
     )
+    bump_write_counter(conn)
     conn.commit()
     return cursor.rowcount
 
@@ -649,6 +1007,50 @@ def get_words_in_set(conn, wordset_name):
         yield dict(row)["value"]
 
 
+## temporary tables ============================================================
+
+
+def create_temp_values(conn: sqlite3.Connection, values):
+    """Store the given values in a temporary table and return a query on it
+
+    Used for the long lists of values of IN conditions: the values are bound
+    as parameters instead of being inlined in the SQL text, and the primary
+    key of the table is used to search them.
+    The name of the table is the digest of the values: the same list gives
+    the same query (see query_cache table) and the table is filled only once
+    per connection. Temporary tables are dropped when the connection is closed.
+
+    Args:
+        conn (sqlite3.Connection): Sqlite3 Connection
+        values (iterable): Values of the list
+
+    Returns:
+        str: SQL subquery that returns the values
+            (``SELECT value FROM temp.in_values_<digest>``).
+    """
+    values = sorted(set(values), key=lambda value: (type(value).__name__, value))
+    digest = hashlib.sha1(repr(values).encode()).hexdigest()
+    table_name = f"in_values_{digest[:16]}"
+    query = f"SELECT value FROM temp.{table_name}"
+
+    if conn.execute(
+        "SELECT 1 FROM sqlite_temp_master WHERE type = 'table' AND name = ?",
+        (table_name,),
+    ).fetchone():
+        return query
+
+    in_transaction = conn.in_transaction
+    conn.execute(f"CREATE TEMP TABLE {table_name} (value PRIMARY KEY) WITHOUT ROWID")
+    conn.executemany(
+        f"INSERT INTO temp.{table_name} (value) VALUES (?)",
+        ((value,) for value in values),
+    )
+    if not in_transaction:
+        # Only the temporary database is modified
+        conn.commit()
+    return query
+
+
 ## Operations on sets of variants ==============================================
 
 
@@ -771,6 +1173,65 @@ def insert_many_fields(conn, data: list):
     conn.commit()
 
 
+def insert_new_fields(conn, data: list):
+    """Insert fields that are not yet in the database and add their columns
+    to the tables of their categories
+
+    Used to append a new file to an existing project.
+
+    :param conn: sqlite3.connect
+    :param data: list of field dictionnary
+    :return: New fields
+    :rtype: <list <dict>>
+
+    .. note:: Constraints of fields are not used: a column with a NOT NULL
+        constraint can't be added to a table which contains data.
+
+    .. note:: In projects with packed genotypes, sample fields are added to
+        the genotypes table; the ones that can't be packed are ignored.
+    """
+    packed = has_packed_genotypes(conn)
+    tables = {
+        "variants": "variants",
+        "annotations": "annotations",
+        "samples": "genotypes" if packed else "sample_has_variant",
+    }
+    known_fields = {
+        (row[0], row[1]) for row in conn.execute("SELECT category, name FROM fields")
+    }
+    # Some columns are not described in fields table (See create_table_annotations)
+    columns = {
+        category: set(get_table_columns(conn, table))
+        for category, table in tables.items()
+    }
+
+    new_fields = []
+    for field in data:
+        category, name = field["category"], field["name"]
+        if (category, name) in known_fields:
+            continue
+
+        column_type = field["type"]
+        if category == "samples" and packed:
+            if not genotypes.is_packable(field):
+                continue
+            column_type = "BLOB"
+
+        known_fields.add((category, name))
+        new_fields.append(field)
+        if name not in columns[category]:
+            conn.execute(
+                f"ALTER TABLE {tables[category]} ADD COLUMN `{name}` {column_type}"
+            )
+
+    if new_fields:
+        insert_many_fields(conn, new_fields)
+        # Fields are cached
+        get_fields.cache_clear()
+        get_field_by_category.cache_clear()
+    return new_fields
+
+
 @lru_cache()
 def get_fields(conn):
     """Get fields as list of dictionnary
@@ -839,6 +1300,15 @@ def get_field_range(conn, field_name: str, sample_name=None):
         JOIN samples ON sample_has_variant.sample_id = samples.id
         WHERE samples.name='{sample_name}'
         """
+        if has_packed_genotypes(conn):
+            expression = get_packed_sample_field(conn, field, sample_name)
+            query = f"SELECT min({expression}), max({expression}) FROM genotypes"
+    elif (
+        table == "annotations"
+        and field_name in get_annotation_dictionary_settings(conn)[0]
+    ):
+        query = f"""SELECT min(value), max(value) FROM annotation_dictionary
+        WHERE field = '{field_name}'"""
     else:
         query = f"SELECT min({field_name}), max({field_name}) FROM {table}"
 
@@ -870,6 +1340,15 @@ def get_field_unique_values(conn, field_name: str, sample_name=None):
         JOIN samples ON sample_has_variant.sample_id = samples.id
         WHERE samples.name='{sample_name}'
         """
+        if has_packed_genotypes(conn):
+            expression = get_packed_sample_field(conn, field, sample_name)
+            query = f"SELECT DISTINCT {expression} AS {field_name} FROM genotypes"
+    elif (
+        table == "annotations"
+        and field_name in get_annotation_dictionary_settings(conn)[0]
+    ):
+        query = f"""SELECT value AS `{field_name}` FROM annotation_dictionary
+        WHERE field = '{field_name}'"""
     else:
         query = f"SELECT DISTINCT `{field_name}` FROM {table}"
     return [i[field_name] for i in conn.execute(query)]
@@ -923,18 +1402,117 @@ def create_annotations_indexes(conn):
         LIMIT 100
     """
     # Allow search on variant_id
-    conn.execute("CREATE INDEX idx_annotations ON annotations (variant_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_annotations ON annotations (variant_id)")
 
 
 def get_annotations(conn, variant_id: int):
     """Get variant annotation for the variant with the given id"""
     conn.row_factory = sqlite3.Row
     for annotation in conn.execute(
-        f"SELECT * FROM annotations WHERE variant_id = {variant_id}"
+        f"SELECT {get_annotations_columns(conn)} FROM annotations "
+        f"WHERE variant_id = {variant_id}"
     ):
         yield dict(annotation)
 
 
+def create_table_annotation_dictionary(conn, fields, threshold: int):
+    """Create "annotation_dictionary" table used to encode annotation values
+
+    Values of encoded annotation fields are stored as integer codes in
+    "annotations" table; codes are mapped to values in this table.
+    A field is decoded back (and is no longer encoded) as soon as its number
+    of distinct values exceeds the threshold.
+    Encoded fields and threshold are stored in metadatas table
+    (:data:`cutevariant.commons.ANNOTATION_DICTIONARY_KEY`).
+
+    :param fields: Annotation fields; only fields of type "str" are encoded.
+    :param threshold: Maximum number of distinct values of an encoded field.
+    """
+    conn.execute(
+        """CREATE TABLE annotation_dictionary (
+        field TEXT NOT NULL,
+        code INTEGER NOT NULL,
+        value TEXT,
+        PRIMARY KEY (field, code)
+        ) WITHOUT ROWID"""
+    )
+    conn.execute(
+        "CREATE UNIQUE INDEX idx_annotation_dictionary "
+        "ON annotation_dictionary (field, value)"
+    )
+    update_annotation_dictionary_settings(
+        conn,
+        [field["name"] for field in fields if field["type"] == "str"],
+        threshold,
+    )
+    conn.commit()
+
+
+def update_annotation_dictionary_settings(conn, fields: list, threshold: int):
+    """Save the encoded annotation fields and the threshold of encoding
+
+    :param conn: Connection or cursor; no commit is done with a cursor.
+    """
+    update_metadatas(
+        conn,
+        {
+            cm.ANNOTATION_DICTIONARY_KEY: json.dumps(
+                {"fields": fields, "threshold": threshold}
+            )
+        },
+    )
+
+
+def get_annotation_dictionary_settings(conn):
+    """Get the encoded annotation fields and the threshold of encoding
+
+    :return: List of encoded fields and threshold;
+        empty list and None if annotations are not encoded.
+    :rtype: <tuple <list>, <int>>
+    """
+    if not get_table_columns(conn, "annotation_dictionary"):
+        return [], None
+    settings = json.loads(get_metadatas(conn)[cm.ANNOTATION_DICTIONARY_KEY])
+    return settings["fields"], settings["threshold"]
+
+
+def get_annotation_dictionary(conn, field: str) -> dict:
+    """Get the codes of the values of an encoded annotation field
+
+    :return: Values as keys, codes as values.
+    """
+    return dict(
+        conn.execute(
+            "SELECT value, code FROM annotation_dictionary WHERE field = ?", (field,)
+        )
+    )
+
+
+def get_decoded_annotation_field(field: str, table="annotations") -> str:
+    """Return the SQL expression of the values of an encoded annotation field
+
+    :param field: Name of the field.
+    :key table: Name or alias of the annotations table.
+    """
+    return (
+        "(SELECT value FROM annotation_dictionary "
+        f"WHERE field = '{field}' AND code = `{table}`.`{field}`)"
+    )
+
+
+def get_annotations_columns(conn) -> str:
+    """Return the SQL columns used to select decoded rows of "annotations" table"""
+    fields, _ = get_annotation_dictionary_settings(conn)
+    if not fields:
+        return "*"
+    return ",".join(
+        f"{get_decoded_annotation_field(col)} AS `{col}`"
+        if col in fields
+        else f"`{col}`"
+        for col in get_table_columns(conn, "annotations")
+    )
+
+
 ## variants table ==============================================================
 
 
@@ -1004,11 +1582,15 @@ def create_variants_indexes(conn):
     """
     # Complementary index of the primary key (sample_id, variant_id)
     conn.execute(
-        "CREATE INDEX idx_sample_has_variant ON sample_has_variant (variant_id)"
+        "CREATE INDEX IF NOT EXISTS idx_sample_has_variant ON sample_has_variant (variant_id)"
     )
 
-    conn.execute("CREATE INDEX idx_variants_pos ON variants (pos)")
-    conn.execute("CREATE INDEX idx_variants_ref_alt ON variants (ref, alt)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_variants_pos ON variants (pos)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_variants_ref_alt ON variants (ref, alt)")
+    # Genomic intervals: regions of queries and BED intersections
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_variants_chr_pos ON variants (chr, pos)"
+    )
 
 
 def get_one_variant(
@@ -1055,12 +1637,15 @@ def get_one_variant(
     if with_annotations:
         variant["annotations"] = [
             dict(annotation) for annotation in conn.execute(
-                f"SELECT * FROM annotations WHERE variant_id = {variant_id}"
+                f"SELECT {get_annotations_columns(conn)} FROM annotations "
+                f"WHERE variant_id = {variant_id}"
             )
         ]
 
     variant["samples"] = []
-    if with_samples:
+    if with_samples and has_packed_genotypes(conn):
+        variant["samples"] = get_packed_genotypes(conn, variant_id)
+    elif with_samples:
         variant["samples"] = [
             dict(sample) for sample in conn.execute(
                 f"""SELECT samples.name, sample_has_variant.* FROM sample_has_variant
@@ -1102,22 +1687,95 @@ def update_variant(conn, variant: dict):
     # )
     cursor = conn.cursor()
     cursor.execute(query, values)
+    bump_write_counter(cursor)
     conn.commit()
 
 
+# Genotypes counters of variants; see AbstractReader.get_extra_fields()
+COUNTER_COLUMNS = (
+    "count_hom",
+    "count_het",
+    "count_ref",
+    "count_var",
+    "case_count_hom",
+    "case_count_het",
+    "case_count_ref",
+    "control_count_hom",
+    "control_count_het",
+    "control_count_ref",
+)
+
+
 def get_variants_count(conn):
     """Get the number of variants in the "variants" table"""
     return count_query(conn, "variants")
 
 
-def async_insert_many_variants(conn, data, total_variant_count=None, yield_every=3000):
+def async_insert_many_variants(
+    conn,
+    data,
+    total_variant_count=None,
+    batch_size=cm.DEFAULT_BATCH_SIZE,
+    append=False,
+    checkpoint=False,
+    start=0,
+    skip=None,
+    checkpoint_variant=None,
+    first_import_id=None,
+    progress_callback=None,
+):
     """Insert many variants from data into variants table
 
+    Variants are buffered and inserted by batches of `batch_size` items.
+    Ids of the variants are pre-assigned from the current maximum id of the
+    table, so that each batch is pushed with only one `executemany` call per
+    table (variants, annotations and sample_has_variant).
+
     :param conn: sqlite3.connect
     :param data: list of variant dictionnary which contains same number of key than fields numbers.
     :param total_variant_count: total variant count, to compute progression
+    :key batch_size: Number of variants inserted at once.
+    :key append: Variants are appended to an existing project: variants already
+        in the database are updated instead of being rejected.
+        Their genotypes counters (see :data:`COUNTER_COLUMNS`) are incremented
+        and the genotypes of new samples are linked to them; their annotations
+        are kept as is. The count of the default selection is updated.
+        Variants inserted or already updated from the same data (ids from
+        `first_import_id`, updated ids) are not updated again: their
+        duplicates are rejected as in a new project.
+    :key checkpoint: Commit each batch with the number of variants of data
+        processed so far (see :data:`cutevariant.commons.IMPORT_CHECKPOINT_KEY`
+        in metadatas table) and, if the variants have the offsets of their
+        records (:data:`cutevariant.commons.RECORD_OFFSET_KEY`), the position
+        of the last one in the file (:data:`cutevariant.commons.IMPORT_OFFSET_KEY`).
+        An interrupted insertion can be resumed from this checkpoint with the
+        `start` argument.
+    :key start: Number of variants of data already processed by a previous
+        insertion.
+    :key skip: Number of variants at the beginning of data that are already
+        processed; default: `start` (data is read from the beginning of the
+        file). Data read from the offset of the checkpoint starts with the
+        variants of its record already processed.
+    :key checkpoint_variant: Key (chr, pos, ref, alt) of the last variant
+        processed by the interrupted insertion; it is checked against the
+        last skipped variant.
+    :key first_import_id: Id of the first variant inserted from data; default:
+        next id of variants table. Must be given to resume an insertion in
+        append mode.
+    :key progress_callback: Function without argument that returns the
+        progression in percent; used instead of total_variant_count.
+        See :meth:`cutevariant.core.reader.abstractreader.AbstractReader.get_progress`.
     :return: Yield a tuple with progression and message.
-        Progression is 0 if total_variant_count is not set.
+        Progression is 0 if total_variant_count and progress_callback
+        are not set.
+
+    .. note:: If the project has a "genotypes" table (see
+        :meth:`create_table_genotypes`), sample data are packed in it instead
+        of being inserted in "sample_has_variant" table.
+
+    .. note:: If the project has an "annotation_dictionary" table (see
+        :meth:`create_table_annotation_dictionary`), values of encoded
+        annotation fields are replaced by their codes.
     :rtype: <generator <tuple <int>, <str>>
 
 
@@ -1127,10 +1785,17 @@ def async_insert_many_variants(conn, data, total_variant_count=None, yield_every
         insert_many_variant(conn, reader.get_variants())
 
     .. warning:: Using reader, this can take a while
-    .. todo:: with large dataset, need to cache import
     .. todo:: handle insertion errors...
     .. seealso:: abstractreader
 
+    .. note:: Pre-assigned ids of variants rejected by the unicity constraint
+        are not reused; there may be gaps in the ids of the variants table.
+
+    .. note:: Rejected variants are not logged one by one; they are stored
+        with the reason of their rejection in "rejected_variants" table
+        (see :meth:`create_table_rejected_variants`) and only their number
+        is reported in progress messages.
+
     .. warning:: About using INSERT OR IGNORE: They avoid the following errors:
 
         - Upon insertion of a duplicate key where the column must contain
@@ -1139,27 +1804,21 @@ def async_insert_many_variants(conn, data, total_variant_count=None, yield_every
           a NOT NULL constraint.
           => This is not recommended
     """
-
-    def build_columns_and_placeholders(table_name):
-        """Build a tuple of columns and "?" placeholders for INSERT queries"""
-        # Get columns description from the given table
-        cols = get_table_columns(conn, table_name)
-        # Build dynamic insert query
-        # INSERT INTO variant qcol1, qcol2.... VALUES ?, ?
-        tb_cols = ",".join([f"`{col}`" for col in cols])
-        tb_places = ",".join(["?" for place in cols])
-        return tb_cols, tb_places
-
     # TODO: Can we avoid this step ? This function should receive columns names
     # because all the tables were created before...
-    # Build placeholders
-    var_cols, var_places = build_columns_and_placeholders("variants")
-    ann_cols, ann_places = build_columns_and_placeholders("annotations")
-
     var_columns = get_table_columns(conn, "variants")
     ann_columns = get_table_columns(conn, "annotations")
     sample_columns = get_table_columns(conn, "sample_has_variant")
 
+    # Build dynamic insert queries
+    # INSERT INTO variant (qcol1, qcol2....) VALUES (?, ?)
+    # Note: ids of variants are given explicitly
+    var_cols = ",".join([f"`{col}`" for col in ["id"] + var_columns])
+    var_places = ",".join(["?"] * (len(var_columns) + 1))
+    ann_cols = ",".join([f"`{col}`" for col in ann_columns])
+    ann_places = ",".join(["?"] * len(ann_columns))
+    sample_places = ",".join(["?"] * len(sample_columns))
+
     # Get samples with samples names as keys and sqlite rowid as values
     # => used as a mapping for samples ids
     samples_id_mapping = dict(conn.execute("SELECT name, id FROM samples"))
@@ -1186,116 +1845,368 @@ def build_columns_and_placeholders(table_name):
                 VALUES ({var_places})
                 ON CONFLICT (chr,pos,ref,alt) DO NOTHING"""
 
+    ann_insert_query = f"INSERT INTO annotations ({ann_cols}) VALUES ({ann_places})"
+    sample_insert_query = f"INSERT INTO sample_has_variant VALUES ({sample_places})"
+
+    if append:
+        # Genotypes already in the database are kept
+        sample_insert_query = (
+            f"INSERT OR IGNORE INTO sample_has_variant VALUES ({sample_places})"
+        )
+        # Increment counters of variants already in the database
+        counter_columns = [col for col in COUNTER_COLUMNS if col in var_columns]
+        counters_update_query = "UPDATE variants SET {} WHERE id = ?".format(
+            ",".join(f"`{col}` = IFNULL(`{col}`, 0) + ?" for col in counter_columns)
+        )
+        existing_id_query = (
+            "SELECT id FROM variants WHERE chr = ? AND pos = ? AND ref = ? AND alt = ?"
+        )
+
+    # Packed genotypes: 1 row per variant, 1 blob per sample field
+    packed = has_packed_genotypes(conn)
+    if packed:
+        genotype_columns = get_table_columns(conn, "genotypes")[1:]
+        genotype_types = {
+            field["name"]: field["type"]
+            for field in get_field_by_category(conn, "samples")
+        }
+        genotype_insert_query = "INSERT OR REPLACE INTO genotypes VALUES ({})".format(
+            ",".join(["?"] * (len(genotype_columns) + 1))
+        )
+
+    def pack_genotypes(variant_id, samples, blobs={}):
+        """Return the row of "genotypes" table with the data of the given samples
+
+        :key blobs: Blobs already in the database, updated with the given data.
+        """
+        row = [variant_id]
+        indexes = [
+            genotypes.sample_index(samples_id_mapping[sample["name"]])
+            for sample in samples
+        ]
+        for col in genotype_columns:
+            values = {index: sample.get(col) for index, sample in zip(indexes, samples)}
+            if col == "gt":
+                row.append(genotypes.pack_gt(values, blobs.get(col)))
+            elif genotype_types.get(col) in genotypes.PACKED_TYPES:
+                row.append(
+                    genotypes.pack_values(values, genotype_types[col], blobs.get(col))
+                )
+            else:
+                row.append(blobs.get(col))
+        return row
+
+    # Dictionary encoding of annotations: field names as keys,
+    # {value: code} mappings as values
+    dictionary_fields, dictionary_threshold = get_annotation_dictionary_settings(conn)
+    dictionaries = {
+        field: get_annotation_dictionary(conn, field)
+        for field in dictionary_fields
+        if field in ann_columns
+    }
+
+    def encode_annotations(annotations):
+        """Replace values of encoded fields by their codes in the given rows
+
+        :return: New entries of the dictionary (field, code, value)
+        """
+        entries = []
+        for index, col in enumerate(ann_columns):
+            if col not in dictionaries:
+                continue
+            mapping = dictionaries[col]
+            for row in annotations:
+                value = row[index]
+                if value is None:
+                    continue
+                code = mapping.get(value)
+                if code is None:
+                    code = mapping[value] = len(mapping)
+                    entries.append((col, code, value))
+                row[index] = code
+        return entries
+
+    def decode_field(col):
+        """Store the values of the given field instead of their codes"""
+        LOGGER.debug(
+            "async_insert_many_variants:: Too many distinct values in %s "
+            "(> %s): the field is no longer encoded",
+            col,
+            dictionary_threshold,
+        )
+        cursor.execute(
+            f"UPDATE annotations SET `{col}` = {get_decoded_annotation_field(col)}"
+            f" WHERE `{col}` IS NOT NULL"
+        )
+        cursor.execute("DELETE FROM annotation_dictionary WHERE field = ?", (col,))
+        del dictionaries[col]
+        update_annotation_dictionary_settings(
+            cursor, list(dictionaries), dictionary_threshold
+        )
+
+    create_table_rejected_variants(conn)
+
     # Insertion - Begin transaction
     cursor = conn.cursor()
 
-    # Loop over variants
-    errors = 0
-    progress = 0
-    for variant_count, variant in enumerate(data, 1):
+    # Ids of the next variants are pre-assigned from the current maximum id
+    next_id = cursor.execute("SELECT IFNULL(MAX(id), 0) + 1 FROM variants").fetchone()[0]
+    if first_import_id is None:
+        first_import_id = next_id
+    # Ids of the variants updated in append mode; their duplicates are rejected
+    updated_ids = set()
+
+    def insert_batch(batch, first_id, first_index):
+        """Insert the given variants with ids starting from first_id
 
-        # Insert current variant
+        :param first_index: Index of the first variant of the batch in the
+            imported data (1-based); used to locate rejected variants.
+        :return: Number of variants rejected (missing key or unicity constraint)
+        """
+        # Create list of values to insert
+        # [id, "chr",234234,"A","G"]
         # Use default dict to handle missing values
-        # LOGGER.debug(
-        #    "async_insert_many_variants:: QUERY: %s\nVALUES: %s",
-        #    variant_insert_query,
-        #    variant,
-        # )
-
-        # Create list of value to insert
-        # ["chr",234234,"A","G"]
-        default_values = defaultdict(str, variant)
-        values = [default_values[col] for col in var_columns]
-
-        cursor.execute(variant_insert_query, values)
-
-        # If the row is not inserted we skip this erroneous variant
-        # and the data that goes with
-        if cursor.rowcount == 0:
-            LOGGER.error(
-                "async_insert_many_variants:: The following variant "
-                "contains erroneous data; most of the time it is a "
-                "duplication of the primary key: (chr,pos,ref,alt). "
-                "Please check your data; this variant and its attached "
-                "data will not be inserted!\n%s",
-                variant,
+        values = []
+        # Ids of variants without a complete key; they are not inserted
+        missing_key_ids = set()
+        for variant_id, variant in enumerate(batch, first_id):
+            key = [variant.get(col) for col in ("chr", "pos", "ref", "alt")]
+            if None in key or "" in key:
+                missing_key_ids.add(variant_id)
+                continue
+            default_values = defaultdict(str, variant)
+            values.append([variant_id] + [default_values[col] for col in var_columns])
+
+        cursor.executemany(variant_insert_query, values)
+
+        # Get ids really inserted; the others have been rejected
+        inserted_ids = {
+            row[0]
+            for row in cursor.execute(
+                "SELECT id FROM variants WHERE id BETWEEN ? AND ?",
+                (first_id, first_id + len(batch) - 1),
             )
-            errors += 1
-            continue
-
-        # Get variant rowid
-        variant_id = cursor.lastrowid
-
-        # If variant has annotation data, insert record into "annotations" table
-        # One-to-many relationships
-        if "annotations" in variant:
-            # print("VAR annotations:", variant["annotations"])
+        }
 
+        annotations = []
+        samples = []
+        packed_genotypes = []
+        counters = []
+        rejected = []
+        for index, (variant_id, variant) in enumerate(
+            enumerate(batch, first_id), first_index
+        ):
+
+            if variant_id in missing_key_ids:
+                key = [variant.get(col) for col in ("chr", "pos", "ref", "alt")]
+                rejected.append([index] + key + [cm.REJECTED_MISSING_KEY])
+                continue
+
+            updated = False
+            if variant_id not in inserted_ids and append:
+                # The variant may be already in the database: update it,
+                # unless it comes from the same data (duplicate)
+                existing_id = cursor.execute(
+                    existing_id_query,
+                    (variant["chr"], variant["pos"], variant["ref"], variant["alt"]),
+                ).fetchone()
+                if (
+                    existing_id
+                    and existing_id[0] < first_import_id
+                    and existing_id[0] not in updated_ids
+                ):
+                    variant_id = existing_id[0]
+                    updated_ids.add(variant_id)
+                    updated = True
+                    if counter_columns:
+                        counters.append(
+                            [variant.get(col, 0) for col in counter_columns]
+                            + [variant_id]
+                        )
+
+            # If the row is not inserted we skip this erroneous variant
+            # and the data that goes with
+            if variant_id not in inserted_ids and not updated:
+                key = [variant.get(col) for col in ("chr", "pos", "ref", "alt")]
+                rejected.append([index] + key + [cm.REJECTED_DUPLICATE])
+                continue
+
+            # If variant has annotation data, insert record into "annotations" table
+            # One-to-many relationships
             # [{'allele': 'T', 'consequence': 'intergenic_region', 'impact': 'MODIFIER', ...}]
-            # The aim is to execute all insertions through executemany()
-            # We remove the placeholder :variant_id from places,
-            # and fix it's value.
-            # TODO: handle missing values;
-            # Les dict de variant["annotations"] contiennent a priori déjà
-            # tous les champs requis (mais vides) car certaines annotations
-            # ont des données manquantes.
-            # A t'on l'assurance de cela ?
-            # Dans ce cas pourquoi doit-on bricoler le variant lui-meme avec un
-            # defaultdict(str,variant)) ? Les variants n'ont pas leurs champs par def ?
-
-            values = []
-            for ann in variant["annotations"]:
-                default_values = defaultdict(str, ann)
-                value = [default_values[col] for col in ann_columns[1:]]
-                value.insert(0, variant_id)
-                values.append(value)
-
-            temp_ann_places = ",".join(["?"] * (len(ann_columns)))
-
-            q = f"""INSERT INTO annotations ({ann_cols})
-                VALUES ({temp_ann_places})"""
-
-            cursor.executemany(q, values)
-
-        # If variant has sample data, insert record into "sample_has_variant" table
-        # Many-to-many relationships
-        if "samples" in variant:
-            # print("VAR samples:", variant["samples"])
+            # PS: Annotations of updated variants are already in the database
+            if not updated:
+                for ann in variant.get("annotations", []):
+                    default_values = defaultdict(str, ann)
+                    annotations.append(
+                        [variant_id] + [default_values[col] for col in ann_columns[1:]]
+                    )
+
+            # If variant has sample data, insert record into "sample_has_variant" table
+            # Many-to-many relationships
             # [{'name': 'NORMAL', 'gt': 1, 'AD': '64,0', 'AF': 0.0, ...}]
-            # Insertion only if the current sample name is in samples_names
-            # (authorized sample names already in the database)
-            #
-            # Is this test usefull since samples that are in the database
-            # have been inserted from the same source file (or it is not the case ?) ?
-            # => yes, we can use external ped file
             # Retrieve the id of the sample to build the association in
             # "sample_has_variant" table carrying the data "gt" (genotype)
-
-            samples = []
-            for sample in variant["samples"]:
-                sample_id = samples_id_mapping[sample["name"]]
+            if packed:
+                if not variant.get("samples"):
+                    continue
+                blobs = {}
+                if updated:
+                    # Add the new samples to the genotypes already in the database
+                    row = cursor.execute(
+                        "SELECT * FROM genotypes WHERE variant_id = ?", (variant_id,)
+                    ).fetchone()
+                    if row:
+                        blobs = dict(zip(["variant_id"] + genotype_columns, row))
+                packed_genotypes.append(
+                    pack_genotypes(variant_id, variant["samples"], blobs)
+                )
+                continue
+
+            for sample in variant.get("samples", []):
                 default_values = defaultdict(str, sample)
-                sample_value = [sample_id, variant_id]
-                sample_value += [default_values[i] for i in sample_columns[2:]]
-                samples.append(sample_value)
+                samples.append(
+                    [samples_id_mapping[sample["name"]], variant_id]
+                    + [default_values[col] for col in sample_columns[2:]]
+                )
+
+        if annotations:
+            if dictionaries:
+                cursor.executemany(
+                    "INSERT INTO annotation_dictionary VALUES (?,?,?)",
+                    encode_annotations(annotations),
+                )
+            cursor.executemany(ann_insert_query, annotations)
+
+            for col, mapping in list(dictionaries.items()):
+                if len(mapping) > dictionary_threshold:
+                    decode_field(col)
+
+        if samples:
+            cursor.executemany(sample_insert_query, samples)
+
+        if packed_genotypes:
+            cursor.executemany(genotype_insert_query, packed_genotypes)
+
+        if counters:
+            cursor.executemany(counters_update_query, counters)
+
+        if rejected:
+            cursor.executemany(
+                "INSERT INTO rejected_variants "
+                "(variant_index, chr, pos, ref, alt, reason) VALUES (?,?,?,?,?,?)",
+                rejected,
+            )
+
+        return len(rejected)
+
+    # Last variant read from data and number of variants of its record
+    position = {"offset": None, "count": 0, "variant": None}
+
+    def track_positions(variants):
+        """Yield the given variants; keep the position of the last one"""
+        for variant in variants:
+            offset = variant.get(cm.RECORD_OFFSET_KEY)
+            if offset is not None and offset == position["offset"]:
+                position["count"] += 1
+            else:
+                position["offset"] = offset
+                position["count"] = 1
+            position["variant"] = variant
+            yield variant
+
+    def commit_checkpoint(variant_count):
+        """Commit the current transaction with the given checkpoint"""
+        metadatas = {cm.IMPORT_CHECKPOINT_KEY: variant_count}
+        variant = position["variant"]
+        if position["offset"] is not None:
+            metadatas[cm.IMPORT_OFFSET_KEY] = json.dumps(
+                {
+                    "offset": position["offset"],
+                    "count": position["count"],
+                    "variant": [variant[col] for col in ("chr", "pos", "ref", "alt")],
+                }
+            )
+        update_metadatas(cursor, metadatas)
+        conn.commit()
 
-            placeholders = ",".join(["?"] * len(sample_columns))
+    data = track_positions(data)
+    skip = start if skip is None else skip
+    if skip:
+        # Skip variants already processed
+        for _ in it.islice(data, skip):
+            pass
+        variant = position["variant"]
+        if checkpoint_variant is not None and (
+            variant is None
+            or [variant[col] for col in ("chr", "pos", "ref", "alt")]
+            != list(checkpoint_variant)
+        ):
+            raise ValueError(
+                "The file doesn't match the interrupted import: "
+                f"{checkpoint_variant} expected at the checkpoint"
+            )
 
-            q = f"INSERT INTO sample_has_variant VALUES ({placeholders})"
-            cursor.executemany(q, samples)
+    # Loop over variants
+    errors = 0
+    progress = 0
+    variant_count = start
+    batch = []
+    for variant_count, variant in enumerate(data, start + 1):
+        batch.append(variant)
 
+        if len(batch) < batch_size:
+            continue
 
+        errors += insert_batch(batch, next_id, variant_count - len(batch) + 1)
+        next_id += len(batch)
+        batch = []
 
-        # Yield progression
-        if variant_count % yield_every == 0:
-            if total_variant_count:
-                progress = variant_count / total_variant_count * 100
+        if checkpoint:
+            commit_checkpoint(variant_count)
 
+        # Yield progression
+        if progress_callback:
+            progress = progress_callback()
+        elif total_variant_count:
+            progress = variant_count / total_variant_count * 100
+
+        if errors:
+            yield progress, f"{variant_count} variants processed, {errors} rejected."
+        else:
             yield progress, f"{variant_count} variants inserted."
 
+    if batch:
+        errors += insert_batch(batch, next_id, variant_count - len(batch) + 1)
+
     # Commit the transaction
+    bump_write_counter(conn)
+    if checkpoint:
+        commit_checkpoint(variant_count)
     conn.commit()
 
+    if errors:
+        LOGGER.warning(
+            "async_insert_many_variants:: %s variant(s) rejected "
+            "(duplicated or missing (chr,pos,ref,alt)); "
+            "see rejected_variants table",
+            errors,
+        )
+        yield 97, f"{errors} variant(s) rejected; see rejected_variants table."
+
+    if append or start:
+        yield 97, f"{variant_count - start - errors} variant(s) has been inserted or updated."
+        # Update the count of the default selection if it is already there
+        count = get_variants_count(conn)
+        cursor = conn.execute(
+            "UPDATE selections SET count = ? WHERE name = ?",
+            (count, cm.DEFAULT_SELECTION_NAME),
+        )
+        conn.commit()
+        if not cursor.rowcount:
+            insert_selection(conn, "", name=cm.DEFAULT_SELECTION_NAME, count=count)
+        return
+
     yield 97, f"{variant_count - errors} variant(s) has been inserted."
 
     # Create default selection (we need the number of variants for this)
@@ -1306,10 +2217,417 @@ def build_columns_and_placeholders(table_name):
 
 def insert_many_variants(conn, data, **kwargs):
     """Wrapper for debugging purpose"""
-    for _, _ in async_insert_many_variants(conn, data, kwargs):
+    for _, _ in async_insert_many_variants(conn, data, **kwargs):
         pass
 
 
+def create_table_rejected_variants(conn):
+    """Create "rejected_variants" table if it doesn't exist
+
+    Variants rejected during imports are stored here with the reason of
+    their rejection (see :meth:`async_insert_many_variants`):
+
+        - variant_index: Index of the variant in the imported data (1-based)
+        - chr, pos, ref, alt: Primary key of the variant
+        - reason: :data:`cutevariant.commons.REJECTED_DUPLICATE` (the key
+          conflicts with another variant) or
+          :data:`cutevariant.commons.REJECTED_MISSING_KEY` (a column of the
+          key is missing, None or empty; the variant is not inserted)
+
+    :param conn: sqlite3.connect
+    """
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS rejected_variants (
+        id INTEGER PRIMARY KEY ASC,
+        variant_index INTEGER,
+        chr TEXT,
+        pos INTEGER,
+        ref TEXT,
+        alt TEXT,
+        reason TEXT
+        )"""
+    )
+    conn.commit()
+
+
+def get_rejected_variants(conn, reason=None):
+    """Get the variants rejected during imports
+
+    :key reason: Get only the variants rejected for this reason.
+    :return: Generator of dictionnaries with the columns of "rejected_variants"
+        table; nothing if the table doesn't exist.
+    :rtype: <generator <dict>>
+    """
+    if not get_table_columns(conn, "rejected_variants"):
+        return
+    conn.row_factory = sqlite3.Row
+    if reason is None:
+        query = conn.execute("SELECT * FROM rejected_variants ORDER BY id")
+    else:
+        query = conn.execute(
+            "SELECT * FROM rejected_variants WHERE reason = ? ORDER BY id", (reason,)
+        )
+    for row in query:
+        yield dict(row)
+
+
+def get_rejected_variants_count(conn):
+    """Get the number of variants rejected during imports for each reason
+
+    :return: Reasons as keys, counts as values.
+    :rtype: <dict>
+    """
+    if not get_table_columns(conn, "rejected_variants"):
+        return {}
+    return dict(
+        conn.execute(
+            "SELECT reason, COUNT(*) FROM rejected_variants GROUP BY reason"
+        ).fetchall()
+    )
+
+
+## query_cache table ===========================================================
+
+
+def get_cache_path(conn: sqlite3.Connection):
+    """Return the path of the store of cached data of the given project
+
+    The store is a sidecar database next to the project file
+    (see :data:`cutevariant.commons.CACHE_STORE_SUFFIX`).
+
+    Args:
+        conn (sqlite3.Connection): Sqlite3 Connection of the project
+
+    Returns:
+        str: Path of the store; None for in-memory projects.
+    """
+    for row in conn.execute("PRAGMA database_list"):
+        if row[1] == "main" and row[2]:
+            return row[2] + cm.CACHE_STORE_SUFFIX
+    return None
+
+
+def get_cache_connection(conn: sqlite3.Connection):
+    """Return the connection to the store of cached data of the given project
+
+    Cached results of queries (query_cache table) and statistics of the index
+    advisor (see :mod:`cutevariant.core.indexadvisor`) are written in a
+    sidecar database: writes never lock the project, and locks held on the
+    project by other connections never delay them. The store is opened once per project
+    connection, with a busy timeout of 0: if it is locked, reads and writes
+    fail immediately and are ignored by the callers.
+    In-memory projects, or projects whose store can't be opened, use a
+    private in-memory store.
+
+    Args:
+        conn (sqlite3.Connection): Sqlite3 Connection of the project,
+            opened by :meth:`get_sql_connection`
+
+    Returns:
+        sqlite3.Connection: Connection to the store; None if the project
+            connection was not opened by :meth:`get_sql_connection`.
+    """
+    if not isinstance(conn, ProjectConnection):
+        return None
+    if conn.cache_conn is not None:
+        return conn.cache_conn
+
+    path = get_cache_path(conn)
+    try:
+        cache_conn = sqlite3.connect(path or ":memory:", timeout=0)
+    except sqlite3.OperationalError as e:
+        LOGGER.debug("get_cache_connection:: %s not opened: %s", path, e)
+        cache_conn = sqlite3.connect(":memory:", timeout=0)
+    try:
+        cache_conn.execute("PRAGMA busy_timeout = 0")
+        # Readers are not blocked by writers; lost data can be computed again
+        cache_conn.execute("PRAGMA journal_mode = WAL")
+        cache_conn.execute("PRAGMA synchronous = OFF")
+    except sqlite3.OperationalError as e:
+        LOGGER.debug("get_cache_connection:: settings not applied: %s", e)
+    conn.cache_conn = cache_conn
+    return cache_conn
+
+
+def remove_cache_store(conn: sqlite3.Connection):
+    """Remove the store of cached data of the given project
+
+    Args:
+        conn (sqlite3.Connection): Sqlite3 Connection of the project
+    """
+    if isinstance(conn, ProjectConnection):
+        if conn.cache_conn is not None:
+            conn.cache_conn.close()
+            conn.cache_conn = None
+        conn.cache_accesses.clear()
+
+    path = get_cache_path(conn)
+    if not path:
+        return
+    for filepath in (path, path + "-wal", path + "-shm"):
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            LOGGER.debug("remove_cache_store:: %s not removed: %s", filepath, e)
+
+
+def create_table_query_cache(conn: sqlite3.Connection):
+    """Create "query_cache" table if it doesn't exist
+
+    Results of queries are stored as JSON with:
+
+        - query: Normalized SQL query (see :meth:`normalize_query`)
+        - version: Write counter of the project when the result was computed
+          (see :meth:`get_write_counter`)
+        - result: JSON data
+        - size: Size of the JSON data
+        - accessed: Time of the last access (LRU eviction)
+
+    Args:
+        conn (sqlite3.Connection): Sqlite3 Connection to the store of cached
+            data (see :meth:`get_cache_connection`)
+    """
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS query_cache (
+        query TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        result TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        accessed REAL NOT NULL
+        )"""
+    )
+
+
+def normalize_query(query: str) -> str:
+    """Collapse the whitespaces of the given SQL query, except in strings"""
+    return re.sub(
+        r"('(?:[^']|'')*')|\s+", lambda match: match[1] or " ", query
+    ).strip()
+
+
+def try_write(conn: sqlite3.Connection, statements) -> bool:
+    """Execute the given statements in their own transaction
+
+    Errors are ignored: read only databases, databases locked by another
+    connection, etc. The current transaction of the connection (if any) is
+    neither committed nor rolled back.
+
+    Args:
+        conn (sqlite3.Connection): Sqlite3 Connection
+        statements (list): (SQL statement, parameters) tuples
+
+    Returns:
+        bool: True if the statements have been executed
+    """
+    in_transaction = conn.in_transaction
+    try:
+        for statement, parameters in statements:
+            conn.execute(statement, parameters)
+    except sqlite3.OperationalError as e:
+        LOGGER.debug("try_write:: data not written: %s", e)
+        if not in_transaction:
+            conn.rollback()
+        return False
+    if not in_transaction:
+        conn.commit()
+    return True
+
+
+def get_cached_result(conn: sqlite3.Connection, query: str):
+    """Return the result of the given query stored in query_cache table
+
+    Results computed before the last write in the project are obsolete.
+    Nothing is written: the time of the access is kept in memory and written
+    in the store with the next result (see :meth:`cache_result`).
+
+    Args:
+        conn (sqlite3.Connection): Sqlite3 Connection of the project
+        query (str): SQL query
+
+    Returns:
+        Result stored by :meth:`cache_result`; None if there is no up to date
+        result.
+    """
+    cache_conn = get_cache_connection(conn)
+    if cache_conn is None:
+        return None
+
+    query = normalize_query(query)
+    try:
+        row = cache_conn.execute(
+            "SELECT result FROM query_cache WHERE query = ? AND version = ?",
+            (query, get_write_counter(conn)),
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # No query_cache table, or locked store
+        return None
+    if row is None:
+        return None
+
+    conn.cache_accesses[query] = time.time()
+    return json.loads(row[0])
+
+
+def cache_result(
+    conn: sqlite3.Connection, query: str, result, max_size=cm.QUERY_CACHE_SIZE
+):
+    """Store the result of the given query in query_cache table
+
+    The pending accesses to cached results are written, obsolete results are
+    removed, then the least recently used results are evicted until the size
+    of the cache is at most max_size.
+    Nothing is written in the project; if the store is locked, the result is
+    not cached.
+
+    Args:
+        conn (sqlite3.Connection): Sqlite3 Connection of the project
+        query (str): SQL query
+        result: Data that can be serialized in JSON (numbers, strings,
+            lists, dicts)
+        max_size (int): Maximum size of the cached results (bytes)
+    """
+    cache_conn = get_cache_connection(conn)
+    if cache_conn is None:
+        return
+    try:
+        data = json.dumps(result)
+    except TypeError:
+        LOGGER.debug("cache_result:: result can't be serialized")
+        return
+    if len(data) > max_size:
+        return
+
+    version = get_write_counter(conn)
+    try:
+        create_table_query_cache(cache_conn)
+    except sqlite3.OperationalError as e:
+        LOGGER.debug("cache_result:: query cache not created: %s", e)
+        return
+
+    accesses = [
+        ("UPDATE query_cache SET accessed = ? WHERE query = ?", (accessed, query))
+        for query, accessed in conn.cache_accesses.items()
+    ]
+    # Accesses are only hints for the eviction: they are lost if the store is
+    # locked
+    conn.cache_accesses.clear()
+    try_write(
+        cache_conn,
+        accesses
+        + [
+            ("DELETE FROM query_cache WHERE version != ?", (version,)),
+            (
+                "INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?, ?, ?)",
+                (normalize_query(query), version, data, len(data), time.time()),
+            ),
+            (
+                """DELETE FROM query_cache WHERE query IN (
+                SELECT query FROM (
+                    SELECT query,
+                    SUM(size) OVER (ORDER BY accessed DESC, rowid DESC) AS total
+                    FROM query_cache
+                ) WHERE total > ?
+                )""",
+                (max_size,),
+            ),
+        ],
+    )
+
+
+## fts tables ==================================================================
+
+
+def create_fts_indexes(conn: sqlite3.Connection, fields=cm.FTS_FIELDS):
+    """Create full-text indexes on text fields of variants and annotations
+
+    For each table, an external content FTS5 table (fts_variants,
+    fts_annotations) with the trigram tokenizer indexes the given fields;
+    substrings of at least 3 characters are searched in the index instead of
+    scanning the table (see
+    :meth:`cutevariant.core.querybuilder.fts_filter_to_sql`).
+    Triggers keep the indexes up to date (imports in append mode,
+    :meth:`update_variant`).
+
+    Fields that are not in the table or that are encoded (see
+    :meth:`create_table_annotation_dictionary`) are skipped. Nothing is
+    created if SQLite doesn't support FTS5 or the trigram tokenizer
+    (SQLite < 3.34). Indexed fields are stored in metadatas table
+    (:data:`cutevariant.commons.FTS_KEY`).
+
+    Args:
+        conn (sqlite3.Connection): Sqlite3 Connection
+        fields (dict): Tables as keys, lists of fields as values
+
+    Returns:
+        dict: Indexed fields by table
+    """
+    encoded_fields = set(get_annotation_dictionary_settings(conn)[0])
+    indexed = dict()
+    for table, table_fields in fields.items():
+        columns = set(get_table_columns(conn, table))
+        if table == "annotations":
+            columns -= encoded_fields
+        table_fields = [field for field in table_fields if field in columns]
+        if not table_fields:
+            continue
+
+        fts_table = f"fts_{table}"
+        columns = ", ".join(f'"{field}"' for field in table_fields)
+        new_values = ", ".join(f'new."{field}"' for field in table_fields)
+        old_values = ", ".join(f'old."{field}"' for field in table_fields)
+        try:
+            conn.execute(
+                f"""CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+                {columns}, content='{table}', content_rowid='rowid',
+                tokenize='trigram')"""
+            )
+        except sqlite3.OperationalError as e:
+            LOGGER.debug("create_fts_indexes:: full-text search not available: %s", e)
+            return dict()
+
+        conn.execute(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')")
+        conn.executescript(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_insert AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO {fts_table} (rowid, {columns})
+                VALUES (new.rowid, {new_values});
+            END;
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_delete AFTER DELETE ON {table}
+            BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, {columns})
+                VALUES ('delete', old.rowid, {old_values});
+            END;
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_update
+            AFTER UPDATE OF {columns} ON {table}
+            BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, {columns})
+                VALUES ('delete', old.rowid, {old_values});
+                INSERT INTO {fts_table} (rowid, {columns})
+                VALUES (new.rowid, {new_values});
+            END;
+            """
+        )
+        indexed[table] = table_fields
+
+    update_metadatas(conn, {cm.FTS_KEY: json.dumps(indexed)})
+    conn.commit()
+    return indexed
+
+
+def get_fts_fields(conn: sqlite3.Connection) -> dict:
+    """Get the fields indexed by :meth:`create_fts_indexes`
+
+    Returns:
+        dict: Tables as keys, lists of fields as values; empty dict if there
+        is no full-text index.
+    """
+    value = get_metadatas(conn).get(cm.FTS_KEY)
+    return json.loads(value) if value else dict()
+
+
 ## samples table ===============================================================
 
 
@@ -1362,6 +2680,78 @@ def create_table_samples(conn, fields=None):
     conn.commit()
 
 
+def create_table_genotypes(conn, fields):
+    """Create "genotypes" table which contains packed genotypes of all samples
+
+    A project with this table stores genotypes in it instead of
+    "sample_has_variant" table: one row per variant, one blob per sample field.
+    See :mod:`cutevariant.core.genotypes`.
+
+    :param conn: sqlite3.connect
+    :param fields: Sample fields; only fields that can be packed are used
+        (gt and numeric fields).
+    """
+    schema = ",".join(
+        f'`{field["name"]}` BLOB'
+        for field in fields
+        if field["name"] != "gt" and genotypes.is_packable(field)
+    )
+    conn.execute(
+        f"""CREATE TABLE genotypes (
+        variant_id INTEGER PRIMARY KEY,
+        gt BLOB{"," if schema else ""}
+        {schema}
+        )"""
+    )
+    conn.commit()
+
+
+def has_packed_genotypes(conn) -> bool:
+    """Return True if the genotypes of the project are packed in "genotypes" table"""
+    return bool(get_table_columns(conn, "genotypes"))
+
+
+def get_packed_sample_field(conn, field: dict, sample_name: str) -> str:
+    """Return the SQL expression of a sample field packed in "genotypes" table
+
+    :param field: Sample field with "name" and "type" keys.
+    :param sample_name: Name of the sample.
+    """
+    sample_id = conn.execute(
+        "SELECT id FROM samples WHERE name = ?", (sample_name,)
+    ).fetchone()[0]
+    return genotypes.get_sql_expression(field, genotypes.sample_index(sample_id))
+
+
+def get_packed_genotypes(conn, variant_id: int, sample_id: int = None):
+    """Get unpacked genotypes of a variant
+
+    :param variant_id: Id of the variant.
+    :key sample_id: Id of a sample; all the samples are returned by default.
+    :return: List of sample data like rows of "sample_has_variant"
+        (name, sample_id, variant_id and sample fields as keys).
+    :rtype: <list <dict>>
+    """
+    fields = [
+        field
+        for field in get_field_by_category(conn, "samples")
+        if genotypes.is_packable(field)
+    ]
+    columns = ",".join(
+        genotypes.get_sql_expression(field, "samples.id - 1")
+        + f" AS `{field['name']}`"
+        for field in fields
+    )
+    query = f"""SELECT samples.name, samples.id AS sample_id,
+        {variant_id} AS variant_id{"," if columns else ""} {columns}
+        FROM samples LEFT JOIN genotypes ON genotypes.variant_id = {variant_id}"""
+    if sample_id is not None:
+        query += f" WHERE samples.id = {int(sample_id)}"
+
+    conn.row_factory = sqlite3.Row
+    return [dict(row) for row in conn.execute(query)]
+
+
 def insert_sample(conn, name="no_name"):
     """Insert one sample in samples table (USED in TESTS)
 
@@ -1405,6 +2795,9 @@ def get_samples(conn):
 
 def get_sample_annotations(conn, variant_id: int, sample_id: int):
     """Get samples for given sample id and variant id"""
+    if has_packed_genotypes(conn):
+        return get_packed_genotypes(conn, variant_id, sample_id)[0]
+
     conn.row_factory = sqlite3.Row
     return dict(
         conn.execute(
@@ -250,6 +250,20 @@ def value(self):
         }
 
 
+class ExplainCmd(metaclass=model_class):
+    @property
+    def value(self):
+        # Source of the explained command: it is parsed again to be timed
+        raw_vql = textx.get_model(self)._tx_parser.input
+        return {
+            "cmd": "explain_cmd",
+            "statement": raw_vql[
+                self.command._tx_position : self.command._tx_position_end
+            ],
+            "profile": self.mode.upper() == "PROFILE",
+        }
+
+
 METAMODEL = textx.metamodel_from_str(
     resource_string(__name__, "vql.tx").decode(),  # grammar extraction from vql.tx
     classes=model_class.classes,
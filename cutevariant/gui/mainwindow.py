@@ -410,7 +410,7 @@ def open_database(self, conn):
         """
         self.conn = conn
 
-        # Clear memoization cache for count_cmd
+        # Clear caches of the previous project
         command.clear_cache_cmd()
         # Clear State variable of application
         # store fields, source, filters, group_by, having data
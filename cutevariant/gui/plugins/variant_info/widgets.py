@@ -180,8 +180,15 @@ def populate(self):
         query = f"""SELECT samples.name, sv.gt FROM samples 
                  LEFT JOIN sample_has_variant sv ON samples.id = sv.sample_id 
                  AND sv.variant_id = {variant_id}"""
-
-        for sample_name, genotype in self.conn.execute(query):
+        if sql.has_packed_genotypes(self.conn):
+            samples_genotypes = (
+                (sample["name"], sample["gt"])
+                for sample in sql.get_packed_genotypes(self.conn, variant_id)
+            )
+        else:
+            samples_genotypes = self.conn.execute(query)
+
+        for sample_name, genotype in samples_genotypes:
             item = QListWidgetItem()
             icon = self.genotype_icons.get(genotype, self.genotype_icons[-1])
 
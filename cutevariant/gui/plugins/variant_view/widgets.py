@@ -15,7 +15,13 @@
 from PySide2.QtGui import *
 
 # Custom imports
-from cutevariant.core.querybuilder import build_full_sql_query, fields_to_vql
+from cutevariant.core.querybuilder import (
+    build_full_sql_query,
+    fields_to_vql,
+    get_default_tables_and_sample_ids,
+    get_keyset_fields,
+    get_keyset_cursor,
+)
 
 from cutevariant.core import command as cmd
 from cutevariant.gui import plugin, FIcon, formatter, style
@@ -45,11 +51,14 @@ class VariantModel(QAbstractTableModel):
     Signals:
         loading (bool): Emit when data start or stop loading
         load_finished: Emit when data is loaded and ready to be used
+        count_updated: Emit when the exact count of variants replaces its
+            estimate
         runnable_exception (str): Emit message when async runnables encounter errors
     """
 
     loading = Signal(bool)
     load_finished = Signal()
+    count_updated = Signal()
     runnable_exception = Signal(str)
 
     def __init__(self, conn=None, parent=None):
@@ -57,6 +66,8 @@ def __init__(self, conn=None, parent=None):
         self.limit = 50
         self.page = 1  #
         self.total = 0
+        # True while total is an estimate
+        self.total_is_approximate = False
         self.variants = []
         self.headers = []
 
@@ -73,6 +84,10 @@ def __init__(self, conn=None, parent=None):
         self.order_desc = False
         self.formatter = None
         self.debug_sql = None
+        # Keyset pagination: fields of the sort key of the query,
+        # page and cursors of its first and last variants
+        self.keyset_fields = None
+        self.page_cursors = None
         # Keep after all initialization
         self.conn = conn
 
@@ -87,6 +102,7 @@ def __init__(self, conn=None, parent=None):
         # Runnables (1 for each query)
         self.variant_runnable = None
         self.count_runnable = None
+        self.exact_count_runnable = None
         # Unique ids for runs
         self.query_counter = it.count()
         self.query_number = 0
@@ -117,10 +133,13 @@ def conn(self, conn):
             # Init Runnables (1 for each query type)
             self.variant_runnable = SqlRunnable(self.conn)
             self.count_runnable = SqlRunnable(self.conn)
+            self.exact_count_runnable = SqlRunnable(self.conn)
             self.variant_runnable.finished.connect(self.loaded)
             self.count_runnable.finished.connect(self.loaded)
+            self.exact_count_runnable.finished.connect(self.exact_count_loaded)
             self.variant_runnable.error.connect(self.runnable_exception)
             self.count_runnable.error.connect(self.runnable_exception)
+            self.exact_count_runnable.error.connect(self.runnable_exception)
 
     def rowCount(self, parent=QModelIndex()):
         """Overrided : Return children count of index"""
@@ -248,13 +267,23 @@ def find_row_id_from_variant_id(self, variant_id: int) -> list:
             if variant["id"] == variant_id
         ]
 
-    def load(self):
+    def load(self, cursor=None, backward=False):
         """Start async queries to get variants and variant count
 
         Called by:
             - on_change_query() from the view.
             - sort() and setPage() by the model.
 
+        Variants are sorted in a unique order (keyset) unless they are grouped:
+        adjacent pages are sought from the cursor of the current page; other
+        pages are loaded with an offset.
+
+        Args:
+            cursor (tuple): Position of the first or last variant of an
+                adjacent page; variants after it (or before it with backward)
+                are loaded instead of skipping the variants of previous pages.
+            backward (bool): Load the variants before the cursor.
+
         See Also:
             :meth:`loaded`
         """
@@ -264,15 +293,33 @@ def load(self):
         self._set_loading(True)
         LOGGER.debug("Start loading")
 
-        offset = (self.page - 1) * self.limit
+        # Cursors need the values of the sort key in the loaded variants
+        keyset = not self.group_by and (
+            self.order_by is None or self.order_by in self.fields
+        )
+        if keyset and cursor is not None:
+            offset = 0
+        else:
+            cursor = None
+            offset = (self.page - 1) * self.limit
+
+        if keyset:
+            default_tables, _ = get_default_tables_and_sample_ids(self.conn)
+            self.keyset_fields = get_keyset_fields(
+                self.fields, self.order_by, default_tables
+            )
+        else:
+            self.keyset_fields = None
 
         # Add fields from group by
         # self.clear()  # Assume variant = []
         self.total = 0
+        self.total_is_approximate = False
 
         # LOGGER.debug("Page queried: %s", self.page)
 
-        # Store SQL query for debugging purpose
+        # Store SQL query for debugging purpose (values of the cursor are bound)
+        params = {}
         self.debug_sql = build_full_sql_query(
             self.conn,
             fields=self.fields,
@@ -284,7 +331,13 @@ def load(self):
             order_by=self.order_by,
             group_by=self.group_by,
             having=self.having,
+            keyset=keyset,
+            cursor=cursor,
+            backward=backward,
+            params=params,
         )
+        if params:
+            self.debug_sql += f" -- {params}"
 
         # Create load_func to run asynchronously: load variants
         load_func = functools.partial(
@@ -298,6 +351,9 @@ def load(self):
             order_by=self.order_by,
             group_by=self.group_by,
             having=self.having,
+            keyset=keyset,
+            cursor=cursor,
+            backward=backward,
         )
 
         # Create count_func to run asynchronously: count variants
@@ -311,7 +367,11 @@ def load(self):
 
         # Assign async functions to runnables
         self.variant_runnable.function = lambda conn: list(load_func(conn))
-        self.count_runnable.function = count_function
+        # Expensive counts are estimated first, then counted in the background
+        self.count_runnable.function = functools.partial(
+            count_function, approximate=True
+        )
+        self.exact_count_runnable.function = count_function
         # Assign unique ID for this run
         self.query_number = next(self.query_counter)
         self.variant_runnable.query_number = self.query_number
@@ -368,30 +428,78 @@ def loaded(self, query_number):
             self.headers = list(self.variants[0].keys())
 
         self.total = self.count_runnable.results["count"]
+        self.total_is_approximate = self.count_runnable.results.get(
+            "approximate", False
+        )
+        if self.total_is_approximate:
+            # Refine the estimate; see exact_count_loaded()
+            self.exact_count_runnable.query_number = self.query_number
+            self.pool.start(self.exact_count_runnable)
+
+        self.page_cursors = None
+        if self.keyset_fields and self.variants:
+            self.page_cursors = (
+                self.page,
+                get_keyset_cursor(self.variants[0], self.keyset_fields),
+                get_keyset_cursor(self.variants[-1], self.keyset_fields),
+            )
 
         self.endResetModel()
         self._set_loading(False)
         self.load_finished.emit()
 
+    def exact_count_loaded(self, query_number):
+        """Called when the exact count of variants is done
+
+        The estimate of the count is replaced if the query is still current.
+
+        Signals:
+            - count_updated (captured by VariantView to load page_box)
+        """
+        if query_number != self.query_number:
+            # Count of a deprecated query
+            return
+
+        self.total = self.exact_count_runnable.results["count"]
+        self.total_is_approximate = False
+        self.count_updated.emit()
+
     def hasPage(self, page: int) -> bool:
         """ Return True if <page> exists otherwise return False """
+        if self.total_is_approximate and page == self.page + 1:
+            # The estimate can be too low: a full page can have a next one
+            return len(self.variants) == self.limit
         return (page - 1) >= 0 and (page - 1) * self.limit < self.total
 
-    def setPage(self, page: int):
-        """ set the page of the model """
+    def setPage(self, page: int, cursor=None, backward=False):
+        """set the page of the model
+
+        Args:
+            cursor (tuple): Position of a variant of an adjacent page.
+                See :meth:`load`.
+            backward (bool): The page is before the cursor.
+        """
         if self.hasPage(page):
             self.page = page
-            self.load()
+            self.load(cursor, backward)
 
     def nextPage(self):
         """ Set model to the next page """
         if self.hasPage(self.page + 1):
-            self.setPage(self.page + 1)
+            # Seek after the last variant of the current page
+            cursor = None
+            if self.page_cursors and self.page_cursors[0] == self.page:
+                cursor = self.page_cursors[2]
+            self.setPage(self.page + 1, cursor)
 
     def previousPage(self):
         """ Set model to the previous page """
         if self.hasPage(self.page - 1):
-            self.setPage(self.page - 1)
+            # Seek before the first variant of the current page
+            cursor = None
+            if self.page_cursors and self.page_cursors[0] == self.page:
+                cursor = self.page_cursors[1]
+            self.setPage(self.page - 1, cursor, backward=True)
 
     def firstPage(self):
         """ Set model to the first page """
@@ -602,6 +710,7 @@ def __init__(self, parent=None, show_popup_menu=True):
         self.model.loading.connect(self._set_loading)
         # Queries are finished (yes its redundant with loading signal...)
         self.model.load_finished.connect(self.loaded)
+        self.model.count_updated.connect(self.load_page_box)
         # Connect errors from async runnables
         self.model.runnable_exception.connect(self.runnable_exception)
 
@@ -752,6 +861,10 @@ def load_page_box(self):
         else:
             text = self.tr("{} line(s) {} page(s)")
 
+        if self.model.total_is_approximate:
+            # Estimate of the count
+            text = "~" + text.replace(" {} ", " ~{} ")
+
         self.info_label.setText(text.format(self.model.total, self.model.pageCount()))
 
     def set_pagging_enabled(self, active=True):
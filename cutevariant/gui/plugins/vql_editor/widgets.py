@@ -21,8 +21,9 @@
     QLabel,
     QFrame,
     QApplication,
+    QPlainTextEdit,
 )
-from PySide2.QtGui import QKeySequence
+from PySide2.QtGui import QKeySequence, QFontDatabase
 
 # Custom imports
 from cutevariant.core import vql, sql
@@ -68,10 +69,17 @@ def __init__(self, parent=None):
         )
         self.log_edit.hide()
         self.log_edit.setFrameStyle(QFrame.StyledPanel | QFrame.Raised)
+        # Results of EXPLAIN/PROFILE commands
+        self.explain_edit = QPlainTextEdit()
+        self.explain_edit.setReadOnly(True)
+        self.explain_edit.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.explain_edit.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.explain_edit.hide()
 
         main_layout = QVBoxLayout()
         main_layout.addWidget(self.top_bar)
         main_layout.addWidget(self.text_edit)
+        main_layout.addWidget(self.explain_edit)
         main_layout.addWidget(self.log_edit)
         main_layout.setContentsMargins(0, 0, 0, 0)
         main_layout.setSpacing(0)
@@ -168,11 +176,15 @@ def run_vql(self):
             - bed_cmd: selections
             - show_cmd: *not supported*
             - import_cmd: wordsets
+            - explain_cmd: SQL query, query plan and timings shown under the
+              editor
         """
         # Check VQL syntax first
         if not self.check_vql():
             return
 
+        self.explain_edit.hide()
+
         for cmd in vql.parse_vql(self.text_edit.toPlainText()):
 
             LOGGER.debug("VQL command %s", cmd)
@@ -195,13 +207,18 @@ def run_vql(self):
 
             try:
                 # Check SQL validity of selections related commands
-                command.create_command_from_obj(self.conn, cmd)()
+                result = command.create_command_from_obj(self.conn, cmd)()
             except (sqlite3.DatabaseError, VQLSyntaxError) as e:
                 # Display errors in VQL editor
                 self.set_message(str(e))
                 LOGGER.exception(e)
                 continue
 
+            if cmd_type == "explain_cmd":
+                self.explain_edit.setPlainText(command.explain_to_text(result))
+                self.explain_edit.show()
+                continue
+
             # Selections related commands
             if cmd_type in ("create_cmd", "set_cmd", "bed_cmd"):
                 # refresh source editor plugin for selections
@@ -42,6 +42,8 @@ class VqlSyntaxHighlighter(QSyntaxHighlighter):
         "IMPORT",
         "WORDSET",
         "INTERSECT",
+        "EXPLAIN",
+        "PROFILE",
     )
 
     def __init__(self, document=None):
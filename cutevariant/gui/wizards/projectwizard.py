@@ -5,15 +5,16 @@
 
 # Qt imports
 from PySide2.QtWidgets import *
-from PySide2.QtCore import QThread, Signal, QDir, QSettings, QFile, Slot
+from PySide2.QtCore import QThread, Signal, QDir, QSettings, QFile, Slot, Qt, Property
 from PySide2.QtGui import QIcon
 
 # Custom imports
 from cutevariant.core.importer import async_import_file
-from cutevariant.core import get_sql_connection
+from cutevariant.core import get_sql_connection, get_metadatas
 import cutevariant.commons as cm
 from cutevariant.core.readerfactory import detect_vcf_annotation, create_reader
 from cutevariant.core.reader import PedReader
+from cutevariant.core.reader.abstractreader import MANDATORY_FIELDS
 from cutevariant.gui.model_view import PedView
 
 LOGGER = cm.logger()
@@ -41,6 +42,12 @@ def __init__(self):
         self.project_path_edit.setText(self.last_directory)
         self.browse_button = QPushButton(self.tr("Browse"))
         self.reference = QComboBox()
+        self.append_checkbox = QCheckBox(
+            self.tr("Append the file to this existing project")
+        )
+        self.packed_checkbox = QCheckBox(
+            self.tr("Compact storage of genotypes (large cohorts)")
+        )
 
         # Unused for now
         self.reference.hide()
@@ -49,6 +56,8 @@ def __init__(self):
         self.registerField("project_name", self.project_name_edit, "text")
         self.registerField("project_path", self.project_path_edit, "text")
         self.registerField("reference", self.reference, "currentText")
+        self.registerField("append", self.append_checkbox)
+        self.registerField("packed_genotypes", self.packed_checkbox)
 
         v_layout = QFormLayout()
 
@@ -60,12 +69,15 @@ def __init__(self):
         v_layout.addRow(self.tr("Reference genom"), self.reference)
         v_layout.addRow(self.tr("Project Name"), self.project_name_edit)
         v_layout.addRow(self.tr("Create in"), browse_layout)
+        v_layout.addRow(self.append_checkbox)
+        v_layout.addRow(self.packed_checkbox)
 
         self.setLayout(v_layout)
 
         self.browse_button.clicked.connect(self._browse)
         self.project_path_edit.textChanged.connect(self.completeChanged)
         self.project_name_edit.textChanged.connect(self.completeChanged)
+        self.append_checkbox.toggled.connect(self.completeChanged)
 
     @Slot()
     def _browse(self):
@@ -82,7 +94,18 @@ def initializePage(self):
         self.project_name_edit.setFocus()
 
     def isComplete(self):
-        """Conditions to unlock next button"""
+        """Conditions to unlock next button
+
+        The project file must exist if the data is appended to it.
+        """
+        if self.append_checkbox.isChecked() and not QFile(
+            self.project_path_edit.text()
+            + QDir.separator()
+            + self.project_name_edit.text()
+            + ".db"
+        ).exists():
+            return False
+
         return (
             True
             if (
@@ -170,6 +193,90 @@ def isComplete(self):
         )
 
 
+class FieldsPage(QWizardPage):
+    """Page: Select the fields and the samples to be imported
+
+    All the fields and samples of the file are checked by default;
+    unchecked ones are not imported.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.setTitle(self.tr("Fields and samples"))
+        self.setSubTitle(
+            self.tr("Uncheck the fields and the samples you don't want to import.")
+        )
+
+        self.fields_view = QTreeWidget()
+        self.fields_view.setHeaderLabels([self.tr("Field"), self.tr("Description")])
+        self.samples_view = QListWidget()
+
+        h_layout = QHBoxLayout()
+        h_layout.addWidget(self.fields_view, 2)
+        h_layout.addWidget(self.samples_view, 1)
+        self.setLayout(h_layout)
+
+        # Deny lists shared accross Wizard pages
+        self.registerField("excluded_fields", self, "excluded_fields")
+        self.registerField("excluded_samples", self, "excluded_samples")
+
+    def initializePage(self):
+        """Overridden: Prepare the page just before it is shown
+
+        We open variant file (vcf, etc.) to get its fields and samples.
+        """
+        self.fields_view.clear()
+        self.samples_view.clear()
+        with create_reader(self.field("filename")) as reader:
+            fields = reader.get_fields()
+            samples = reader.get_samples()
+
+        categories = dict()
+        for field in fields:
+            category = field["category"]
+            if category not in categories:
+                categories[category] = QTreeWidgetItem(self.fields_view, [category])
+
+            item = QTreeWidgetItem(
+                categories[category], [field["name"], field["description"]]
+            )
+            item.setData(0, Qt.UserRole, f"{category}.{field['name']}")
+            item.setCheckState(0, Qt.Checked)
+            if (category, field["name"]) in MANDATORY_FIELDS:
+                # Always imported
+                item.setDisabled(True)
+
+        self.fields_view.expandAll()
+
+        for name in samples:
+            item = QListWidgetItem(name, self.samples_view)
+            item.setCheckState(Qt.Checked)
+
+    @Property(str)  # Qt property for QWizardPage.registerFields
+    def excluded_fields(self):
+        """Return unchecked fields separated by commas ("category.name,...")"""
+        iterator = QTreeWidgetItemIterator(
+            self.fields_view, QTreeWidgetItemIterator.NotChecked
+        )
+        names = []
+        while iterator.value():
+            name = iterator.value().data(0, Qt.UserRole)
+            if name:
+                names.append(name)
+            iterator += 1
+        return ",".join(names)
+
+    @Property(str)  # Qt property for QWizardPage.registerFields
+    def excluded_samples(self):
+        """Return unchecked samples separated by commas"""
+        return ",".join(
+            self.samples_view.item(row).text()
+            for row in range(self.samples_view.count())
+            if self.samples_view.item(row).checkState() != Qt.Checked
+        )
+
+
 class SamplePage(QWizardPage):
     """Gather additional information on sequenced individuals and their families
 
@@ -304,9 +411,24 @@ def __init__(self):
         # Facultative PED file
         self.pedfile = None
         self.project_settings = dict()
+        # Append data to an existing project
+        self.append = False
+        # Pack genotypes in blobs
+        self.packed_genotypes = False
+        # Deny lists of fields and samples
+        self.exclude_fields = None
+        self.exclude_samples = None
 
     def set_importer_settings(
-        self, filename, db_filename, pedfile=None, project_settings={}
+        self,
+        filename,
+        db_filename,
+        pedfile=None,
+        project_settings={},
+        append=False,
+        packed_genotypes=False,
+        exclude_fields=None,
+        exclude_samples=None,
     ):
         """Init settings of the importer
 
@@ -315,6 +437,10 @@ def set_importer_settings(
         :key pedfile: PED file to be opened.
         :key project_settings: The reference genome and the name of the project.
             Keys have to be at least "reference" and "project_name".
+        :key append: Append data to the existing project instead of creating it.
+        :key packed_genotypes: Pack the genotypes of each variant in blobs.
+        :key exclude_fields: Fields of the file not to import.
+        :key exclude_samples: Samples of the file not to import.
         :type filename: <str>
         :type pedfile: <str>
         :type db_filename: <str>
@@ -328,6 +454,10 @@ def set_importer_settings(
         self.project_settings = project_settings
         # Ped file
         self.pedfile = pedfile
+        self.append = append
+        self.packed_genotypes = packed_genotypes
+        self.exclude_fields = exclude_fields
+        self.exclude_samples = exclude_samples
 
     def run(self):
         """Overrided QThread method
@@ -341,8 +471,14 @@ def run(self):
         #  start timer
         start = time.perf_counter()
 
+        resume = False
         if os.path.exists(self.db_filename):
-            os.remove(self.db_filename)
+            conn = get_sql_connection(self.db_filename)
+            # Resume the interrupted import of the project instead of deleting it
+            resume = cm.IMPORT_CHECKPOINT_KEY in get_metadatas(conn)
+            conn.close()
+            if not resume and not self.append:
+                os.remove(self.db_filename)
         self.conn = get_sql_connection(self.db_filename)
 
         try:
@@ -352,6 +488,11 @@ def run(self):
                 self.filename,
                 pedfile=self.pedfile,
                 project=self.project_settings,
+                append=self.append,
+                packed_genotypes=self.packed_genotypes,
+                exclude_fields=self.exclude_fields,
+                exclude_samples=self.exclude_samples,
+                resume=resume,
             ):
                 if self._stop:
                     self.conn.close()
@@ -446,7 +587,7 @@ def cleanupPage(self):
         """Called when back button is clicked: stop the import thread"""
         self.thread_stop()
 
-        if self.thread_finished:
+        if self.thread_finished and not self.field("append"):
             # The import process is not finished corretly
             # Delete file
             os.remove(self.db_filename)
@@ -508,6 +649,17 @@ def run(self):
                     # Project's name
                     "project_name": self.field("project_name"),
                 },
+                # Append data to an existing project
+                append=self.field("append"),
+                # Compact storage of genotypes
+                packed_genotypes=self.field("packed_genotypes"),
+                # Unchecked fields and samples
+                exclude_fields=[
+                    name for name in self.field("excluded_fields").split(",") if name
+                ],
+                exclude_samples=[
+                    name for name in self.field("excluded_samples").split(",") if name
+                ],
             )
 
             self.log_edit.appendPlainText(self.tr("Import ") + self.thread.filename)
@@ -532,9 +684,11 @@ def isComplete(self):
 class ProjectWizard(QWizard):
     """Main window of the project wizard
 
-    3 pages are instantiated here:
+    5 pages are instantiated here:
         - ProjectPage: Creation of a new project
         - FilePage: Open the file containing variant data
+        - FieldsPage: Select the fields and the samples to be imported
+        - SamplePage: Describe the samples (PED file)
         - ImportPage: Creation of the database
     """
 
@@ -545,6 +699,7 @@ def __init__(self):
         self.setWizardStyle(QWizard.ClassicStyle)
         self.addPage(ProjectPage())
         self.addPage(FilePage())
+        self.addPage(FieldsPage())
         self.addPage(SamplePage())
         self.addPage(ImportPage())
 
@@ -0,0 +1,41 @@
+"""Compare the parsing time of VCF files with PyVCF and with VcfTokenizer
+
+Usage (from the root of the repository):
+
+    $ PYTHONPATH=. python poc/vcf_tokenizer_benchmark.py [files...]
+
+By default, VCF files of the examples directory are used.
+"""
+import glob
+import sys
+import timeit
+
+from cutevariant.core.reader import VcfReader
+
+REPEAT = 5
+NUMBER = 20
+
+
+def benchmark(filename, fast_parser):
+    """Return the best time in ms to parse the records of the given file"""
+    mode = "rb" if filename.endswith(".gz") else "r"
+    with open(filename, mode) as device:
+        # Readers are built once: only the parsing of records is measured
+        reader = VcfReader(device, fast_parser=fast_parser)
+        timings = timeit.repeat(
+            lambda: list(reader.parse_variants()), repeat=REPEAT, number=NUMBER
+        )
+    return min(timings) / NUMBER * 1000
+
+
+filenames = sys.argv[1:] or sorted(
+    glob.glob("examples/*.vcf") + glob.glob("examples/*.vcf.gz")
+)
+
+print(f"{'file':<35}{'PyVCF (ms)':>12}{'tokenizer (ms)':>16}{'speedup':>10}")
+for filename in filenames:
+    timings = [benchmark(filename, fast_parser) for fast_parser in (False, True)]
+    print(
+        f"{filename:<35}{timings[0]:>12.2f}{timings[1]:>16.2f}"
+        f"{timings[0] / timings[1]:>9.1f}x"
+    )
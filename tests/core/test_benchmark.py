@@ -0,0 +1,69 @@
+# Standard imports
+import json
+
+# Custom imports
+from cutevariant.core import benchmark, sql
+from cutevariant.core.importer import import_file
+
+
+def test_generate_vcf(tmp_path):
+    """Synthetic files are deterministic and can be imported"""
+    filepath = tmp_path / "test.vcf"
+    variant_count = benchmark.generate_vcf(
+        filepath, variants=100, samples=3, annotations=2, multiallelic_rate=0.5
+    )
+    content = filepath.read_text()
+    benchmark.generate_vcf(
+        tmp_path / "test2.vcf",
+        variants=100,
+        samples=3,
+        annotations=2,
+        multiallelic_rate=0.5,
+    )
+    assert (tmp_path / "test2.vcf").read_text() == content
+    assert 100 < variant_count < 200
+
+    conn = sql.get_sql_connection(":memory:")
+    import_file(conn, str(filepath))
+    assert sql.get_variants_count(conn) == variant_count
+    assert len(list(sql.get_samples(conn))) == 3
+    # At least the annotations of each alternative allele
+    assert (
+        conn.execute("SELECT COUNT(*) FROM annotations").fetchone()[0]
+        >= 2 * variant_count
+    )
+
+
+def test_benchmark_import(tmp_path):
+    results = benchmark.benchmark_import(
+        variants=200, samples=2, repeat=2, directory=str(tmp_path), batch_size=50
+    )
+    assert len(results["runs"]) == 2
+    best = results["best"]
+    assert best["variants"] > 200
+    assert best["variants_per_second"] > 0
+    assert set(best["stages"]) == {
+        "setup",
+        "parse",
+        "extra_fields",
+        "insert",
+        "bulk",
+        "index",
+    }
+    assert all(elapsed >= 0 for elapsed in best["stages"].values())
+    assert sum(best["stages"].values()) <= best["elapsed"] * 1.01
+
+    output = tmp_path / "results.json"
+    benchmark.save_results(results, output)
+    assert json.loads(output.read_text())["parameters"]["variants"] == 200
+
+
+def test_peak_rss(tmp_path):
+    """The memory used by the caller is not counted in the peak of the runs"""
+    data = b"x" * (256 << 20)
+    assert benchmark.get_peak_rss() >= len(data)
+    results = benchmark.benchmark_import(
+        variants=100, samples=2, repeat=2, directory=str(tmp_path)
+    )
+    del data
+    assert all(0 < run["peak_rss"] < 256 << 20 for run in results["runs"])
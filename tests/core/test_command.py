@@ -1,6 +1,8 @@
 # Standard imports
 import pytest
 import csv
+import sqlite3
+import time
 # Custom imports
 from cutevariant.core import command, sql, vql
 from cutevariant.core.reader import VcfReader
@@ -25,6 +27,81 @@ def test_select_cmd(conn):
     assert "gene" in variant
 
 
+@pytest.mark.parametrize(
+    "fields, order_by, order_desc",
+    [
+        (["chr", "pos", "ref", "alt"], None, False),
+        (["chr", "pos", "qual"], "qual", True),
+        (["chr", "pos", "gene", "consequence"], "gene", False),
+        (["chr", "variants.dp", ("sample", "TUMOR", "gt")], "variants.dp", True),
+    ],
+    ids=["default", "nulls", "annotations", "samples"],
+)
+def test_select_cmd_keyset(conn, fields, order_by, order_desc):
+    """Test keyset pagination against OFFSET pagination"""
+    from cutevariant.core.querybuilder import (
+        get_keyset_fields,
+        get_keyset_cursor,
+        get_default_tables_and_sample_ids,
+        build_full_sql_query,
+    )
+
+    # Ties and NULL values
+    conn.execute("UPDATE variants SET qual = pos % 2 WHERE id % 3 != 0")
+    kwargs = {"fields": fields, "order_by": order_by, "order_desc": order_desc}
+    expected = list(command.select_cmd(conn, keyset=True, limit=None, **kwargs))
+    assert len(expected) > 6
+    # Rows are sorted in a unique order
+    keyset_fields = get_keyset_fields(
+        fields, order_by, get_default_tables_and_sample_ids(conn)[0]
+    )
+    cursors = [get_keyset_cursor(row, keyset_fields) for row in expected]
+    assert len(set(cursors)) == len(cursors)
+
+    # Next pages
+    limit = 3
+    pages = [list(command.select_cmd(conn, keyset=True, limit=limit, **kwargs))]
+    while pages[-1]:
+        cursor = get_keyset_cursor(pages[-1][-1], keyset_fields)
+        pages.append(
+            list(command.select_cmd(conn, cursor=cursor, limit=limit, **kwargs))
+        )
+    assert [row for page in pages for row in page] == expected
+
+    # Previous pages, from the last one
+    pages = pages[-2:-1]
+    while pages[0]:
+        cursor = get_keyset_cursor(pages[0][0], keyset_fields)
+        pages.insert(
+            0,
+            list(
+                command.select_cmd(
+                    conn, cursor=cursor, backward=True, limit=limit, **kwargs
+                )
+            ),
+        )
+    assert [row for page in pages for row in page] == expected
+
+    # Random jumps with offsets give the same pages
+    assert (
+        list(command.select_cmd(conn, keyset=True, limit=limit, offset=3, **kwargs))
+        == expected[3:6]
+    )
+
+    # SQLite seeks to the cursor in the index of the sort field
+    if order_by in (None, "qual"):
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_variants_qual ON variants (qual)")
+        params = {}
+        query = build_full_sql_query(
+            conn, cursor=cursors[len(cursors) // 2], params=params, limit=3, **kwargs
+        )
+        plan = [step["detail"] for step in sql.get_query_plan(conn, query, params)]
+        assert any(
+            detail.startswith("SEARCH variants") and "?" in detail for detail in plan
+        ), plan
+        assert not any(detail.startswith("SCAN variants") for detail in plan), plan
+
+
 def test_select_cmd_with_set(conn):
     """Test the select query of gene sets"""
     # Import fake words (gene) as a new set called "test"
@@ -44,6 +121,32 @@ def test_select_cmd_with_set(conn):
     # filters  = {"AND": {"field":"gene", }}
 
 
+@pytest.mark.parametrize("operator", ["IN", "NOT IN"])
+def test_select_cmd_with_long_list(conn, operator):
+    """Test the select query of long lists of values (temporary tables)"""
+    from cutevariant.core.querybuilder import MAX_INLINE_VALUES
+
+    fields = ["chr", "pos", "gene"]
+    genes = ("CHID1", "AP2A2") + tuple(
+        f"GENE{i}" for i in range(MAX_INLINE_VALUES + 1)
+    )
+    filters = {"AND": [{"field": "gene", "operator": operator, "value": genes}]}
+    short_filters = {
+        "AND": [{"field": "gene", "operator": operator, "value": genes[:2]}]
+    }
+
+    query = command.build_full_sql_query(conn, fields, filters=filters, limit=None)
+    assert "temp.in_values_" in query
+    # Same list, same table
+    assert query == command.build_full_sql_query(
+        conn, fields, filters=filters, limit=None
+    )
+
+    expected = list(command.select_cmd(conn, fields, filters=short_filters))
+    assert expected
+    assert list(command.select_cmd(conn, fields, filters=filters)) == expected
+
+
 def test_create_cmd(conn):
     """Test creation of a selection table based on default 'variants' table"""
     result = command.create_cmd(conn, source="variants", target="test")
@@ -67,6 +170,89 @@ def test_count_cmd(conn):
     assert result["count"] == 11
 
 
+def test_estimate_count(tmp_path):
+    """Test approximate counts against exact counts"""
+    from cutevariant.core.benchmark import generate_vcf
+    from cutevariant.core.importer import import_file
+
+    filepath = str(tmp_path / "test.vcf")
+    generate_vcf(filepath, variants=2000, samples=2)
+    conn = sql.get_sql_connection(":memory:")
+    import_file(conn, filepath)
+
+    fields = ["chr", "pos", "impact"]
+    filters = {"AND": [{"field": "impact", "operator": "=", "value": "MODIFIER"}]}
+    exact = command.count_cmd(conn, fields=fields, filters=filters)
+    assert "approximate" not in exact
+
+    estimate = command.estimate_count(
+        conn, fields=fields, filters=filters, sample_size=500, ranges=5
+    )
+    assert abs(estimate - exact["count"]) < exact["count"] * 0.2
+
+    # Small sources are counted exactly
+    assert command.estimate_count(conn, fields=fields, filters=filters) is None
+    assert command.count_cmd(
+        conn, fields=fields, filters=filters, approximate=True
+    ) == exact
+
+
+def test_cached_results(conn):
+    """Test the caching of counts and pages until the data is modified"""
+    fields = ["chr", "pos", "gene"]
+    filters = {"AND": [{"field": "gene", "operator": "=", "value": "CHID1"}]}
+    count = command.count_cmd(conn, fields=fields, filters=filters)["count"]
+    variants = list(command.select_cmd(conn, fields=fields, filters=filters))
+    assert count == len(variants) > 0
+
+    # Unknown modifications are ignored...
+    conn.execute("UPDATE annotations SET gene = 'CHID1'")
+    assert command.count_cmd(conn, fields=fields, filters=filters)["count"] == count
+    assert list(command.select_cmd(conn, fields=fields, filters=filters)) == variants
+
+    # ...until the next write of the project
+    sql.update_variant(conn, {"id": 1, "comment": "hello"})
+    new_count = command.count_cmd(conn, fields=fields, filters=filters)["count"]
+    assert new_count > count
+    assert len(list(command.select_cmd(conn, fields=fields, filters=filters))) > len(
+        variants
+    )
+
+
+def test_cached_results_locked(tmp_path):
+    """Test that the cache never waits for locks on the project or its store"""
+    db_path = str(tmp_path / "test.db")
+    conn = sql.get_sql_connection(db_path)
+    import_reader(conn, VcfReader(open("examples/test.snpeff.vcf"), "snpeff"))
+    fields = ["chr", "pos", "gene"]
+    filters = {"AND": [{"field": "gene", "operator": "=", "value": "CHID1"}]}
+
+    # Another connection holds a read lock on the project: writes are blocked
+    reader = sql.get_sql_connection(db_path)
+    reader.execute("BEGIN")
+    reader.execute("SELECT COUNT(*) FROM variants").fetchone()
+    start = time.perf_counter()
+    count = command.count_cmd(conn, fields=fields, filters=filters)
+    variants = list(command.select_cmd(conn, fields=fields, filters=filters))
+    assert time.perf_counter() - start < 1
+    assert not conn.in_transaction
+    cache_conn = sql.get_cache_connection(conn)
+    assert cache_conn.execute("SELECT COUNT(*) FROM query_cache").fetchone()[0] == 2
+    assert command.count_cmd(conn, fields=fields, filters=filters) == count
+    assert list(command.select_cmd(conn, fields=fields, filters=filters)) == variants
+    reader.rollback()
+
+    # The store is locked by another connection: results are not cached
+    locker = sqlite3.connect(sql.get_cache_path(conn))
+    locker.execute("BEGIN EXCLUSIVE")
+    start = time.perf_counter()
+    command.count_cmd(conn, fields=fields)
+    assert time.perf_counter() - start < 1
+    locker.rollback()
+    assert cache_conn.execute("SELECT COUNT(*) FROM query_cache").fetchone()[0] == 2
+    assert command.count_cmd(conn, fields=fields, filters=filters) == count
+
+
 def test_drop_cmd(conn):
     """Test drop command of VQL language
 
@@ -293,6 +479,33 @@ def test_show_cmd(conn):
         list(command.execute(conn, "SHOW truc"))
 
 
+@pytest.mark.parametrize(
+    "statement, count",
+    [
+        ("SELECT chr, pos, gene FROM variants WHERE gene = 'CHID1'", 3),
+        ("COUNT FROM variants WHERE ref = 'C'", 4),
+    ],
+    ids=["select", "count"],
+)
+def test_explain_cmd(conn, statement, count):
+    """Test the query plans and timings of EXPLAIN/PROFILE commands"""
+    result = command.execute(conn, "EXPLAIN " + statement)
+    assert result["statement"] == statement
+    assert result["sql"].startswith("SELECT")
+    assert result["plan"] and result["plan"][0]["depth"] == 0
+    assert list(result["timings"]) == ["parse", "build"]
+    assert "count" not in result
+
+    result = command.execute(conn, "PROFILE " + statement)
+    assert list(result["timings"]) == ["parse", "build", "execute", "fetch"]
+    assert result["count"] == count
+    text = command.explain_to_text(result)
+    assert "QUERY PLAN" in text and result["plan"][-1]["detail"] in text
+
+    with pytest.raises(vql.VQLSyntaxError):
+        command.explain_cmd(conn, "DROP selections subset")
+
+
 def test_execute(conn):
     """Test the wrapper of create_command_from_obj()
 
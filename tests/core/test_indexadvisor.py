@@ -0,0 +1,111 @@
+import pytest
+import time
+
+from cutevariant.core import sql, command, indexadvisor
+from cutevariant.core.importer import import_reader
+from cutevariant.core.reader import VcfReader
+from tests.utils import table_exists
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sql.get_sql_connection(str(tmp_path / "project.db"))
+    import_reader(conn, VcfReader(open("examples/test.snpeff.vcf"), "snpeff"))
+    command.clear_cache_cmd()
+    return conn
+
+
+def test_get_query_indexes():
+    default_tables = {"gene": "annotations", "impact": "annotations", "pos": "variants"}
+    filters = {
+        "AND": [
+            {"field": "gene", "operator": "=", "value": "CFTR"},
+            {"field": "impact", "operator": "IN", "value": ("HIGH", "MODERATE")},
+            {"field": "pos", "operator": ">", "value": 10},
+            {"field": "variants.qual", "operator": "LIKE", "value": "1%"},
+            {"field": ("sample", "boby", "gt"), "operator": "=", "value": 1},
+        ]
+    }
+    assert indexadvisor.get_query_indexes(filters, "variants.ref", default_tables) == {
+        ("annotations", ("gene",)),
+        ("annotations", ("impact",)),
+        ("annotations", ("gene", "impact")),
+        ("variants", ("pos",)),
+    }
+    assert indexadvisor.get_query_indexes({}, "variants.ref", default_tables) == {
+        ("variants", ("ref",))
+    }
+    assert indexadvisor.get_query_shape(filters, "variants.ref") == (
+        ("gene", "impact"),
+        ("pos",),
+        "variants.ref",
+    )
+
+
+def test_index_advisor(conn):
+    filters = {
+        "AND": [
+            {"field": "annotations.gene", "operator": "=", "value": "CHID1"},
+            {"field": "variants.pos", "operator": "=", "value": 10},
+        ]
+    }
+    # Fast queries are ignored
+    indexadvisor.record_query(conn, filters, 0.001)
+    assert indexadvisor.get_index_suggestions(conn, min_count=1) == []
+
+    # Another connection holds a read lock on the project: no wait
+    reader = sql.get_sql_connection(conn.execute("PRAGMA database_list").fetchone()[2])
+    reader.execute("BEGIN")
+    reader.execute("SELECT COUNT(*) FROM variants").fetchone()
+    start = time.perf_counter()
+    for _ in range(3):
+        indexadvisor.record_query(conn, filters, 1, order_by="variants.ref")
+    assert time.perf_counter() - start < 1
+    reader.rollback()
+    indexadvisor.record_query(conn, {"AND": [filters["AND"][0]]}, 1)
+
+    # Statistics are recorded in the store of the project, by shape of query
+    assert not table_exists(conn, "index_advisor")
+    cache_conn = sql.get_cache_connection(conn)
+    assert cache_conn.execute("SELECT COUNT(*) FROM index_advisor").fetchone()[0] == 2
+
+    suggestions = indexadvisor.get_index_suggestions(conn)
+    # variants.pos is already indexed (idx_variants_pos)
+    assert [(i["table"], i["columns"]) for i in suggestions] == [
+        ("annotations", ("gene",)),
+        ("variants", ("pos", "ref")),
+    ]
+    assert all(i["size"] > 0 and i["count"] >= 3 for i in suggestions)
+
+    # Budget on the size of the indexes
+    budget = suggestions[0]["size"]
+    limited = indexadvisor.get_index_suggestions(conn, budget=budget)
+    assert [i["name"] for i in limited] == [suggestions[0]["name"]]
+
+    # Create the indexes in a background thread
+    filepath = conn.execute("PRAGMA database_list").fetchone()[2]
+    thread = indexadvisor.IndexAdvisorThread(filepath, budget=budget)
+    thread.start()
+    thread.join()
+    assert thread.created == ["idx_advisor_annotations_gene"]
+    assert [i["name"] for i in indexadvisor.get_advisor_indexes(conn)] == [
+        "idx_advisor_annotations_gene"
+    ]
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM annotations WHERE gene = 'CHID1'"
+    ).fetchall()
+    assert "idx_advisor_annotations_gene" in str([tuple(row) for row in plan])
+
+    # The budget is used by the created index
+    assert indexadvisor.get_index_suggestions(conn, budget=budget) == []
+
+    indexes = list(command.show_cmd(conn, "indexes"))
+    assert [(i["name"], i["status"]) for i in indexes] == [
+        ("idx_advisor_annotations_gene", "created"),
+        ("idx_advisor_variants_pos_ref", "suggested"),
+    ]
+
+    # Only indexes of the advisor can be dropped
+    assert not command.drop_cmd(conn, "indexes", "idx_variants_pos")["success"]
+    assert command.drop_cmd(conn, "indexes", "idx_advisor_annotations_gene")["success"]
+    assert list(indexadvisor.get_advisor_indexes(conn)) == []
@@ -0,0 +1,219 @@
+import pytest
+
+from cutevariant.core import sql, querybuilder
+from cutevariant.core.importer import async_import_reader, import_reader
+from cutevariant.core.intervals import (
+    load_intervals,
+    IntervalSweep,
+    ucsc_bin,
+    containing_bins,
+    parse_region,
+    merge_sorted_intervals,
+    intersect_sorted,
+    UnsortedIntervalsError,
+)
+from cutevariant.core.prefilter import VariantFilter, parse_where
+from cutevariant.core.reader import VcfReader, BedReader
+
+FILENAME = "examples/test.snpeff.vcf"
+
+BED = """
+11 120000 123000 first
+11 122000 124000 overlapping
+11 900005 950000 last
+"""
+
+
+def test_interval_sweep():
+    intervals = load_intervals(BedReader(BED))
+    assert intervals == {"11": [(120000, 124000), (900005, 950000)]}
+
+    sweep = IntervalSweep(intervals)
+    positions = [1, 120000, 123500, 124000, 124001, 900000, 920000, 950001]
+    expected = [False, True, True, True, False, False, True, False]
+    assert [sweep.contains("11", pos) for pos in positions] == expected
+
+    # Unsorted positions and unknown chromosomes
+    assert [sweep.contains("11", pos) for pos in reversed(positions)] == list(
+        reversed(expected)
+    )
+    assert not sweep.contains("chr11", 120000)
+
+    # Streamed intervals
+    merged = list(merge_sorted_intervals(BedReader(BED)))
+    assert merged == [("11", 120000, 124000), ("11", 900005, 950000)]
+    with pytest.raises(UnsortedIntervalsError):
+        list(merge_sorted_intervals(BedReader("11 10 20\n11 1 5")))
+    with pytest.raises(UnsortedIntervalsError):
+        list(merge_sorted_intervals(BedReader("11 10 20\n12 1 5\n11 30 40")))
+
+    positions = [(1, 5), (2, 15), (3, 20), (4, 25), (5, 35)]
+    assert list(intersect_sorted(positions, [(10, 20), (30, 32)])) == [2, 3]
+
+
+def test_ucsc_bins():
+    assert ucsc_bin(0, 0) == 585
+    assert ucsc_bin(200000, 200010) == 586
+    # Across the boundary of 128 kb bins: 1 Mb bin
+    assert ucsc_bin(131000, 132000) == 73
+    assert ucsc_bin(0, 2 ** 29) == -1
+
+    for start, end in [(10, 20), (131000, 132000), (1, 2 ** 28), (0, 2 ** 30)]:
+        for pos in (start, end):
+            assert ucsc_bin(start, end) in containing_bins(pos)
+
+    assert parse_region("chr1:12,000-13000") == ("chr1", 12000, 13000)
+    assert parse_region("chr1:12000") == ("chr1", 12000, 12000)
+    assert parse_region("chrX") == ("chrX", None, None)
+    with pytest.raises(ValueError):
+        parse_region("chr1:13000-12000")
+
+
+@pytest.mark.parametrize(
+    "create_selection",
+    [sql.create_selection_from_bed, sql.create_selection_from_sorted_bed],
+)
+@pytest.mark.parametrize("interval_count", [3, 500])
+@pytest.mark.parametrize("sort", [True, False])
+def test_bed_intersection(create_selection, interval_count, sort):
+    """Test both joins of BED intersections (intervals or variants first)
+
+    and the sort-merge sweep, with sorted and unsorted BED data
+    """
+    conn = sql.get_sql_connection(":memory:")
+    import_reader(conn, VcfReader(open(FILENAME), "snpeff"))
+    lines = [f"11 {i * 2000} {i * 2000 + 5}" for i in range(interval_count - 3)]
+    lines += BED.strip().splitlines() + ["12 1 1000000"]
+    if sort:
+        lines.sort(key=lambda line: (line.split()[0], int(line.split()[1])))
+    else:
+        lines.reverse()
+    bed = "\n".join(lines)
+    expected = {
+        row[0]
+        for row in conn.execute("SELECT id, chr, pos FROM variants")
+        if any(
+            str(row[1]) == interval["chrom"]
+            and int(interval["start"]) <= row[2] <= int(interval["end"])
+            for interval in BedReader(bed)
+        )
+    }
+    selection_id = create_selection(conn, "variants", "panel", BedReader(bed))
+    found = conn.execute(
+        "SELECT variant_id FROM selection_has_variant WHERE selection_id = ?",
+        (selection_id,),
+    )
+    assert {row[0] for row in found} == expected
+
+
+def get_variants(conn):
+    return {
+        tuple(row)
+        for row in conn.execute("SELECT chr, pos, ref, alt, qual FROM variants")
+    }
+
+
+@pytest.mark.parametrize(
+    "where",
+    [
+        "qual > 30 AND filter = ''",
+        "impact = 'MODIFIER' AND gene != 'CHID1'",
+        "annotations.gene IN ('CHID1', 'RIC8A') OR pos < 125000",
+        "consequence LIKE '%intron%'",
+        "gene HAS 'hid'",
+        "sample['TUMOR'].gt = 1",
+        "variants.dp IS NULL",
+        "region IN ('11:120000-124000', '11:900,000')",
+        "region != '11:125000-950000'",
+    ],
+)
+def test_prefilters(where):
+    """Test the filters evaluated during the import against SQL queries"""
+    conn = sql.get_sql_connection(":memory:")
+    import_reader(conn, VcfReader(open(FILENAME), "snpeff"))
+
+    filters = parse_where(where)
+    query = querybuilder.build_full_sql_query(
+        conn, ["chr", "pos", "ref", "alt", "qual"], filters=filters, limit=None
+    )
+    expected = {tuple(row)[1:] for row in conn.execute(query)}
+
+    filtered_conn = sql.get_sql_connection(":memory:")
+    messages = [
+        message
+        for _, message in async_import_reader(
+            filtered_conn, VcfReader(open(FILENAME), "snpeff"), filters=where
+        )
+    ]
+    assert get_variants(filtered_conn) == expected
+    rejected = sql.get_variants_count(conn) - len(expected)
+    assert f"{rejected} variant(s) filtered out." in messages
+
+
+def test_bed_prefilter():
+    """Test the BED file of the import against CREATE ... INTERSECT"""
+    conn = sql.get_sql_connection(":memory:")
+    import_reader(conn, VcfReader(open(FILENAME), "snpeff"))
+    sql.create_selection_from_bed(conn, "variants", "panel", BedReader(BED))
+    expected = {
+        tuple(row)
+        for row in conn.execute(
+            "SELECT chr, pos, ref, alt, qual FROM variants "
+            "INNER JOIN selection_has_variant sv ON sv.variant_id = variants.id "
+            "INNER JOIN selections s ON s.id = sv.selection_id AND s.name = 'panel'"
+        )
+    }
+    assert expected
+
+    filtered_conn = sql.get_sql_connection(":memory:")
+    for _ in async_import_reader(
+        filtered_conn,
+        VcfReader(open(FILENAME), "snpeff", fast_parser=True),
+        bed=BED,
+        filters="qual > 0",
+    ):
+        pass
+    assert get_variants(filtered_conn) == {
+        row for row in expected if (row[4] or 0) > 0
+    }
+
+
+def test_prefilter_errors():
+    fields = [
+        {"name": "pos", "category": "variants"},
+        {"name": "gene", "category": "annotations"},
+    ]
+    VariantFilter("pos > 10 AND annotations.gene = 'CFTR'", fields=fields)
+
+    with pytest.raises(ValueError, match="Unknown field"):
+        VariantFilter("impact = 'HIGH'", fields=fields)
+
+    with pytest.raises(ValueError, match="Wordsets"):
+        VariantFilter("gene IN WORDSET['panel']", fields=fields)
+
+
+def test_resume_prefilter():
+    """Filters with tuples survive the interruption of the import"""
+    where = "sample['TUMOR'].gt = 1 AND pos IN (10000, 900000, 123000, 125010)"
+    expected_conn = sql.get_sql_connection(":memory:")
+    for _ in async_import_reader(
+        expected_conn, VcfReader(open(FILENAME), "snpeff"), filters=where
+    ):
+        pass
+    expected = get_variants(expected_conn)
+    assert len(expected) > 2
+
+    conn = sql.get_sql_connection(":memory:")
+    importer = async_import_reader(
+        conn, VcfReader(open(FILENAME), "snpeff"), filters=where, batch_size=2
+    )
+    for _, message in importer:
+        if "variants inserted" in message:
+            importer.close()
+            break
+    assert 0 < sql.get_variants_count(conn) < len(expected)
+
+    reader = VcfReader(open(FILENAME), "snpeff")
+    for _ in async_import_reader(conn, reader, resume=True):
+        pass
+    assert get_variants(conn) == expected
@@ -400,3 +400,36 @@ def test_build_query(test_input, test_output, vql):
 #     assert querybuilder.fields_to_vql(("sample", "boby", "gt")) == "sample['boby'].gt"
 
 # def test_filters_to_vql():
+
+
+def test_keyset_to_sql():
+    fields = ["`variants`.`pos`", "`variants`.`id`"]
+    params = {}
+    # The first field is bounded; values are bound to parameters
+    assert querybuilder.keyset_to_sql(fields, (10, 3), params=params) == [
+        "(`variants`.`pos` >= :keyset_0 AND (`variants`.`pos` > :keyset_0 OR "
+        "(`variants`.`pos` = :keyset_0 AND `variants`.`id` > :keyset_1)))"
+    ]
+    assert params == {"keyset_0": 10, "keyset_1": 3}
+    # NULL values come after the others in descending order
+    params = {}
+    assert querybuilder.keyset_to_sql(fields, (10, 3), True, params) == [
+        "(`variants`.`pos` <= :keyset_0 AND (`variants`.`pos` < :keyset_0 OR "
+        "(`variants`.`pos` = :keyset_0 AND "
+        "(`variants`.`id` < :keyset_1 OR `variants`.`id` IS NULL))))",
+        "`variants`.`pos` IS NULL",
+    ]
+    # NULL is the lowest value
+    params = {}
+    assert querybuilder.keyset_to_sql(fields, (None, 3), True, params) == [
+        "(0 OR (`variants`.`pos` IS NULL AND "
+        "(`variants`.`id` < :keyset_1 OR `variants`.`id` IS NULL)))"
+    ]
+    assert params == {"keyset_1": 3}
+    params = {}
+    querybuilder.keyset_to_sql(["`annotations`.`gene`"], ("O'Neil",), params=params)
+    assert params == {"keyset_0": "O'Neil"}
+
+    # Cursors are bound to parameters
+    with pytest.raises(ValueError):
+        querybuilder.build_sql_query(["chr"], cursor=(1,))
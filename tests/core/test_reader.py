@@ -1,13 +1,23 @@
 # Standard imports
 import pytest
 import sqlite3
+import os
+import gzip
+import struct
+import zlib
 from collections import OrderedDict
+from itertools import groupby
+from operator import itemgetter
 
 # Custom imports
-from cutevariant.core.reader import VcfReader, FakeReader
+from cutevariant.core.reader import VcfReader, FakeReader, CsvReader
 from cutevariant.core.reader import BedReader
+from cutevariant.core.reader import BgzfReader, open_gzip
+from cutevariant.core.reader.csvreader import external_sort
+from cutevariant.core.readerfactory import create_reader
 from cutevariant.core.reader import check_variant_schema, check_field_schema
 from cutevariant.core import sql
+import cutevariant.commons as cm
 
 
 READERS = [
@@ -102,6 +112,375 @@ def test_create_db(reader):
     assert sql.get_variants_count(conn) == variant_count
 
 
+@pytest.mark.parametrize(
+    "filename, annotation_parser, mode",
+    [
+        ("examples/test.vcf", None, "r"),
+        ("examples/test.vep.vcf", "vep", "r"),
+        ("examples/test.snpeff.vcf", "snpeff", "r"),
+        ("examples/test.snpeff.vcf.gz", "snpeff", "rb"),
+    ],
+)
+def test_parallel_vcfreader(filename, annotation_parser, mode):
+    """Variants parsed in worker processes must be those of the sequential parsing"""
+    with open(filename, mode) as device:
+        reader = VcfReader(device, annotation_parser)
+        samples = reader.get_samples()
+        kwargs = {"case": samples[:1], "control": samples[1:]}
+        expected = list(reader.get_extra_variants(**kwargs))
+
+    with open(filename, mode) as device:
+        reader = VcfReader(device, annotation_parser, processes=2, chunk_size=3)
+        variants = list(reader.get_extra_variants(**kwargs))
+
+    assert variants
+    # Compare representations: NaN values are not equal to themselves
+    assert repr(variants) == repr(expected)
+
+
+@pytest.mark.parametrize(
+    "filename, annotation_parser, mode",
+    [
+        ("examples/test.vcf", None, "r"),
+        ("examples/test.vep.vcf", "vep", "r"),
+        ("examples/test.snpeff.vcf", "snpeff", "r"),
+        ("examples/test.snpeff.vcf.gz", "snpeff", "rb"),
+        ("examples/spliceai.vcf", None, "r"),
+    ],
+)
+def test_vcf_tokenizer(filename, annotation_parser, mode):
+    """Variants parsed by VcfTokenizer must be those parsed by PyVCF"""
+    with open(filename, mode) as device:
+        expected = list(VcfReader(device, annotation_parser).get_extra_variants())
+
+    with open(filename, mode) as device:
+        reader = VcfReader(device, annotation_parser, fast_parser=True)
+        variants = list(reader.get_extra_variants())
+
+    assert variants
+    # Compare representations: NaN values are not equal to themselves
+    assert repr(variants) == repr(expected)
+
+
+def test_vcf_tokenizer_edge_cases(tmp_path):
+    """Missing values, multiple alleles, partial genotypes, etc."""
+    filename = tmp_path / "edge_cases.vcf"
+    filename.write_text(
+        "##fileformat=VCFv4.2\n"
+        '##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">\n'
+        '##INFO=<ID=AF,Number=A,Type=Float,Description="Frequency">\n'
+        '##INFO=<ID=DB,Number=0,Type=Flag,Description="dbSNP">\n'
+        '##INFO=<ID=NOTE,Number=.,Type=String,Description="Note">\n'
+        '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n'
+        '##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Depth">\n'
+        '##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Depths">\n'
+        '##FORMAT=<ID=FT,Number=1,Type=String,Description="Filter">\n'
+        "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tboby\tsacha\tlouis\n"
+        "chr1\t10\trs1\tA\tT,G\t30\tPASS\tDP=10;AF=0.5,.;DB\tGT:DP:AD:FT\t0/1:5:3,2,.:PASS\t./.:.:.:q10\t1|1\n"
+        "chr1\t20\t.\tAC\tA\t.\t.\tNOTE=a,b;DP=3\tGT:AD\t0\t1/.\t0/0:4,0\n"
+        "chr2\t30\t.\tG\tC\t12.5\tq10;s50\t.\tDP\t3\t4\t5\n"
+        "chr2\t40\t.\tT\t<DEL>\t50\tPASS\tDP=2\t.\t.\t.\t.\n"
+    )
+
+    with open(filename) as device:
+        expected = list(VcfReader(device).get_variants())
+
+    with open(filename) as device:
+        variants = list(VcfReader(device, fast_parser=True).get_variants())
+
+    assert len(variants) == 5
+    assert variants == expected
+    assert [sample["gt"] for sample in variants[0]["samples"]] == [1, -1, 2]
+    assert [sample["gt"] for sample in variants[2]["samples"]] == [0, 1, 0]
+
+    # Selected fields and samples: unselected values are removed for PyVCF
+    for fields, samples in (
+        (["variants.dp", "samples.ad"], None),
+        (["variants.note"], ["sacha", "louis"]),
+        (None, ["louis"]),
+    ):
+        results = []
+        for fast_parser in (False, True):
+            with open(filename) as device:
+                reader = VcfReader(device, fast_parser=fast_parser)
+                reader.select_fields(include=fields)
+                reader.select_samples(include=samples)
+                results.append(list(reader.get_variants()))
+        assert results[0] == results[1]
+
+
+def test_vcfreader_selection(monkeypatch):
+    """Unselected INFO keys, FORMAT keys and samples are never decoded by PyVCF"""
+    import vcf
+
+    decoded_infos, decoded_formats, sample_counts = set(), set(), set()
+    parse_info = vcf.Reader._parse_info
+    parse_samples = vcf.Reader._parse_samples
+
+    def spy_parse_info(self, info_str):
+        info = parse_info(self, info_str)
+        decoded_infos.update(info)
+        return info
+
+    def spy_parse_samples(self, samples, samp_fmt, site):
+        decoded_formats.update(samp_fmt.split(":"))
+        sample_counts.add(len(samples))
+        return parse_samples(self, samples, samp_fmt, site)
+
+    monkeypatch.setattr(vcf.Reader, "_parse_info", spy_parse_info)
+    monkeypatch.setattr(vcf.Reader, "_parse_samples", spy_parse_samples)
+
+    def read(fast_parser=False, selection=True):
+        with open("examples/test.snpeff.vcf") as device:
+            reader = VcfReader(device, fast_parser=fast_parser)
+            if selection:
+                reader.select_fields(include=["variants.dp", "samples.af"])
+                reader.select_samples(include=["TUMOR"])
+            return list(reader.get_variants())
+
+    # The tokenizer doesn't use PyVCF to parse the records
+    expected = read(fast_parser=True)
+    decoded_infos.clear()
+    decoded_formats.clear()
+    sample_counts.clear()
+
+    variants = read()
+    assert variants == expected
+    assert decoded_infos == {"DP"}
+    assert decoded_formats == {"GT", "AF"}
+    assert sample_counts == {1}
+    assert {sample["name"] for v in variants for sample in v["samples"]} == {"TUMOR"}
+
+    # Values of the selected fields are the same
+    full_variants = read(selection=False)
+    assert len(decoded_infos) > 1 and sample_counts == {1, 2}
+    for variant, full_variant in zip(variants, full_variants):
+        assert variant["dp"] == full_variant["dp"]
+        assert variant["samples"][0] == {
+            key: value
+            for key, value in full_variant["samples"][1].items()
+            if key in ("name", "gt", "af")
+        }
+
+
+@pytest.mark.parametrize(
+    "filename, mode",
+    [("examples/test.snpeff.vcf", "r"), ("examples/test.snpeff.vcf.gz", "rb")],
+)
+def test_reader_progress(filename, mode):
+    """Test the progression computed from the position in the file on disk"""
+    with open(filename, mode) as device:
+        reader = VcfReader(device)
+        # Compressed size for gz files
+        assert reader.file_size == os.path.getsize(filename)
+
+        progressions = [reader.get_progress() for _ in reader.get_variants()]
+        assert progressions == sorted(progressions)
+        assert 0 < progressions[0] and progressions[-1] <= 100
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+@pytest.mark.parametrize(
+    "filename, mode",
+    [
+        ("examples/test.snpeff.vcf", "r"),
+        ("examples/test.snpeff.vcf.gz", "rb"),
+        ("bgzf", "r"),
+    ],
+)
+def test_vcfreader_start_offset(tmp_path, filename, mode, processes):
+    """Test the reading of the variants from the offset of a record"""
+    if filename == "bgzf":
+        filename = str(tmp_path / "test.snpeff.vcf.gz")
+        write_bgzf(filename, open("examples/test.snpeff.vcf", "rb").read(), 500)
+        device = open_gzip(filename)
+    else:
+        device = open(filename, mode)
+
+    with device:
+        reader = VcfReader(device, "snpeff", processes=processes, chunk_size=2)
+        expected = list(reader.get_extra_variants())
+        offsets = [variant[cm.RECORD_OFFSET_KEY] for variant in expected]
+        assert offsets == sorted(offsets) and len(set(offsets)) > 3
+        # Offsets are positions of records in the uncompressed file
+        opener = gzip.open if filename.endswith(".gz") else open
+        with opener(filename, "rb") as file:
+            data = file.read()
+        record = "%s\t%d\t" % (expected[3]["chr"], expected[3]["pos"])
+        assert data[offsets[3] :].startswith(record.encode())
+
+        assert reader.set_start_offset(offsets[3])
+        variants = list(reader.get_extra_variants())
+        assert repr(variants) == repr(expected[3:])
+
+
+def write_bgzf(filename, data, block_size):
+    """Write data in a BGZF file with blocks of block_size uncompressed bytes"""
+    with open(filename, "wb") as file_obj:
+        for i in range(0, len(data), block_size):
+            block = data[i : i + block_size]
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+            cdata = compressor.compress(block) + compressor.flush()
+            # Header (18 bytes) + compressed data + crc32 + isize
+            file_obj.write(
+                b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+                + struct.pack("<H", 18 + len(cdata) + 8 - 1)
+                + cdata
+                + struct.pack("<II", zlib.crc32(block), len(block))
+            )
+
+
+def test_get_bgzf_block_size(tmp_path):
+    """Test the detection of BGZF blocks"""
+    with open("examples/test.snpeff.vcf.gz", "rb") as file_obj:
+        assert cm.get_bgzf_block_size(file_obj) is None
+
+    data = open("examples/test.snpeff.vcf", "rb").read() * 10
+    filename = str(tmp_path / "test.vcf.gz")
+    write_bgzf(filename, data, 10000)
+    assert gzip.open(filename).read() == data
+
+    with open(filename, "rb") as file_obj:
+        size = cm.get_bgzf_block_size(file_obj)
+        assert size is not None
+        file_obj.seek(size)
+        assert cm.get_bgzf_block_size(file_obj) is not None
+
+
+def test_bgzf_reader(tmp_path):
+    """Test the multi-threaded decompression of BGZF files"""
+    data = open("examples/test.snpeff.vcf", "rb").read() * 10
+    filename = str(tmp_path / "test.vcf.gz")
+    write_bgzf(filename, data, 1000)
+
+    with BgzfReader(filename, threads=4, window=3) as stream:
+        assert stream.read() == data
+        # Seek backwards and forwards
+        stream.seek(1500)
+        assert stream.read(1000) == data[1500:2500]
+        stream.seek(10)
+        assert stream.tell() == 10
+        assert stream.read1(5000) == data[10:1000]
+        # Skip blocks without inflating them
+        stream.seek(5500)
+        assert stream.tell() == 5500
+        assert stream.read(1000) == data[5500:6500]
+        stream.seek(len(data) + 10)
+        assert stream.read() == b""
+
+    with open_gzip(filename) as stream:
+        assert isinstance(stream.buffer, BgzfReader)
+        assert stream.read() == data.decode()
+
+    # Plain gzip file
+    with open_gzip("examples/test.snpeff.vcf.gz") as stream:
+        assert stream.read() == gzip.open("examples/test.snpeff.vcf.gz", "rt").read()
+
+
+def test_create_reader_bgzf(tmp_path):
+    """Test VcfReader and BedReader on BGZF files"""
+    filename = str(tmp_path / "test.snpeff.vcf.gz")
+    write_bgzf(filename, open("examples/test.snpeff.vcf", "rb").read(), 5000)
+
+    with create_reader(filename) as reader:
+        variants = list(reader.get_extra_variants())
+        assert reader.file_size == os.path.getsize(filename)
+        assert reader.get_progress() == 100
+
+    with create_reader("examples/test.snpeff.vcf") as reader:
+        assert repr(variants) == repr(list(reader.get_extra_variants()))
+
+    filename = str(tmp_path / "test.bed.gz")
+    write_bgzf(filename, gzip.open("examples/test.bed.gz").read(), 20)
+    assert list(BedReader(filename)) == list(BedReader("examples/test.bed.gz"))
+
+
+def test_genotype_counter():
+    """Test that vectorized genotype counters equal the ones computed one by one"""
+    import copy
+    from cutevariant.core.reader.abstractreader import (
+        GenotypeCounter,
+        compute_extra_fields,
+    )
+
+    samples = ["a", "b", "c", "d", "e"]
+    variants = [
+        {
+            "chr": "chr1",
+            "pos": pos,
+            "ref": "A",
+            "alt": "CT"[pos % 2:],
+            "samples": [
+                {"name": name, "gt": (pos * index) % 4 - 1}
+                for index, name in enumerate(samples)
+            ],
+        }
+        for pos in range(20)
+    ]
+    # Variants processed one by one: filtered samples, no samples
+    variants[3]["samples"] = variants[3]["samples"][1:3]
+    # Same first and last samples, but in another order
+    samples_5 = variants[5]["samples"]
+    variants[5]["samples"] = [samples_5[0], samples_5[2], samples_5[1]] + samples_5[3:]
+    variants.append({"chr": "chr1", "pos": 30, "ref": "A", "alt": "T"})
+
+    for case, control in ((None, None), (["a", "c"], ["b", "e"])):
+        expected = [
+            compute_extra_fields(variant, case, control)
+            for variant in copy.deepcopy(variants)
+        ]
+        counter = GenotypeCounter(samples, case, control)
+        assert not counter.is_vectorizable(variants[5])
+        result = counter.compute_extra_fields(copy.deepcopy(variants))
+        assert result == expected
+        assert [list(variant) for variant in result] == [
+            list(variant) for variant in expected
+        ]
+        assert all(type(variant["count_het"]) is int for variant in result)
+
+
+def test_csvreader_external_sort(tmp_path):
+    """Unsorted transcripts are grouped by variant with temporary files"""
+
+    def get_variants(reader):
+        reader.get_fields()
+        return {
+            (v["chr"], v["pos"], v["ref"], v["alt"]): v["annotations"]
+            for v in reader.get_variants()
+        }
+
+    expected = get_variants(CsvReader(open("examples/test.vep.txt"), presorted=True))
+    assert len(expected) == 11
+
+    # Interleave the transcripts of the variants
+    header, *rows = open("examples/test.vep.txt").readlines()
+    filename = tmp_path / "unsorted.vep.txt"
+    filename.write_text(header + "".join(rows[::2] + rows[1::2]))
+
+    # Rows of the same variant are not consecutive
+    presorted = list(CsvReader(open(filename), presorted=True).parse_rows())
+    assert len([key for key, _ in groupby(presorted, key=itemgetter(0))]) > 11
+
+    for buffer_size in (4, 1000):
+        reader = CsvReader(open(filename), sort_buffer_size=buffer_size)
+        variants = get_variants(reader)
+        assert variants.keys() == expected.keys()
+        for key, annotations in variants.items():
+            assert sorted(map(str, annotations)) == sorted(map(str, expected[key]))
+
+    # Option of the importer
+    with create_reader("examples/test.vep.txt") as reader:
+        assert not reader.presorted
+    with create_reader("examples/test.vep.txt", presorted=True) as reader:
+        assert reader.presorted
+
+    # Merge of sorted chunks is stable
+    items = [(i % 3, i) for i in range(20)]
+    assert list(external_sort(items, key=itemgetter(0), buffer_size=3)) == sorted(
+        items, key=itemgetter(0)
+    )
+
+
 def test_bedreader_from_string():
     """Test bed string"""
 
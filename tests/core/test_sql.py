@@ -2,7 +2,10 @@
 import tempfile
 import copy
 import os
+import json
+import sqlite3
 
+import cutevariant.commons as cm
 from cutevariant.core import sql
 from cutevariant.core.reader import BedReader
 from tests.utils import table_exists, table_count
@@ -739,3 +742,678 @@ def test_variants(conn):
                 del expected_variant[not_wanted_key]
 
         assert tuple(record) == tuple(expected_variant.values())
+
+
+@pytest.mark.parametrize("batch_size", (1, 2, 1000))
+def test_insert_many_variants_by_batches(batch_size):
+    """Test the insertion of variants by batches with duplicated variants
+
+    Data attached to rejected variants must not be inserted; data of other
+    variants must be linked to the right ids whatever the batch size.
+    """
+    conn = sql.get_sql_connection(":memory:")
+    sql.create_table_fields(conn)
+    sql.insert_many_fields(conn, FIELDS)
+    sql.create_table_selections(conn)
+    sql.create_table_annotations(conn, sql.get_field_by_category(conn, "annotations"))
+    sql.create_table_samples(conn, sql.get_field_by_category(conn, "samples"))
+    sql.insert_many_samples(conn, SAMPLES)
+    sql.create_table_variants(conn, sql.get_field_by_category(conn, "variants"))
+
+    data = [
+        {
+            "chr": "chr1",
+            "pos": pos,
+            "ref": "G",
+            "alt": "A",
+            "annotations": [{"gene": f"gene{pos}", "transcript": "transcript1"}],
+            "samples": [{"name": "sacha", "gt": 1}, {"name": "boby", "gt": 0}],
+        }
+        for pos in (10, 20, 30)
+    ]
+    # The first variant is duplicated at the end of the data
+    data.append(
+        {
+            "chr": "chr1",
+            "pos": 10,
+            "ref": "G",
+            "alt": "A",
+            "annotations": [{"gene": "duplicate", "transcript": "duplicate"}],
+            "samples": [{"name": "sacha", "gt": 2}],
+        }
+    )
+    # Variants without a complete key, even duplicated ones
+    data += [
+        {"chr": "chr1", "pos": 40, "ref": "G", "alt": None},
+        {"chr": "chr1", "pos": 50, "ref": "G", "alt": ""},
+        {"chr": "chr1", "pos": 50, "ref": "G", "alt": ""},
+        {"chr": "chr1", "pos": 60, "alt": "A", "samples": [{"name": "sacha", "gt": 1}]},
+    ]
+
+    sql.insert_many_variants(conn, data, batch_size=batch_size)
+
+    assert sql.get_variants_count(conn) == 3
+    assert table_count(conn, "annotations") == 3
+    assert table_count(conn, "sample_has_variant") == 6
+
+    for variant in conn.execute("SELECT id, pos FROM variants"):
+        genes = [ann["gene"] for ann in sql.get_annotations(conn, variant["id"])]
+        assert genes == [f"gene{variant['pos']}"]
+
+    # Default selection takes only inserted variants into account
+    selection = next(sql.get_selections(conn))
+    assert selection["count"] == 3
+
+    # Rejected variants are stored instead of being logged
+    rejected = list(sql.get_rejected_variants(conn))
+    assert [
+        (row["variant_index"], row["chr"], row["pos"], row["reason"])
+        for row in rejected
+    ] == [(4, "chr1", 10, cm.REJECTED_DUPLICATE)] + [
+        (index, "chr1", pos, cm.REJECTED_MISSING_KEY)
+        for index, pos in ((5, 40), (6, 50), (7, 50), (8, 60))
+    ]
+    assert sql.get_rejected_variants_count(conn) == {
+        cm.REJECTED_DUPLICATE: 1,
+        cm.REJECTED_MISSING_KEY: 4,
+    }
+
+
+def test_bulk_load(tmp_path):
+    """Test the settings of the bulk load session and the deferred checks"""
+    conn = sql.get_sql_connection(str(tmp_path / "bulk.db"))
+    sql.create_table_fields(conn)
+    sql.insert_many_fields(conn, FIELDS)
+    sql.create_table_selections(conn)
+    sql.create_table_annotations(conn, sql.get_field_by_category(conn, "annotations"))
+    sql.create_table_samples(conn, sql.get_field_by_category(conn, "samples"))
+    sql.insert_many_samples(conn, SAMPLES)
+    sql.create_table_variants(conn, sql.get_field_by_category(conn, "variants"))
+
+    previous_settings = sql.begin_bulk_load(conn)
+    assert previous_settings["journal_mode"] == "delete"
+    assert previous_settings["foreign_keys"] == 1
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "memory"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 0
+    assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 0
+
+    # Genotype of an unknown sample: accepted during the bulk load
+    conn.execute(
+        "INSERT INTO sample_has_variant (sample_id, variant_id, gt) VALUES (1000, 1, 1)"
+    )
+
+    with pytest.raises(sqlite3.IntegrityError):
+        sql.end_bulk_load(conn, previous_settings)
+
+    # Safe settings are restored
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 2
+    assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+
+    conn.execute("DELETE FROM sample_has_variant")
+    previous_settings = sql.begin_bulk_load(conn)
+    sql.insert_many_variants(conn, VARIANTS[2:])
+    sql.end_bulk_load(conn, previous_settings)
+    assert sql.get_variants_count(conn) == 1
+
+
+def test_insert_many_variants_append():
+    """Test the update of variants already in the database in append mode"""
+    conn = sql.get_sql_connection(":memory:")
+    sql.create_table_fields(conn)
+    sql.insert_many_fields(conn, FIELDS)
+    sql.create_table_selections(conn)
+    sql.create_table_annotations(conn, sql.get_field_by_category(conn, "annotations"))
+    sql.create_table_samples(conn, sql.get_field_by_category(conn, "samples"))
+    sql.create_table_variants(
+        conn,
+        list(sql.get_field_by_category(conn, "variants"))
+        + [{"name": "count_het", "type": "int"}, {"name": "count_hom", "type": "int"}],
+    )
+    sql.insert_many_samples(conn, ["sacha"])
+    sql.insert_many_variants(
+        conn,
+        [
+            {
+                "chr": "chr1",
+                "pos": 10,
+                "ref": "G",
+                "alt": "A",
+                "count_het": 1,
+                "count_hom": 0,
+                "annotations": [{"gene": "gene1", "transcript": "transcript1"}],
+                "samples": [{"name": "sacha", "gt": 1}],
+            }
+        ],
+    )
+
+    # New sample with a known variant and a new one
+    sql.insert_many_samples(conn, ["boby"])
+    sql.insert_many_variants(
+        conn,
+        [
+            {
+                "chr": "chr1",
+                "pos": 10,
+                "ref": "G",
+                "alt": "A",
+                "count_het": 0,
+                "count_hom": 1,
+                "annotations": [{"gene": "gene1", "transcript": "transcript1"}],
+                "samples": [{"name": "boby", "gt": 2}],
+            },
+            {
+                "chr": "chr1",
+                "pos": 20,
+                "ref": "C",
+                "alt": "T",
+                "count_het": 1,
+                "count_hom": 0,
+                "samples": [{"name": "boby", "gt": 1}],
+            },
+        ],
+        append=True,
+    )
+
+    assert sql.get_variants_count(conn) == 2
+    variant = conn.execute(
+        "SELECT id, count_het, count_hom FROM variants WHERE pos = 10"
+    ).fetchone()
+    assert (variant["count_het"], variant["count_hom"]) == (1, 1)
+    # Annotations are not duplicated
+    assert len(list(sql.get_annotations(conn, variant["id"]))) == 1
+    # Genotypes of both samples are linked to the variant
+    genotypes = conn.execute(
+        "SELECT gt FROM sample_has_variant WHERE variant_id = ? ORDER BY sample_id",
+        (variant["id"],),
+    )
+    assert [row["gt"] for row in genotypes] == [1, 2]
+    # The default selection is updated, not duplicated
+    selections = list(sql.get_selections(conn))
+    assert len(selections) == 1
+    assert selections[0]["count"] == 2
+
+
+@pytest.mark.parametrize("packed", [False, True], ids=["unpacked", "packed"])
+@pytest.mark.parametrize("batch_size", [2, 1000])
+def test_insert_many_variants_append_duplicates(tmp_path, packed, batch_size):
+    """Test the rejection of the duplicates of a file appended to a project"""
+    from cutevariant.core import command
+    from cutevariant.core.importer import async_import_reader
+    from cutevariant.core.reader import VcfReader
+
+    with open("examples/test.snpeff.vcf") as file:
+        lines = file.read().splitlines()
+    header = [line for line in lines if line.startswith("#")]
+    records = [line for line in lines if not line.startswith("#")]
+    # The first record is new in the project, the second is already there;
+    # both are repeated with other genotypes at the end of the appended file
+    base_path = tmp_path / "base.vcf"
+    base_path.write_text("\n".join(header + records[1:]) + "\n")
+    duplicates = [
+        record.replace("\t0/0:", "\t1/1:").replace("\t0/1:", "\t1/1:")
+        for record in records[:2]
+    ]
+    appended_path = tmp_path / "appended.vcf"
+    appended_path.write_text(
+        "\n".join(
+            header[:-1]
+            + [header[-1].replace("NORMAL", "N2").replace("TUMOR", "T2")]
+            + records
+            + duplicates
+        )
+        + "\n"
+    )
+
+    def import_file(conn, path, append=False):
+        with open(path) as device:
+            for _ in async_import_reader(
+                conn,
+                VcfReader(device),
+                batch_size=batch_size,
+                append=append,
+                packed_genotypes=packed,
+            ):
+                pass
+
+    def get_variants(conn):
+        fields = ["chr", "pos", "ref", "alt"] + [
+            ("sample", name, "gt") for name in ("N2", "T2")
+        ]
+        command.clear_cache_cmd()
+        return {
+            tuple(variant[field] for field in ("chr", "pos", "ref", "alt")): {
+                field: value for field, value in variant.items() if field != "id"
+            }
+            for variant in command.select_cmd(conn, fields=fields, limit=None)
+        }
+
+    def get_counters(conn):
+        counters = sql.COUNTER_COLUMNS
+        return {
+            tuple(row[:4]): row[4:]
+            for row in conn.execute(
+                f"SELECT chr, pos, ref, alt, {','.join(counters)} FROM variants"
+            )
+        }
+
+    def get_rejected(conn):
+        return conn.execute(
+            "SELECT chr, pos, ref, alt, reason FROM rejected_variants ORDER BY pos"
+        ).fetchall()
+
+    expected_conn = sql.get_sql_connection(":memory:")
+    import_file(expected_conn, appended_path)
+    base_conn = sql.get_sql_connection(":memory:")
+    import_file(base_conn, base_path)
+    conn = sql.get_sql_connection(":memory:")
+    import_file(conn, base_path)
+    import_file(conn, appended_path, append=True)
+
+    # Counters of the appended file are added once
+    expected_counters = get_counters(expected_conn)
+    base_counters = get_counters(base_conn)
+    assert get_counters(conn) == {
+        key: tuple(
+            value + base
+            for value, base in zip(counters, base_counters.get(key, [0] * len(counters)))
+        )
+        for key, counters in expected_counters.items()
+    }
+    # Genotypes of the first occurrences are kept
+    expected_variants = get_variants(expected_conn)
+    variants = get_variants(conn)
+    assert {key: variants[key] for key in expected_variants} == expected_variants
+    assert [tuple(row) for row in get_rejected(conn)] == [
+        tuple(row) for row in get_rejected(expected_conn)
+    ]
+    assert {row["reason"] for row in get_rejected(conn)} == {cm.REJECTED_DUPLICATE}
+    assert len(get_rejected(conn)) == 2
+
+
+def test_insert_new_fields():
+    """Test the addition of fields and columns of a new file"""
+    conn = sql.get_sql_connection(":memory:")
+    sql.create_table_fields(conn)
+    sql.insert_many_fields(conn, FIELDS)
+    sql.create_table_annotations(conn, sql.get_field_by_category(conn, "annotations"))
+    sql.create_table_samples(conn, sql.get_field_by_category(conn, "samples"))
+    sql.create_table_variants(conn, sql.get_field_by_category(conn, "variants"))
+
+    new_fields = [
+        {"name": "qual", "category": "variants", "type": "int", "description": ""},
+        {"name": "impact", "category": "annotations", "type": "str", "description": ""},
+        {"name": "gq", "category": "samples", "type": "int", "description": ""},
+    ]
+    assert sql.insert_new_fields(conn, FIELDS + new_fields) == new_fields
+    assert len(sql.get_fields(conn)) == len(FIELDS) + 3
+    assert "qual" in sql.get_table_columns(conn, "variants")
+    assert "impact" in sql.get_table_columns(conn, "annotations")
+    assert "gq" in sql.get_table_columns(conn, "sample_has_variant")
+
+    # Nothing to do the second time
+    assert sql.insert_new_fields(conn, new_fields) == []
+
+
+def test_resume_import():
+    """Test the resumption of an interrupted import from its last checkpoint"""
+    from cutevariant.core.importer import async_import_reader
+    from cutevariant.core.reader import VcfReader
+    import cutevariant.commons as cm
+
+    filename = "examples/test.snpeff.vcf"
+
+    # Reference: uninterrupted import
+    expected_conn = sql.get_sql_connection(":memory:")
+    with open(filename) as device:
+        for _ in async_import_reader(expected_conn, VcfReader(device), batch_size=2):
+            pass
+
+    conn = sql.get_sql_connection(":memory:")
+    with open(filename) as device:
+        importer = async_import_reader(conn, VcfReader(device), batch_size=2)
+        for _, message in importer:
+            if "variants inserted" in message:
+                # Interrupt the import after the first batch
+                importer.close()
+                break
+
+    metadatas = sql.get_metadatas(conn)
+    assert metadatas[cm.IMPORT_CHECKPOINT_KEY] == "2"
+    assert sql.get_variants_count(conn) == 2
+    # The reader restarts from the offset of the last inserted record
+    position = json.loads(metadatas[cm.IMPORT_OFFSET_KEY])
+    with open(filename) as device:
+        variants = list(VcfReader(device).get_variants())
+    offsets = [variant[cm.RECORD_OFFSET_KEY] for variant in variants[:2]]
+    assert position["offset"] == offsets[1]
+    assert position["count"] == offsets.count(offsets[1])
+    assert position["variant"] == [
+        variants[1][key] for key in ("chr", "pos", "ref", "alt")
+    ]
+
+    # The file doesn't match the interrupted import
+    with pytest.raises(ValueError):
+        with open("examples/test.vcf") as device:
+            for _ in async_import_reader(conn, VcfReader(device), resume=True):
+                pass
+
+    with open(filename) as device:
+        for _ in async_import_reader(conn, VcfReader(device), resume=True):
+            pass
+
+    metadatas = sql.get_metadatas(conn)
+    assert cm.IMPORT_CHECKPOINT_KEY not in metadatas
+    assert cm.IMPORT_OFFSET_KEY not in metadatas
+    query = "SELECT * FROM variants ORDER BY id"
+    assert list(conn.execute(query)) == list(expected_conn.execute(query))
+    query = "SELECT * FROM sample_has_variant ORDER BY variant_id, sample_id"
+    assert list(conn.execute(query)) == list(expected_conn.execute(query))
+    assert list(conn.execute("SELECT name, count FROM selections")) == list(
+        expected_conn.execute("SELECT name, count FROM selections")
+    )
+
+    # Nothing to resume anymore
+    with pytest.raises(ValueError):
+        with open(filename) as device:
+            for _ in async_import_reader(conn, VcfReader(device), resume=True):
+                pass
+
+
+def test_packed_genotypes():
+    """Test the storage of genotypes in blobs against sample_has_variant table"""
+    from cutevariant.core.importer import import_reader, async_import_reader
+    from cutevariant.core.reader import VcfReader
+    from cutevariant.core import querybuilder, genotypes
+
+    # Pack, update and unpack
+    blob = genotypes.pack_gt({0: 1, 5: 2, 6: -1})
+    assert [genotypes.unpack_gt(blob, i) for i in range(9)] == [1] + [-1] * 4 + [2] + [-1] * 3
+    blob = genotypes.pack_gt({1: 0}, blob)
+    assert genotypes.unpack_gt(blob, 1) == 0 and genotypes.unpack_gt(blob, 5) == 2
+    blob = genotypes.pack_values({0: 12, 2: None}, "int")
+    assert [genotypes.unpack_int(blob, i) for i in range(4)] == [12, None, None, None]
+
+    filename = "examples/test.snpeff.vcf"
+    conn = sql.get_sql_connection(":memory:")
+    import_reader(conn, VcfReader(open(filename)))
+    packed_conn = sql.get_sql_connection(":memory:")
+    for _ in async_import_reader(
+        packed_conn, VcfReader(open(filename)), packed_genotypes=True
+    ):
+        pass
+
+    assert sql.has_packed_genotypes(packed_conn)
+    assert not sql.has_packed_genotypes(conn)
+    assert table_count(packed_conn, "sample_has_variant") == 0
+    assert table_count(packed_conn, "genotypes") == sql.get_variants_count(conn)
+    # Multi-valued fields can't be packed
+    assert "ad" not in [f["name"] for f in sql.get_field_by_category(packed_conn, "samples")]
+
+    fields = [
+        "chr",
+        "pos",
+        ("sample", "TUMOR", "gt"),
+        ("sample", "NORMAL", "dp"),
+        ("sample", "TUMOR", "af"),
+    ]
+    filters = {"AND": [{"field": ("sample", "TUMOR", "gt"), "operator": "=", "value": 1}]}
+    results = []
+    for connection in (conn, packed_conn):
+        query = querybuilder.build_full_sql_query(
+            connection, fields, filters=filters, order_by="pos", limit=None
+        )
+        results.append([tuple(row) for row in connection.execute(query)])
+
+    expected, packed = results
+    assert len(packed) == len(expected) > 0
+    for row, packed_row in zip(expected, packed):
+        assert row[:5] == packed_row[:5]
+        assert packed_row[5] == pytest.approx(row[5])
+
+    query = querybuilder.build_full_sql_query(packed_conn, fields)
+    assert "sample_has_variant" not in query
+
+    variant = sql.get_one_variant(packed_conn, 1, with_samples=True)
+    expected_variant = sql.get_one_variant(conn, 1, with_samples=True)
+    assert [(s["name"], s["gt"], s["dp"]) for s in variant["samples"]] == [
+        (s["name"], s["gt"], s["dp"]) for s in expected_variant["samples"]
+    ]
+
+
+def test_packed_genotypes_join(tmp_path):
+    """Test the queries on a sample appended to packed and unpacked projects
+
+    Unpacked projects drop the variants without data for the sample
+    (INNER JOIN); packed projects return them with missing values.
+    """
+    from cutevariant.core.importer import async_import_reader
+    from cutevariant.core.reader import VcfReader
+    from cutevariant.core import querybuilder
+
+    # New sample for the first variants only
+    lines = open("examples/test.snpeff.vcf").read().splitlines()
+    header = [line for line in lines if line.startswith("#")]
+    records = [line for line in lines if not line.startswith("#")]
+    header[-1] = header[-1].replace("TUMOR", "RELAPSE")
+    filename = str(tmp_path / "relapse.vcf")
+    with open(filename, "w") as file:
+        file.write("\n".join(header + records[:3]) + "\n")
+
+    fields = ["chr", "pos", ("sample", "RELAPSE", "gt")]
+    results = []
+    for packed_genotypes in (False, True):
+        conn = sql.get_sql_connection(":memory:")
+        with open("examples/test.snpeff.vcf") as device:
+            for _ in async_import_reader(
+                conn, VcfReader(device), packed_genotypes=packed_genotypes
+            ):
+                pass
+        with open(filename) as device:
+            for _ in async_import_reader(conn, VcfReader(device), append=True):
+                pass
+
+        # Multi-valued fields keep their types in unpacked projects
+        types = {f["name"]: f["type"] for f in sql.get_field_by_category(conn, "samples")}
+        assert types.get("ad") == (None if packed_genotypes else "int")
+
+        query = querybuilder.build_full_sql_query(conn, fields, limit=None)
+        results.append([tuple(row)[1:] for row in conn.execute(query)])
+        total = sql.get_variants_count(conn)
+
+    unpacked, packed = results
+    assert len(unpacked) == 3
+    assert len(packed) == total > 3
+    assert sorted(row for row in packed if row[2] != -1) == sorted(unpacked)
+
+
+def test_annotation_dictionary():
+    """Test the encoding of annotations against plain annotations"""
+    from cutevariant.core.importer import import_reader, async_import_reader
+    from cutevariant.core.reader import VcfReader
+    from cutevariant.core import querybuilder
+
+    filename = "examples/test.snpeff.vcf"
+    conn = sql.get_sql_connection(":memory:")
+    import_reader(conn, VcfReader(open(filename), "snpeff"))
+    encoded_conn = sql.get_sql_connection(":memory:")
+    for _ in async_import_reader(
+        encoded_conn,
+        VcfReader(open(filename), "snpeff"),
+        batch_size=5,
+        dictionary_threshold=20,
+    ):
+        pass
+
+    # Fields with more than 20 distinct values are no longer encoded
+    fields, threshold = sql.get_annotation_dictionary_settings(encoded_conn)
+    assert threshold == 20
+    assert {"impact", "gene", "consequence"} <= set(fields)
+    assert not {"transcript", "hgvs_c"} & set(fields)
+    assert sql.get_annotation_dictionary_settings(conn) == ([], None)
+    assert {
+        row[0]
+        for row in encoded_conn.execute("SELECT typeof(impact) FROM annotations")
+    } == {"integer"}
+    assert {
+        row[0]
+        for row in encoded_conn.execute("SELECT DISTINCT field FROM annotation_dictionary")
+    } == set(fields)
+
+    fields = ["chr", "pos", "gene", "annotations.impact", "transcript"]
+    filters = {
+        "AND": [
+            {"field": "impact", "operator": "=", "value": "MODIFIER"},
+            {"field": "annotations.gene", "operator": "!=", "value": "CHID1"},
+            {"field": "transcript", "operator": "IS NOT", "value": "NULL"},
+        ]
+    }
+    results = []
+    for connection in (conn, encoded_conn):
+        query = querybuilder.build_full_sql_query(
+            connection, fields, filters=filters, order_by="gene", limit=None
+        )
+        results.append([dict(row) for row in connection.execute(query)])
+    assert results[0] == results[1]
+    assert len(results[0]) > 0
+
+    for field in ("impact", "consequence"):
+        assert sorted(sql.get_field_unique_values(encoded_conn, field)) == sorted(
+            sql.get_field_unique_values(conn, field)
+        )
+    assert list(sql.get_annotations(encoded_conn, 1)) == list(
+        sql.get_annotations(conn, 1)
+    )
+
+
+@pytest.mark.parametrize("fast_parser", [False, True], ids=["pyvcf", "fast"])
+def test_selective_import(fast_parser):
+    """Test the import of a subset of the fields and samples of a file"""
+    from cutevariant.core.importer import async_import_reader
+    from cutevariant.core.reader import VcfReader
+
+    filename = "examples/test.snpeff.vcf"
+    conn = sql.get_sql_connection(":memory:")
+    reader = VcfReader(open(filename), "snpeff", fast_parser=fast_parser)
+    for _ in async_import_reader(
+        conn,
+        reader,
+        include_fields=["dp", "gene", "annotations.impact", "samples.dp"],
+        exclude_samples=["NORMAL"],
+    ):
+        pass
+
+    # Mandatory fields are always imported
+    assert {"chr", "pos", "ref", "alt", "dp"} <= set(
+        sql.get_table_columns(conn, "variants")
+    )
+    assert not {"ac", "af", "fs"} & set(sql.get_table_columns(conn, "variants"))
+    assert {"gene", "impact"} <= set(sql.get_table_columns(conn, "annotations"))
+    assert "consequence" not in sql.get_table_columns(conn, "annotations")
+    assert {"gt", "dp"} <= set(sql.get_table_columns(conn, "sample_has_variant"))
+    assert "gq" not in sql.get_table_columns(conn, "sample_has_variant")
+
+    assert [sample["name"] for sample in sql.get_samples(conn)] == ["TUMOR"]
+    assert sql.get_variants_count(conn) > 0
+    assert conn.execute(
+        "SELECT COUNT(*) FROM annotations WHERE gene IS NOT NULL"
+    ).fetchone()[0]
+    assert conn.execute(
+        "SELECT COUNT(*) FROM sample_has_variant WHERE dp IS NOT NULL"
+    ).fetchone()[0]
+
+
+def test_query_cache(tmp_path):
+    """Test the invalidation and the eviction of cached results"""
+    db_path = str(tmp_path / "test.db")
+    conn = sql.get_sql_connection(db_path)
+    sql.create_table_metadatas(conn)
+    query = "SELECT id FROM variants WHERE  ref = 'A  C'"
+
+    assert sql.get_cached_result(conn, query) is None
+    sql.cache_result(conn, query, [{"id": 1}])
+    assert sql.get_cached_result(conn, query) == [{"id": 1}]
+    assert sql.get_cached_result(conn, sql.normalize_query(query)) == [{"id": 1}]
+    assert sql.get_cached_result(conn, query.replace("A  C", "A C")) is None
+
+    # Persistent
+    conn.close()
+    conn = sql.get_sql_connection(db_path)
+    assert sql.get_cached_result(conn, query) == [{"id": 1}]
+
+    # Writes in other connections are detected
+    other_conn = sql.get_sql_connection(db_path)
+    sql.bump_write_counter(other_conn)
+    other_conn.commit()
+    assert sql.get_write_counter(conn) == 1
+    assert sql.get_cached_result(conn, query) is None
+
+    # Least recently used results are evicted
+    for index in range(3):
+        sql.cache_result(conn, f"SELECT {index}", "x" * 10, max_size=40)
+    sql.get_cached_result(conn, "SELECT 0")
+    sql.cache_result(conn, "SELECT 3", "x" * 10, max_size=40)
+    cache_conn = sql.get_cache_connection(conn)
+    assert [
+        row[0]
+        for row in cache_conn.execute("SELECT query FROM query_cache ORDER BY query")
+    ] == ["SELECT 0", "SELECT 2", "SELECT 3"]
+
+    # Nothing is written in the project
+    assert not table_exists(conn, "query_cache")
+    assert sql.get_cache_path(conn) == db_path + cm.CACHE_STORE_SUFFIX
+
+    # Stores of previous projects are removed
+    conn.close()
+    os.remove(db_path)
+    conn = sql.get_sql_connection(db_path)
+    sql.create_table_metadatas(conn)
+    assert not os.path.exists(db_path + cm.CACHE_STORE_SUFFIX)
+    assert sql.get_cached_result(conn, query) is None
+
+
+@pytest.mark.parametrize(
+    "where, use_index",
+    [
+        ("gene HAS 'hid'", True),
+        ("annotations.gene LIKE '%HID_'", True),
+        ("gene ~ 'CHID'", True),
+        ("gene ~ '^CH'", False),
+        ("hgvs_c HAS '+4g>T'", True),
+        ("hgvs_c HAS 'c.'", False),
+        ("comment HAS 'benign'", True),
+    ],
+)
+def test_fts_indexes(where, use_index):
+    """Test substring searches on full-text indexes against table scans"""
+    from cutevariant.core import querybuilder
+    from cutevariant.core.importer import async_import_reader
+    from cutevariant.core.prefilter import parse_where
+    from cutevariant.core.reader import VcfReader
+
+    results = []
+    for fts_fields in (cm.FTS_FIELDS, None):
+        conn = sql.get_sql_connection(":memory:")
+        for _ in async_import_reader(
+            conn,
+            VcfReader(open("examples/test.snpeff.vcf"), "snpeff"),
+            fts_fields=fts_fields,
+        ):
+            pass
+        # Maintained by triggers
+        sql.update_variant(conn, {"id": 2, "comment": "Likely BENIGN"})
+        sql.update_variant(conn, {"id": 3, "comment": "benign"})
+        sql.update_variant(conn, {"id": 3, "comment": "pathogenic"})
+
+        query = querybuilder.build_full_sql_query(
+            conn, ["chr", "pos", "gene"], filters=parse_where(where), limit=None
+        )
+        results.append((query, {tuple(row) for row in conn.execute(query)}))
+
+    (fts_query, fts_rows), (query, rows) = results
+    assert fts_rows == rows
+    assert rows
+    assert ("fts_" in fts_query) == use_index
+    assert "fts_" not in query
+    if "comment" in where:
+        assert {row[0] for row in rows} == {2}
@@ -165,6 +165,18 @@
         "path": "/home/truc/test.txt",
         "name": "boby",
     },
+    # Test 18 Query plan
+    "EXPLAIN SELECT chr FROM variants WHERE pos > 3": {
+        "cmd": "explain_cmd",
+        "statement": "SELECT chr FROM variants WHERE pos > 3",
+        "profile": False,
+    },
+    # Test 19 Query plan and timings
+    "profile COUNT FROM variants": {
+        "cmd": "explain_cmd",
+        "statement": "COUNT FROM variants",
+        "profile": True,
+    },
 }
 
 